@@ -0,0 +1,109 @@
+"""Dashboard read cost as order history grows: rollups against a full scan.
+
+Grows one orders table through the given sizes (orders spread over the last
+--days days, a few statuses) and at each size rebuilds the rollups, then
+times the /admin/stats summary read from the rollups and the same numbers
+aggregated straight from the orders table. The rollup read should stay flat
+while the scan grows with the table.
+
+    python benchmarks/analytics.py --sizes 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+STATUSES = ["pending"] * 3 + ["paid"] * 5 + ["shipped"] * 6 + ["cancelled"]
+
+SCAN_SUMMARY = """
+SELECT sum(order_date >= :today), sum(CASE WHEN order_date >= :today THEN total_amount END),
+       sum(order_date >= :week), sum(CASE WHEN order_date >= :week THEN total_amount END),
+       sum(order_date >= :month), sum(CASE WHEN order_date >= :month THEN total_amount END),
+       count(*), sum(total_amount)
+FROM orders WHERE status != 'cancelled'
+"""
+
+
+def grow(database: str, start: int, stop: int, days: int, rng):
+    from services.analytics import utcnow
+    now = utcnow()
+    connection = sqlite3.connect(database)
+    connection.executemany(
+        "INSERT INTO orders (id, order_number, user_id, total_amount, order_date, status) VALUES (?, ?, 1, ?, ?, ?)",
+        ((n, f"B{n}", round(rng.uniform(5, 500), 2),
+          (now - timedelta(seconds=rng.uniform(0, days * 86400))).isoformat(sep=" "), rng.choice(STATUSES))
+         for n in range(start + 1, stop + 1)))
+    connection.commit()
+    connection.close()
+
+
+async def timed(call, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await call()
+        samples.append((time.perf_counter() - started) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+async def measure(repeat: int):
+    from sqlalchemy import text
+    from services.analytics import bucket_start, sales_summary, utcnow
+    from settings.database import AsyncSessionLocal
+
+    today = bucket_start(utcnow(), "day")
+    bounds = {"today": today, "week": today - timedelta(days=6), "month": today - timedelta(days=29)}
+    async with AsyncSessionLocal() as db:
+        return {"rollup_ms": await timed(lambda: sales_summary(db), repeat),
+                "scan_ms": await timed(lambda: db.execute(text(SCAN_SUMMARY), bounds), repeat)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--days", type=int, default=365, help="spread orders over this many past days")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix="storeapp-analytics-")
+    os.chdir(workdir.name)
+    database = f"{workdir.name}/analytics.db"
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from services.analytics import rebuild
+    from settings.database import engine
+    from settings.migrations import upgrade
+
+    upgrade()
+
+    rng = random.Random(args.seed)
+    results, seeded = [], 0
+    for size in sorted(args.sizes):
+        grow(database, seeded, size, args.days, rng)
+        seeded = size
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            rollup_rows = rebuild(connection)
+        rebuild_s = round(time.perf_counter() - started, 2)
+        results.append({"orders": size, "rollup_rows": rollup_rows, "rebuild_s": rebuild_s,
+                        **asyncio.run(measure(args.repeat))})
+        print(json.dumps(results[-1]), file=sys.stderr)
+    print(json.dumps({"days": args.days, "repeat": args.repeat, "results": results}, indent=2))
+    sys.stdout.flush()
+    # aiosqlite worker threads can keep the interpreter alive after the loop closes
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
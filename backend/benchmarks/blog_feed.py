@@ -0,0 +1,119 @@
+"""Blog feed: summary rows and compressed bodies against full rows.
+
+Seeds the same blogs (generated text of --words words each) into two fresh
+databases, one with bodies stored plain (COMPRESSED_TEXT_MIN_SIZE=0) and one
+with the default compression, each in its own process. For each it reports
+the database file size, the time to load one feed page through the ORM the
+way GET /blogs does (content deferred) and with the bodies undeferred, as
+the feed used to load them, and the size of the page as serialized with and
+without bodies.
+
+    python benchmarks/blog_feed.py --blogs 20000 --words 800
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SETTINGS = {"plain": "0", "compressed": None}
+
+
+async def page_timings(pages: int, limit: int, blogs: int, rng):
+    from sqlalchemy import select
+    from sqlalchemy.orm import undefer
+    from models.models import Blogs
+    from routers.blogs import BlogPage, BlogResponse
+    from services.cache import serialize
+    from settings.database import AsyncSessionLocal
+
+    timings = {"summary": [], "full": []}
+    sizes = {}
+    for _ in range(pages):
+        cursor = rng.randint(limit, blogs)
+        for name, options in (("summary", ()), ("full", (undefer(Blogs.content),))):
+            async with AsyncSessionLocal() as db:
+                started = time.perf_counter()
+                query = (select(Blogs).options(*options).where(Blogs.id <= cursor)
+                         .order_by(Blogs.created_at.desc(), Blogs.id.desc()).limit(limit))
+                items = (await db.execute(query)).scalars().all()
+                timings[name].append((time.perf_counter() - started) * 1000)
+                if name == "full":
+                    page = {"items": [BlogResponse.model_validate(item) for item in items], "next_cursor": None}
+                    sizes["full_page_bytes"] = len(serialize(page))
+                else:
+                    sizes["summary_page_bytes"] = len(serialize({"items": items, "next_cursor": None}, BlogPage))
+    return {f"{name}_page_ms": round(statistics.median(samples), 3) for name, samples in timings.items()} | sizes
+
+
+def child(args):
+    workdir = tempfile.TemporaryDirectory(prefix="storeapp-blogs-")
+    os.chdir(workdir.name)
+    database = Path(workdir.name) / "blogs.db"
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from models.models import Blogs
+    import models.users  # noqa: F401  (blogs.owner_id references users)
+    from settings.database import SessionLocal, async_engine
+    from settings.migrations import upgrade
+
+    upgrade()
+
+    rng = random.Random(args.seed)
+    words = [f"{rng.choice('bcdfghklmnprstvz')}{rng.choice('aeiou')}{rng.choice('nrstl')}{n}" for n in range(5000)]
+    with SessionLocal() as db:
+        for offset in range(0, args.blogs, 1000):
+            db.add_all(Blogs(title=" ".join(rng.choices(words, k=6)), description=" ".join(rng.choices(words, k=12)),
+                             content=" ".join(rng.choices(words, k=args.words)), author="bench", tags="bench")
+                       for _ in range(offset, min(offset + 1000, args.blogs)))
+            db.commit()
+    with SessionLocal() as db:
+        db.connection().exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    async def run():
+        results = await page_timings(args.pages, args.limit, args.blogs, rng)
+        await async_engine.dispose()
+        return results
+
+    results = {"database_bytes": database.stat().st_size, **asyncio.run(run())}
+    print(json.dumps(results))
+    sys.stdout.flush()
+    # aiosqlite worker threads can keep the interpreter alive after the loop closes
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blogs", type=int, default=20000)
+    parser.add_argument("--words", type=int, default=800, help="words of content per blog")
+    parser.add_argument("--pages", type=int, default=200, help="feed pages loaded per variant")
+    parser.add_argument("--limit", type=int, default=20, help="blogs per page (the route's default)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args)
+        return
+
+    results = {}
+    for name, min_size in SETTINGS.items():
+        env = dict(os.environ)
+        env.pop("COMPRESSED_TEXT_MIN_SIZE", None)
+        if min_size is not None:
+            env["COMPRESSED_TEXT_MIN_SIZE"] = min_size
+        output = subprocess.run([sys.executable, __file__, "--child", *sys.argv[1:]], env=env, capture_output=True,
+                                text=True, check=True).stdout
+        results[name] = json.loads(output.strip().splitlines()[-1])
+    print(json.dumps({"blogs": args.blogs, "words": args.words, "limit": args.limit, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""Bulk product import and streaming export against the per-row paths.
+
+Runs the app in-process against a throwaway database. Import compares one
+POST /products/new_product per row with a single streamed POST
+/products/bulk. Export streams every product through GET /products/export
+and records the Python heap peak (tracemalloc) next to loading the same
+rows with .all(), which is what paging everything into memory amounts to.
+
+    python benchmarks/bulk.py --import-rows 20000 --export-rows 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def ndjson_rows(count: int, start: int = 0):
+    for n in range(start, start + count):
+        yield (json.dumps({"name": f"Product {n}", "description": "Bulk loaded product", "price": 1 + n % 500,
+                           "stock": n % 100}) + "\n").encode()
+
+
+async def import_rows(client, rows: int, single_rows: int, batch_size: int):
+    started = time.perf_counter()
+    for n in range(single_rows):
+        response = await client.post("/products/new_product", json={
+            "name": f"Single {n}", "description": "One row per request", "price": 10, "stock": 1})
+        response.raise_for_status()
+    single = single_rows / (time.perf_counter() - started)
+
+    async def body():
+        # Sent in 64 KB pieces so the server sees a streamed body, not one buffer
+        buffer = b""
+        for line in ndjson_rows(rows):
+            buffer += line
+            if len(buffer) >= 65536:
+                yield buffer
+                buffer = b""
+        if buffer:
+            yield buffer
+
+    started = time.perf_counter()
+    response = await client.post(f"/products/bulk?batch_size={batch_size}", content=body(),
+                                 headers={"content-type": "application/x-ndjson"})
+    response.raise_for_status()
+    elapsed = time.perf_counter() - started
+    report = response.json()
+    return {
+        "single_rows_per_sec": round(single, 1),
+        "bulk_rows_per_sec": round(report["inserted"] / elapsed, 1),
+        "bulk_inserted": report["inserted"],
+        "bulk_failed": report["failed"],
+    }
+
+
+async def export_rows(app, data_format: str):
+    # Drives the ASGI app directly: httpx's ASGITransport buffers whole responses,
+    # which would hide exactly the memory behaviour being measured
+    sent = {"bytes": 0, "lines": 0, "status": None}
+    requested = asyncio.Event()
+
+    async def receive():
+        # The request body once, then block like a client that never disconnects
+        if not requested.is_set():
+            requested.set()
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            sent["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            sent["bytes"] += len(message.get("body", b""))
+            sent["lines"] += message.get("body", b"").count(b"\n")
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": "/products/export", "raw_path": b"/products/export", "root_path": "",
+             "query_string": f"format={data_format}".encode(), "headers": [(b"host", b"bulk")],
+             "client": ("127.0.0.1", 1), "server": ("bulk", 80)}
+    tracemalloc.start()
+    started = time.perf_counter()
+    await app(scope, receive, send)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert sent["status"] == 200, sent
+    return {"rows": sent["lines"], "mb": round(sent["bytes"] / 1048576, 1), "seconds": round(elapsed, 2),
+            "rows_per_sec": round(sent["lines"] / elapsed), "peak_heap_mb": round(peak / 1048576, 1)}
+
+
+async def load_all(session_factory):
+    from sqlalchemy import select
+    from models.models import Products
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    async with session_factory() as db:
+        rows = (await db.execute(select(Products))).scalars().all()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"rows": len(rows), "seconds": round(elapsed, 2), "peak_heap_mb": round(peak / 1048576, 1)}
+
+
+async def run(app, engines, args):
+    from settings.database import AsyncReadSessionLocal
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bulk", timeout=None) as client:
+        results["import"] = await import_rows(client, args.import_rows, args.single_rows, args.batch_size)
+        seed_products(args.database, args.export_rows)
+        for data_format in ("ndjson", "csv"):
+            results[f"export {data_format}"] = await export_rows(app, data_format)
+    results["load everything with .all()"] = await load_all(AsyncReadSessionLocal)
+    for engine in engines:
+        await engine.dispose()
+    return results
+
+
+def seed_products(database: str, total: int):
+    # Tops the table up to `total` rows directly; the import path is measured separately
+    connection = sqlite3.connect(database)
+    existing = connection.execute("SELECT count(*) FROM products").fetchone()[0]
+    connection.executemany(
+        "INSERT INTO products (product_name, description, price, available, quantity) VALUES (?, ?, ?, 1, ?)",
+        ((f"Seeded {n}", "Seeded for the export benchmark", 1 + n % 500, n % 100)
+         for n in range(max(0, total - existing))))
+    connection.commit()
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--import-rows", type=int, default=20000)
+    parser.add_argument("--single-rows", type=int, default=500, help="rows sent one request at a time")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--export-rows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix="storeapp-bulk-")
+    os.chdir(workdir.name)
+    args.database = os.path.join(workdir.name, "bulk.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.database}"
+    # The per-row baseline sends hundreds of writes from one address
+    os.environ["RATE_LIMIT_ENABLED"] = "0"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from main import app
+    from models.users import User
+    from routers.auth import get_current_user
+    from settings.database import SessionLocal, async_engine, async_read_engine
+    from settings.migrations import upgrade
+
+    upgrade()
+    app.dependency_overrides[get_current_user] = lambda: {"username": "admin", "user_id": 1}
+    with SessionLocal() as db:
+        db.add(User(id=1, username="admin", email="admin@example.com", role="admin"))
+        db.commit()
+
+    results = asyncio.run(run(app, (async_engine, async_read_engine), args))
+    print(json.dumps({"import_rows": args.import_rows, "batch_size": args.batch_size,
+                      "export_rows": args.export_rows, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
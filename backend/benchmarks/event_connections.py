@@ -0,0 +1,137 @@
+"""Memory held by idle order-status subscribers, and fan-out latency across them.
+
+Opens N Server-Sent Events or WebSocket connections straight against the ASGI
+app (no sockets, so the numbers are the application's share only), leaves
+them idle, reports RSS and Python heap growth per connection, then publishes
+one event every connection is subscribed to and times until the last one
+has received it.
+
+    python benchmarks/event_connections.py --connections 10000 --transport sse
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * resource.getpagesize()
+
+
+class Connection:
+    # A client that reads everything it is sent and never speaks unless told to leave
+    def __init__(self, transport: str, received_all: asyncio.Event, total: list):
+        self.transport = transport
+        self.leave = asyncio.Event()
+        self.opened = False
+        self.messages = 0
+        self.received_all = received_all
+        self.total = total
+
+    def scope(self):
+        common = {"asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http", "root_path": "",
+                  "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80)}
+        if self.transport == "sse":
+            return {**common, "type": "http", "method": "GET", "path": "/orders/events",
+                    "raw_path": b"/orders/events", "query_string": b""}
+        return {**common, "type": "websocket", "scheme": "ws", "path": "/orders/ws", "raw_path": b"/orders/ws",
+                "query_string": b"", "subprotocols": []}
+
+    async def receive(self):
+        if not self.opened:
+            self.opened = True
+            if self.transport == "sse":
+                return {"type": "http.request", "body": b"", "more_body": False}
+            return {"type": "websocket.connect"}
+        await self.leave.wait()
+        return {"type": "http.disconnect"} if self.transport == "sse" else {"type": "websocket.disconnect", "code": 1000}
+
+    async def send(self, message):
+        body = message.get("body") or message.get("text") or b""
+        if b"order.updated" in (body if isinstance(body, bytes) else body.encode()):
+            self.messages += 1
+            self.total[0] += 1
+            if self.total[0] == self.total[1]:
+                self.received_all.set()
+
+
+async def run(app, count: int, transport: str):
+    from services.events import event_hub, user_orders_topic
+
+    received_all = asyncio.Event()
+    total = [0, count]
+    connections = [Connection(transport, received_all, total) for _ in range(count)]
+
+    gc.collect()
+    rss_before = rss_bytes()
+    tracemalloc.start()
+    heap_before = tracemalloc.get_traced_memory()[0]
+    tasks = [asyncio.create_task(app(conn.scope(), conn.receive, conn.send)) for conn in connections]
+    while event_hub.stats()["subscriptions"] < count:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.5)
+    gc.collect()
+    heap_after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    rss_after = rss_bytes()
+
+    started = time.perf_counter()
+    await event_hub.publish(user_orders_topic(1), {"type": "order.updated", "order_id": 1, "status": "shipped"})
+    await asyncio.wait_for(received_all.wait(), 120)
+    fan_out = time.perf_counter() - started
+
+    for conn in connections:
+        conn.leave.set()
+    await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), 120)
+    return {
+        "connections": count,
+        "rss_mb": round((rss_after - rss_before) / 1048576, 1),
+        "rss_kb_per_connection": round((rss_after - rss_before) / count / 1024, 2),
+        "heap_kb_per_connection": round((heap_after - heap_before) / count / 1024, 2),
+        "fan_out_ms": round(fan_out * 1000, 1),
+        "subscriptions_left": event_hub.stats()["subscriptions"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--transport", choices=("sse", "websocket"), default="sse")
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix="storeapp-events-")
+    os.chdir(workdir.name)
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir.name}/events.db"
+    # No heartbeats during the measurement; the connections are meant to be idle
+    os.environ["EVENT_HEARTBEAT"] = "3600"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from main import app
+    from routers.auth import get_stream_user
+    from settings.database import async_engine, async_read_engine
+    from settings.migrations import upgrade
+
+    upgrade()
+    app.dependency_overrides[get_stream_user] = lambda: {"username": "bench", "user_id": 1}
+
+    async def measure():
+        result = await run(app, args.connections, args.transport)
+        await async_engine.dispose()
+        await async_read_engine.dispose()
+        return result
+
+    print(json.dumps({"transport": args.transport, **asyncio.run(measure())}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
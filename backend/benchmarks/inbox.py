@@ -0,0 +1,144 @@
+"""Notification inbox: unread counts, paging and mark-all-read for a heavy user.
+
+Seeds one user with N notifications (and a crowd of other users' rows so
+the index has to do its job), then times through the app in-process:
+
+- GET /notifications/unread-count, cached and uncached, next to counting
+  unread rows with SELECT count(*)
+- GET /notifications for the first page and a deep page reached by cursor
+- POST /notifications/read-all (moves the read watermark) next to stamping
+  read_at on every unread row with one UPDATE
+
+    python benchmarks/inbox.py --notifications 50000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def seed(database: str, notifications: int, other_users: int):
+    connection = sqlite3.connect(database)
+    connection.executemany("INSERT INTO users (id, username, email, role, is_active) VALUES (?, ?, ?, 'user', 1)",
+                           ((n, f"user{n}", f"user{n}@example.com") for n in range(1, other_users + 2)))
+    # Interleaved like real traffic: the heavy user's rows are spread through the table
+    rows = ((1 if n % 2 == 0 else 2 + n % other_users, "announcement", "Sale", f"Notification {n}")
+            for n in range(notifications * 2))
+    connection.executemany("INSERT INTO notifications (user_id, kind, title, message) VALUES (?, ?, ?, ?)", rows)
+    connection.execute("INSERT INTO notification_counters (user_id, unread_count) "
+                       "SELECT user_id, count(*) FROM notifications GROUP BY user_id")
+    connection.commit()
+    connection.close()
+
+
+def timed(samples):
+    return {"p50_ms": round(statistics.median(samples) * 1000, 3), "max_ms": round(max(samples) * 1000, 3)}
+
+
+async def measure(client, method: str, url: str, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = await client.request(method, url)
+        samples.append(time.perf_counter() - started)
+        response.raise_for_status()
+    return samples, response.json()
+
+
+def direct(database: str, statement: str, repeat: int = 1):
+    samples = []
+    for _ in range(repeat):
+        connection = sqlite3.connect(database)
+        started = time.perf_counter()
+        connection.execute(statement).fetchall()
+        connection.commit()
+        samples.append(time.perf_counter() - started)
+        connection.close()
+    return samples
+
+
+async def run(app, database: str, args):
+    from services.cache import response_cache
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        samples, body = await measure(client, "GET", "/notifications/unread-count", args.repeat)
+        results["unread-count cached"] = {**timed(samples[1:]), "unread": body["unread"]}
+        uncached = []
+        for _ in range(args.repeat):
+            await response_cache.invalidate_items("notifications-unread", [1])
+            sample, _ = await measure(client, "GET", "/notifications/unread-count", 1)
+            uncached += sample
+        results["unread-count uncached"] = timed(uncached)
+        results["SELECT count(*) of unread rows"] = timed(direct(
+            database, "SELECT count(*) FROM notifications WHERE user_id = 1 AND read_at IS NULL", args.repeat))
+
+        samples, body = await measure(client, "GET", "/notifications?limit=20", args.repeat)
+        results["first page"] = timed(samples)
+        deep_cursor = body["items"][-1]["id"] - args.notifications
+        samples, _ = await measure(client, "GET", f"/notifications?limit=20&cursor={deep_cursor}", args.repeat)
+        results["deep page"] = timed(samples)
+
+        # The naive UPDATE runs on a copy so both start from the same unread rows
+        copy = database + ".copy"
+        source, target = sqlite3.connect(database), sqlite3.connect(copy)
+        source.backup(target)
+        source.close()
+        target.close()
+        results["UPDATE read_at on every unread row"] = timed(direct(
+            copy, "UPDATE notifications SET read_at = CURRENT_TIMESTAMP WHERE user_id = 1 AND read_at IS NULL"))
+
+        samples, body = await measure(client, "POST", "/notifications/read-all", 1)
+        results["read-all"] = {**timed(samples), "unread_after": body["unread"]}
+        _, body = await measure(client, "GET", "/notifications/unread-count", 1)
+        results["unread after read-all"] = body["unread"]
+        _, body = await measure(client, "GET", "/notifications?unread=true", 1)
+        results["unread items listed after read-all"] = len(body["items"])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notifications", type=int, default=50000, help="notifications of the heavy user")
+    parser.add_argument("--other-users", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix="storeapp-inbox-")
+    os.chdir(workdir.name)
+    database = os.path.join(workdir.name, "inbox.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{database}"
+    os.environ["NOTIFICATION_WORKERS"] = "0"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from main import app
+    from routers.auth import get_current_user
+    from settings.database import async_engine, async_read_engine
+    from settings.migrations import upgrade
+
+    upgrade()
+    seed(database, args.notifications, args.other_users)
+    app.dependency_overrides[get_current_user] = lambda: {"username": "user1", "user_id": 1}
+
+    async def measure_all():
+        result = await run(app, database, args)
+        await async_engine.dispose()
+        await async_read_engine.dispose()
+        return result
+
+    print(json.dumps({"notifications": args.notifications, "results": asyncio.run(measure_all())}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""A login flood with and without the rate limiter.
+
+Runs the app in-process. A few "attacker" addresses hammer POST /auth/token
+with wrong passwords for a real account, so every attempt costs a bcrypt
+verification, while one legitimate client keeps logging in and reading a
+product from its own address. Each phase reports the legitimate client's
+latencies and how the attackers' requests were answered.
+
+    python benchmarks/limits.py --attackers 8 --duration 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def find_middleware(app, kind):
+    layer = app.middleware_stack
+    while layer is not None and not isinstance(layer, kind):
+        layer = getattr(layer, "app", None)
+    return layer
+
+
+def latency(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {"count": len(samples), "p50_ms": round(statistics.median(ordered) * 1000, 1),
+            "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 1)}
+
+
+async def phase(app, attackers: int, per_attacker: int, duration: float):
+    stop = time.perf_counter() + duration
+    answered = Counter()
+    legit_login, legit_read = [], []
+
+    async def attack(address):
+        transport = httpx.ASGITransport(app=app, client=(address, 40000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def one():
+                while time.perf_counter() < stop:
+                    response = await client.post("/auth/token", data={"username": "victim", "password": "guess"})
+                    answered[response.status_code] += 1
+                    if response.status_code == 429:
+                        # A polite attacker; an impolite one only adds cheap 429s
+                        await asyncio.sleep(0.05)
+            await asyncio.gather(*(one() for _ in range(per_attacker)))
+
+    async def legit():
+        transport = httpx.ASGITransport(app=app, client=("192.0.2.1", 40000))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            while time.perf_counter() < stop:
+                started = time.perf_counter()
+                response = await client.post("/auth/token", data={"username": "victim", "password": "correct horse"})
+                if response.status_code == 200:
+                    legit_login.append(time.perf_counter() - started)
+                for _ in range(5):
+                    started = time.perf_counter()
+                    (await client.get("/products/1")).raise_for_status()
+                    legit_read.append(time.perf_counter() - started)
+                await asyncio.sleep(0.5)
+
+    await asyncio.gather(legit(), *(attack(f"203.0.113.{n + 1}") for n in range(attackers)))
+    return {"legit_login": latency(legit_login), "legit_read": latency(legit_read),
+            "attacker_responses": dict(sorted(answered.items()))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--attackers", type=int, default=8, help="distinct attacking addresses")
+    parser.add_argument("--per-attacker", type=int, default=4, help="concurrent requests per address")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per phase")
+    parser.add_argument("--bcrypt-rounds", type=int, default=10,
+                        help="lower than production so the attackers get through their burst within a phase")
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix="storeapp-limits-")
+    os.chdir(workdir.name)
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir.name}/limits.db"
+    os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from main import app
+    from models.models import Products
+    from models.users import User
+    from services.limits import RateLimitMiddleware
+    from services.passwords import hash_password, password_hasher
+    from settings.database import SessionLocal, async_engine, async_read_engine
+    from settings.migrations import upgrade
+
+    upgrade()
+    with SessionLocal() as db:
+        db.add(User(username="victim", email="victim@example.com", role="user",
+                    hashed_password=hash_password("correct horse")))
+        db.add(Products(product_name="Probe", description="Read during the flood", price=10,
+                        available=True, quantity=5))
+        db.commit()
+
+    async def run():
+        await httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench").get("/products/1")
+        limiter = find_middleware(app, RateLimitMiddleware)
+        results = {}
+        for name, enabled in (("limiter off", False), ("limiter on", True)):
+            limiter.enabled = enabled
+            rejected = password_hasher.rejected
+            results[name] = await phase(app, args.attackers, args.per_attacker, args.duration)
+            results[name]["hash_queue_rejections"] = password_hasher.rejected - rejected
+        password_hasher.shutdown()
+        await async_engine.dispose()
+        await async_read_engine.dispose()
+        return results
+
+    print(json.dumps({"attackers": args.attackers, "per_attacker": args.per_attacker, "duration": args.duration,
+                      "results": asyncio.run(run())}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Requests/sec of one endpoint at several client concurrency levels.
+
+Each app directory is started under uvicorn in a throwaway working directory
+(so it gets its own storeapp.db), seeded, and hammered with concurrent
+clients. Compare two checkouts, e.g. before/after a change:
+
+    git worktree add /tmp/before <commit>
+    python benchmarks/load.py --app before=/tmp/before/backend --app after=.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from models.types import register_sqlite_functions  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed(db_path: Path, products: int, blogs: int):
+    conn = sqlite3.connect(db_path)
+    # The search index triggers on blogs call inflate_text()
+    register_sqlite_functions(conn)
+    conn.executemany(
+        "INSERT INTO products (product_name, description, price, available, quantity, owner_id) VALUES (?, ?, ?, ?, ?, ?)",
+        [(f"Product {i}", "Benchmark product", 100 + i % 900, i % 3 != 0, 100, None) for i in range(products)],
+    )
+    conn.executemany(
+        "INSERT INTO blogs (title, description, content, author, tags) VALUES (?, ?, ?, ?, ?)",
+        [(f"Post {i}", "Benchmark post", "lorem ipsum " * 200, "bench", "bench,load") for i in range(blogs)],
+    )
+    conn.commit()
+    conn.close()
+
+
+class Server:
+    # Plain uvicorn, or the pre-forked launcher (serve.py) when `workers` is given
+    def __init__(self, app_dir: Path, env=None, workers: int | None = None):
+        self.app_dir = app_dir.resolve()
+        self.port = free_port()
+        self.workdir = tempfile.TemporaryDirectory(prefix="storeapp-bench-")
+        self.env = {**os.environ, **(env or {})}
+        self.workers = workers
+        self.process = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        if self.workers is None:
+            command = [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(self.app_dir)]
+        else:
+            command = [sys.executable, str(self.app_dir / "serve.py"), "--workers", str(self.workers),
+                       "--host", "127.0.0.1"]
+        self.process = subprocess.Popen(
+            command + ["--port", str(self.port), "--log-level", "warning", "--no-access-log"],
+            cwd=self.workdir.name, env=self.env,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                httpx.get(self.url + "/docs", timeout=1)
+                return self
+            except httpx.TransportError:
+                time.sleep(0.2)
+        raise RuntimeError(f"server in {self.app_dir} did not start")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            # A server wedged on a blocked event loop never handles SIGTERM
+            self.process.kill()
+            self.process.wait()
+        self.workdir.cleanup()
+
+    @property
+    def db_path(self):
+        return Path(self.workdir.name) / "storeapp.db"
+
+
+async def drive(url: str, path: str, concurrency: int, duration: float, timeout: float = 10.0):
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=timeout) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                except httpx.HTTPError:
+                    # Timeouts count as failures; a stalled server must not hang the run
+                    errors += 1
+                    continue
+                if response.status_code >= 400:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return float("nan")
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", action="append", default=[],
+                        help="label=path to a backend directory (repeatable, default: this checkout)")
+    parser.add_argument("--path", default="/products/1", help="endpoint to request")
+    parser.add_argument("--concurrency", default="1,16,128")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--blogs", type=int, default=200)
+    args = parser.parse_args()
+
+    apps = [app.split("=", 1) if "=" in app else (app, app) for app in args.app] or [("current", str(BACKEND_DIR))]
+    levels = [int(level) for level in args.concurrency.split(",")]
+    # Disable the response cache so the numbers reflect the database path
+    env = {"CACHE_TTL": "0"}
+
+    report = {}
+    for label, app_dir in apps:
+        with Server(Path(app_dir), env=env) as server:
+            seed(server.db_path, args.products, args.blogs)
+            report[label] = [asyncio.run(drive(server.url, args.path, level, args.duration)) for level in levels]
+
+    print(json.dumps({"path": args.path, "results": report}, indent=2))
+    for label, rows in report.items():
+        print(f"\n{label}")
+        for row in rows:
+            print(f"  c={row['concurrency']:>4}  {row['rps']:>9.1f} req/s  p50 {row['p50_ms']:>8.2f} ms  p99 {row['p99_ms']:>8.2f} ms  errors {row['errors']}")
+
+
+if __name__ == "__main__":
+    main()
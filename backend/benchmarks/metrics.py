@@ -0,0 +1,164 @@
+"""Overhead of request and database metrics, with a confidence interval.
+
+One process seeds a fresh database and sends requests straight to the ASGI
+app (no sockets, no HTTP client), so the comparison covers only what the
+application does per request. Each round times a block of requests with the
+metrics switched off and a block with them on, in alternating order so drift
+on the machine hits both sides equally; switching happens in place (the
+middleware's flag, the wrappers instrument_engine puts on the dialect and the
+pool), so both sides share the same process, caches and memory layout. CPU
+rather than wall time: on a shared machine wall time varies more than the
+overhead does.
+
+Per round the overhead is on / off - 1; the report gives its median over the
+rounds with a 95% confidence interval, and the exit status is 1 when the
+upper end of any interval reaches --limit percent. Many short rounds beat a
+few long ones here: a burst of load elsewhere spoils single rounds, which the
+median shrugs off, rather than shifting a long block on one side. Workloads: a cached
+GET /products/{id}, the cheapest request there is and so the worst case for
+relative overhead, and an uncached GET /search/suggest that runs queries.
+
+    python benchmarks/metrics.py --requests 100 --rounds 300
+"""
+import argparse
+import asyncio
+import gc
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+WORKLOADS = {"cached product": ("/products/1", b""), "search suggest": ("/search/suggest", b"q=probe")}
+
+
+async def drive(app, path: str, query: bytes, count: int, concurrency: int):
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": path, "raw_path": path.encode(), "query_string": query, "root_path": "",
+             "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80)}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def worker(share: int):
+        for _ in range(share):
+            statuses = []
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    statuses.append(message["status"])
+            await app(dict(scope), receive, send)
+            if statuses != [200]:
+                raise RuntimeError(f"{path} answered {statuses}")
+
+    started = time.process_time()
+    await asyncio.gather(*(worker(count // concurrency) for _ in range(concurrency)))
+    return (time.process_time() - started) / (count // concurrency * concurrency)
+
+
+class Instrumentation:
+    # Takes off and puts back what MetricsMiddleware and instrument_engine add, without rebuilding anything
+    def __init__(self):
+        from services import metrics
+
+        self.middlewares = list(metrics._middlewares)
+        self.wrapped = []
+        for engine in metrics._pools.values():
+            for method in metrics.EXECUTE_METHODS:
+                self.wrapped.append((engine.dialect, method, vars(engine.dialect)[method]))
+            self.wrapped.append((engine.pool, "_do_get", vars(engine.pool)["_do_get"]))
+        if not self.middlewares or not self.wrapped:
+            raise RuntimeError("metrics are not enabled; unset METRICS_ENABLED=0")
+        self.enabled = True
+
+    def set(self, enabled: bool):
+        if enabled == self.enabled:
+            return
+        self.enabled = enabled
+        for middleware in self.middlewares:
+            middleware.enabled = enabled
+        for owner, name, wrapper in self.wrapped:
+            if enabled:
+                setattr(owner, name, wrapper)
+            else:
+                # The class's own method shows through again
+                delattr(owner, name)
+
+
+def summarize(off: list, on: list):
+    # Median of the per-round overheads with its distribution-free 95% interval (sign test, normal
+    # approximation): a burst of load on the machine moves a few rounds, not the interval
+    overheads = sorted((b - a) / a * 100 for a, b in zip(off, on))
+    rank = max(0, math.floor(len(overheads) / 2 - 0.98 * math.sqrt(len(overheads))))
+    return {"cpu_us_per_request_off": round(statistics.median(off) * 1e6, 1),
+            "cpu_us_per_request_on": round(statistics.median(on) * 1e6, 1),
+            "overhead_percent": round(statistics.median(overheads), 2),
+            "overhead_percent_ci95": [round(overheads[rank], 2), round(overheads[-1 - rank], 2)]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100, help="requests per block")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=300, help="pairs of blocks per workload, at least 20")
+    parser.add_argument("--limit", type=float, default=2.0, help="largest acceptable overhead, in percent")
+    args = parser.parse_args()
+    if args.rounds < 20:
+        parser.error("--rounds must be at least 20")
+
+    workdir = tempfile.TemporaryDirectory(prefix="storeapp-metrics-")
+    os.chdir(workdir.name)
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir.name}/metrics.db"
+    os.environ["METRICS_ENABLED"] = "1"
+    os.environ["NOTIFICATION_WORKERS"] = "0"
+    os.environ["RATE_LIMIT_ENABLED"] = "0"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from main import app
+    from models.models import Products
+    from settings.database import SessionLocal, async_engine, async_read_engine
+    from settings.migrations import upgrade
+
+    upgrade()
+    with SessionLocal() as db:
+        db.add_all(Products(product_name=f"Probe {n}", description="Metrics probe", price=10, available=True,
+                            quantity=5) for n in range(200))
+        db.commit()
+
+    async def run():
+        results = {}
+        for name, (path, query) in WORKLOADS.items():
+            # Warm up caches, pools and the route table first; the middleware stack is built on the first request
+            await drive(app, path, query, args.requests, args.concurrency)
+            instrumentation = Instrumentation()
+            # Everything alive now is left out of later collections, which then cost the same in every block
+            gc.collect()
+            gc.freeze()
+            timings = {False: [], True: []}
+            for round_number in range(args.rounds):
+                for enabled in ((False, True) if round_number % 2 == 0 else (True, False)):
+                    instrumentation.set(enabled)
+                    timings[enabled].append(await drive(app, path, query, args.requests, args.concurrency))
+            instrumentation.set(True)
+            gc.unfreeze()
+            results[name] = summarize(timings[False], timings[True])
+            print(json.dumps({"workload": name, **results[name]}), file=sys.stderr)
+        await async_engine.dispose()
+        await async_read_engine.dispose()
+        return results
+
+    results = asyncio.run(run())
+    passed = all(result["overhead_percent_ci95"][1] < args.limit for result in results.values())
+    print(json.dumps({"requests": args.requests, "concurrency": args.concurrency, "rounds": args.rounds,
+                      "limit_percent": args.limit, "passed": passed, "results": results}, indent=2))
+    sys.stdout.flush()
+    # aiosqlite worker threads can keep the interpreter alive after the loop closes
+    os._exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
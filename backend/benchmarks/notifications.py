@@ -0,0 +1,183 @@
+"""Broadcast fan-out to N users through the notification outbox and workers.
+
+Seeds N users, starts the app in-process with its notification workers, and
+points the email channel at a local SMTP sink running in its own process.
+Reports how long POST /notifications/broadcast takes to answer, how long the
+workers take to expand the broadcast and to deliver every in-app and email
+notification, and the latency of an ordinary GET request sampled while all
+of that is going on. --fail-rate makes the sink answer 451 to that share of
+recipients so retries show up in the numbers.
+
+    python benchmarks/notifications.py --users 100000 --workers 2
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def run_sink(port, delivered, fail_rate: float):
+    # Just enough SMTP for smtplib: accepts every message, or temporarily refuses a share of recipients
+    async def handle(reader, writer):
+        writer.write(b"220 sink\r\n")
+        in_data = False
+        while line := await reader.readline():
+            if in_data:
+                if line == b".\r\n":
+                    in_data = False
+                    delivered.value += 1
+                    writer.write(b"250 queued\r\n")
+                continue
+            command = line[:4].upper()
+            if command == b"RCPT" and random.random() < fail_rate:
+                writer.write(b"451 try again later\r\n")
+            elif command == b"DATA":
+                in_data = True
+                writer.write(b"354 end with .\r\n")
+            elif command == b"QUIT":
+                writer.write(b"221 bye\r\n")
+                break
+            else:
+                writer.write(b"250 ok\r\n")
+            await writer.drain()
+        await writer.drain()
+        writer.close()
+
+    async def serve():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port.value = server.sockets[0].getsockname()[1]
+        await server.serve_forever()
+
+    asyncio.run(serve())
+
+
+def seed_users(database: str, total: int):
+    connection = sqlite3.connect(database)
+    connection.execute("INSERT INTO users (id, username, email, role, is_active) "
+                       "VALUES (1, 'admin', 'admin@example.com', 'admin', 1)")
+    connection.executemany("INSERT INTO users (username, email, role, is_active) VALUES (?, ?, 'user', 1)",
+                           ((f"user{n}", f"user{n}@example.com") for n in range(total - 1)))
+    connection.execute("INSERT INTO products (product_name, description, price, available, quantity) "
+                       "VALUES ('Probe', 'Requested during the fan-out', 10, 1, 5)")
+    connection.commit()
+    connection.close()
+
+
+def percentile(samples, fraction: float):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(app, args, delivered):
+    from services.notifications import notification_worker, outbox_stats
+    from settings.database import AsyncReadSessionLocal
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await notification_worker.start()
+        started = time.perf_counter()
+        response = await client.post("/notifications/broadcast",
+                                     json={"title": "Sale", "message": "Everything is 20% off"})
+        accepted = time.perf_counter() - started
+        response.raise_for_status()
+        broadcast_id = response.json()["id"]
+
+        expanded = finished = None
+        probe = []
+        expected = args.users * 2
+        while finished is None:
+            sampled = time.perf_counter()
+            (await client.get("/products/1")).raise_for_status()
+            probe.append(time.perf_counter() - sampled)
+            await asyncio.sleep(0.05)
+            if expanded is None:
+                progress = (await client.get(f"/notifications/broadcast/{broadcast_id}")).json()
+                if progress["status"] == "sent":
+                    expanded = time.perf_counter() - started
+            if expanded is not None and len(probe) % 10 == 0:
+                async with AsyncReadSessionLocal() as db:
+                    stats = await outbox_stats(db)
+                done = sum(count for channel, counts in stats.items() if channel != "broadcast"
+                           for status, count in counts.items() if status in ("sent", "dead"))
+                if done >= expected:
+                    finished = time.perf_counter() - started
+        await notification_worker.stop()
+
+    return {
+        "broadcast_accepted_ms": round(accepted * 1000, 1),
+        "expanded_seconds": round(expanded, 2),
+        "delivered_seconds": round(finished, 2),
+        "deliveries_per_sec": round(expected / finished),
+        "emails_received": delivered.value,
+        "outbox": stats,
+        "worker": notification_worker.stats(),
+        "probe_requests": len(probe),
+        "probe_p50_ms": round(statistics.median(probe) * 1000, 1),
+        "probe_p99_ms": round(percentile(probe, 0.99) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of recipients the sink defers with 451")
+    args = parser.parse_args()
+
+    port = multiprocessing.Value("i", 0)
+    delivered = multiprocessing.Value("i", 0)
+    sink = multiprocessing.Process(target=run_sink, args=(port, delivered, args.fail_rate), daemon=True)
+    sink.start()
+    while not port.value:
+        time.sleep(0.01)
+
+    workdir = tempfile.TemporaryDirectory(prefix="storeapp-notifications-")
+    os.chdir(workdir.name)
+    database = os.path.join(workdir.name, "notifications.db")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{database}",
+        "NOTIFICATION_EMAIL_URL": f"smtp://127.0.0.1:{port.value}",
+        "NOTIFICATION_WORKERS": str(args.workers),
+        "NOTIFICATION_BATCH_SIZE": str(args.batch_size),
+        # Retries come back within the run instead of minutes later
+        "NOTIFICATION_RETRY_BASE": "0.2",
+        "NOTIFICATION_RETRY_MAX": "2",
+    })
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from main import app
+    from routers.auth import get_current_user
+    from settings.database import async_engine, async_read_engine
+    from settings.migrations import upgrade
+
+    upgrade()
+    seed_users(database, args.users)
+    app.dependency_overrides[get_current_user] = lambda: {"username": "admin", "user_id": 1}
+
+    async def measure():
+        result = await run(app, args, delivered)
+        await async_engine.dispose()
+        await async_read_engine.dispose()
+        return result
+
+    results = asyncio.run(measure())
+    sink.terminate()
+    print(json.dumps({"users": args.users, "workers": args.workers, "batch_size": args.batch_size,
+                      "fail_rate": args.fail_rate, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
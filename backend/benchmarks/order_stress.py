@@ -0,0 +1,117 @@
+"""Fire thousands of concurrent checkouts at one low-stock product.
+
+Runs the app in-process against a throwaway database and checks the
+invariants the checkout path must hold under contention: stock never goes
+negative, every unit sold belongs to exactly one order, and nothing beyond
+the initial stock is sold. Exits non-zero if any invariant breaks.
+
+    python benchmarks/order_stress.py --orders 5000 --stock 250 --concurrency 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+async def stress(app, engine, orders: int, concurrency: int, users: int):
+    statuses = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://stress") as client:
+        async def checkout(n):
+            async with semaphore:
+                response = await client.post(
+                    "/orders/create_order",
+                    json={"items": [{"product_id": 1, "quantity": 1}], "shipping_address": "1 Stress Street"},
+                    headers={"X-User": str(1 + n % users), "Idempotency-Key": f"order-{n}"},
+                )
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(checkout(n) for n in range(orders)))
+        elapsed = time.perf_counter() - started
+    # Pooled aiosqlite connections own threads that would keep the interpreter alive
+    await engine.dispose()
+    return statuses, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--stock", type=int, default=250)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--users", type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix="storeapp-stress-")
+    os.chdir(workdir.name)
+    # Every checkout comes from one client address; the limiter would turn most of them into 429s
+    os.environ["RATE_LIMIT_ENABLED"] = "0"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from fastapi import Request
+    from sqlalchemy import func, select
+    from main import app
+    from models.models import OrderItems, Orders, Products
+    from models.users import User
+    from routers.auth import get_current_user
+    from settings.database import SessionLocal, async_engine
+    from settings.migrations import upgrade
+
+    upgrade()
+    # Skip JWT handling; the stress target is the checkout transaction
+    def stress_user(request: Request):
+        return {"username": "stress", "user_id": int(request.headers["X-User"])}
+    app.dependency_overrides[get_current_user] = stress_user
+
+    with SessionLocal() as db:
+        db.add_all(User(username=f"stress{n}", email=f"stress{n}@example.com", role="customer")
+                   for n in range(1, args.users + 1))
+        db.add(Products(product_name="Limited", description="Low stock", price=10,
+                        available=True, quantity=args.stock))
+        db.commit()
+
+    statuses, elapsed = asyncio.run(stress(app, async_engine, args.orders, args.concurrency, args.users))
+
+    with SessionLocal() as db:
+        remaining = db.get(Products, 1).quantity
+        orders = db.scalar(select(func.count()).select_from(Orders))
+        sold = db.scalar(select(func.coalesce(func.sum(OrderItems.quantity), 0)))
+
+    report = {
+        "orders_attempted": args.orders,
+        "concurrency": args.concurrency,
+        "initial_stock": args.stock,
+        "statuses": statuses,
+        "orders_created": orders,
+        "units_sold": sold,
+        "stock_remaining": remaining,
+        "seconds": round(elapsed, 3),
+        "orders_per_sec": round(args.orders / elapsed, 1),
+    }
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if remaining < 0:
+        failures.append("stock went negative")
+    if sold + remaining != args.stock:
+        failures.append("units sold plus remaining stock does not equal the initial stock")
+    if orders != statuses.get(201, 0):
+        failures.append("created orders do not match successful responses")
+    if failures:
+        print("FAILED: " + "; ".join(failures), file=sys.stderr)
+        sys.exit(1)
+    print("OK: no overselling")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Statement budgets of the main endpoints.
+
+Seeds a fresh SQLite database, sends each request below straight to the ASGI
+app inside services.querylog.assert_query_budget, and reports how many
+statements it ran against its budget. Requests go in-process on the same
+task, so the budget sees the statements of the request and of nothing else
+(background workers poll on their own). Any request over its budget, or
+running the same statement shape N_PLUS_ONE_THRESHOLD times, fails the run
+with the statements listed; the exit status is 1 then, so CI can run it:
+
+    python benchmarks/query_budgets.py
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+SEED_ROWS = 30
+
+# (method, path, JSON body, budget); the budgets are what each request runs today, with the caches cold
+REQUESTS = [
+    ("GET", "/products", None, 1),
+    ("GET", "/products/1", None, 1),
+    ("GET", "/blogs", None, 1),
+    ("GET", "/blogs/1", None, 1),
+    ("GET", "/blogs/tags", None, 1),
+    ("GET", "/orders", None, 3),
+    ("GET", "/orders/1", None, 2),
+    ("POST", "/orders/create_order", {"items": [{"product_id": 2, "quantity": 1}, {"product_id": 3, "quantity": 2}],
+                                      "shipping_address": "Budget street 1"}, 10),
+    ("GET", "/notifications", None, 2),
+    ("GET", "/notifications/unread-count", None, 1),
+    ("GET", "/users/me", None, 1),
+    ("GET", "/admin/stats", None, 6),
+    ("GET", "/search?q=probe", None, 2),
+]
+
+
+def seed():
+    from models.models import Blogs, Notifications, OrderItems, Orders, Products
+    from models.users import User
+    from settings.database import SessionLocal
+
+    with SessionLocal() as db:
+        db.add(User(id=1, username="budget", email="budget@example.com", first_name="Budget", last_name="Probe",
+                    hashed_password="-", is_active=True, role="admin"))
+        db.add_all(Products(product_name=f"Probe {n}", description="Budget probe", price=10, available=True,
+                            quantity=100, owner_id=1) for n in range(SEED_ROWS))
+        db.add_all(Blogs(title=f"Probe {n}", description="Budget probe", content="Budget probe body " * 20,
+                         author="Budget", tags="probe, budget", owner_id=1) for n in range(SEED_ROWS))
+        db.add_all(Notifications(user_id=1, kind="probe", message=f"Probe {n}") for n in range(SEED_ROWS))
+        db.flush()
+        for n in range(SEED_ROWS):
+            order = Orders(order_number=f"BUDGET-{n}", user_id=1, total_amount=20, status="pending",
+                           shipping_address="Budget street 1", shipping_cost=0)
+            db.add(order)
+            db.flush()
+            db.add_all(OrderItems(order_id=order.id, product_id=item, quantity=1, unit_price=10) for item in (1, 2))
+        db.commit()
+
+
+async def check(app, headers: dict):
+    import httpx
+    from services.querylog import assert_query_budget
+
+    results, failed = [], False
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://budget",
+                                 headers=headers) as client:
+        for method, path, body, budget in REQUESTS:
+            result = {"request": f"{method} {path}", "budget": budget}
+            try:
+                with assert_query_budget(budget) as trace:
+                    response = await client.request(method, path, json=body)
+                result["ok"] = response.is_success
+                if not response.is_success:
+                    result["error"] = f"{response.status_code} {response.text[:200]}"
+            except AssertionError as exc:
+                result["ok"], result["error"] = False, str(exc)
+            result["queries"] = len(trace.statements)
+            failed |= not result["ok"]
+            results.append(result)
+    return results, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix="storeapp-budgets-")
+    os.chdir(workdir.name)
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir.name}/budgets.db"
+    os.environ["NOTIFICATION_WORKERS"] = "0"
+    os.environ["RATE_LIMIT_ENABLED"] = "0"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from main import app
+    from routers.auth import create_access_token
+    from settings.database import async_engine, async_read_engine
+    from settings.migrations import upgrade
+
+    upgrade()
+    seed()
+    headers = {"Authorization": f"Bearer {create_access_token('budget', 1, timedelta(minutes=30))}"}
+
+    async def run():
+        try:
+            return await check(app, headers)
+        finally:
+            await async_engine.dispose()
+            await async_read_engine.dispose()
+
+    results, failed = asyncio.run(run())
+    print(json.dumps({"results": results}, indent=2))
+    sys.stdout.flush()
+    # aiosqlite worker threads can keep the interpreter alive after the loop closes
+    os._exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Search latency on a synthetic corpus.
+
+Seeds blogs and products with Zipf-distributed words (the FTS5 triggers index
+every row as it is inserted, tags are normalised afterwards), then runs services.search queries from several
+frequency bands and reports p50/p95/p99 per query class.
+
+    python benchmarks/search.py --docs 500000 --queries 200
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from settings.database import create_async_db_engine, create_db_engine  # noqa: E402
+from settings.migrations import upgrade  # noqa: E402
+from services.search import search, tag_facets  # noqa: E402
+from services.tags import backfill_blog_tags  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession  # noqa: E402
+
+VOCABULARY_SIZE = 50000
+TAGS = [f"tag{n}" for n in range(200)]
+SEED_BATCH = 5000
+
+
+def make_vocabulary(rng: random.Random):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(3, 10))))
+    words = sorted(words)
+    rng.shuffle(words)
+    # Rank-frequency weights 1/rank, so a few words are everywhere and most are rare
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, len(words) + 1)))
+    return words, weights
+
+
+def seed(url: str, docs: int, vocabulary, cum_weights, rng: random.Random):
+    engine = create_db_engine(url)
+    upgrade(engine)
+
+    def text_of(count):
+        return " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=count))
+
+    blogs = int(docs * 0.8)
+    started = time.perf_counter()
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        for offset in range(0, docs, SEED_BATCH):
+            batch = range(offset, min(offset + SEED_BATCH, docs))
+            blog_rows = [(text_of(6), text_of(15), text_of(80), "me", ", ".join(rng.sample(TAGS, 3)))
+                         for n in batch if n < blogs]
+            product_rows = [(text_of(4), text_of(25), 10, 1, 100) for n in batch if n >= blogs]
+            cursor.executemany("INSERT INTO blogs (title, description, content, author, tags) VALUES (?, ?, ?, ?, ?)",
+                               blog_rows)
+            cursor.executemany("INSERT INTO products (product_name, description, price, available, quantity) "
+                               "VALUES (?, ?, ?, ?, ?)", product_rows)
+            raw.commit()
+        cursor.execute("INSERT INTO blogs_fts(blogs_fts) VALUES ('optimize')")
+        cursor.execute("INSERT INTO products_fts(products_fts) VALUES ('optimize')")
+        raw.commit()
+    finally:
+        raw.close()
+    with engine.begin() as connection:
+        backfill_blog_tags(connection)
+    engine.dispose()
+    return time.perf_counter() - started
+
+
+def query_classes(vocabulary, rng: random.Random, count: int):
+    common, mid, rare = vocabulary[:50], vocabulary[500:5000], vocabulary[20000:]
+    return {
+        "common term": [rng.choice(common) for _ in range(count)],
+        "mid term": [rng.choice(mid) for _ in range(count)],
+        "rare term": [rng.choice(rare) for _ in range(count)],
+        "two terms": [f"{rng.choice(common)} {rng.choice(mid)}" for _ in range(count)],
+        "typeahead (3 chars)": [rng.choice(mid)[:3] for _ in range(count)],
+    }
+
+
+def percentile(samples, fraction):
+    return round(samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000, 2)
+
+
+async def measure(url: str, classes, facets: bool):
+    engine = create_async_db_engine(url, read_only=True)
+    results = {}
+    try:
+        async with AsyncSession(engine) as db:
+            for name, queries in classes.items():
+                timings = []
+                for query in queries:
+                    prefix = name.startswith("typeahead")
+                    started = time.perf_counter()
+                    await search(db, query, limit=20, prefix=prefix)
+                    if facets:
+                        await tag_facets(db, query, prefix=prefix)
+                    timings.append(time.perf_counter() - started)
+                timings.sort()
+                results[name] = {"p50_ms": percentile(timings, 0.50), "p95_ms": percentile(timings, 0.95),
+                                 "p99_ms": percentile(timings, 0.99)}
+    finally:
+        await engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=500000)
+    parser.add_argument("--queries", type=int, default=200, help="queries per class")
+    parser.add_argument("--facets", action="store_true", help="also compute tag facets for each query")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary, cum_weights = make_vocabulary(rng)
+    with tempfile.TemporaryDirectory(prefix="storeapp-search-") as workdir:
+        url = f"sqlite:///{workdir}/search.db"
+        seconds = seed(url, args.docs, vocabulary, cum_weights, rng)
+        size_mb = Path(workdir, "search.db").stat().st_size / (1024 * 1024)
+        results = asyncio.run(measure(url, query_classes(vocabulary, rng, args.queries), args.facets))
+
+    print(json.dumps({"docs": args.docs, "seed_docs_per_sec": round(args.docs / seconds),
+                      "db_mb": round(size_mb, 1), "facets": args.facets, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Serialization cost and bytes on the wire of the product and blog listings.
+
+Builds one listing page of each (product rows as the projected dicts the
+route loads, blogs as ORM objects with a few KB of generated text) and
+times, per row:
+
+- before: jsonable_encoder followed by json.dumps, the path every response
+  used to take
+- after: what services.cache.serialize does now, orjson for the product
+  dicts and the Pydantic response model dumped by pydantic-core for blogs
+
+Then reports the body size as sent plainly, gzip- and (when the brotli
+package is installed) br-compressed, at the per-request levels of the
+compression middleware and at the levels used for cached entries, with the
+CPU time each compression takes.
+
+    python benchmarks/serialization.py --products 200 --blogs 100
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from models.models import Blogs  # noqa: E402
+from routers.blogs import BlogPage  # noqa: E402
+from services.cache import serialize  # noqa: E402
+from services.compression import ENCODINGS, LEVELS, PRECOMPRESS_LEVELS, compress  # noqa: E402
+
+WORDS = ("order shipping product stock price blog review customer update delivery return cart checkout payment "
+         "account image profile search tag summary warehouse supplier discount season release guide").split()
+
+
+def text(rng, words: int):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def product_page(rng, rows: int):
+    items = [{"id": n, "product_name": f"Product {n} {text(rng, 2)}", "description": text(rng, 25),
+              "price": rng.choice((rng.randint(1, 500), round(rng.uniform(1, 500), 2))), "available": True,
+              "quantity": rng.randint(0, 500), "owner_id": rng.randint(1, 50)} for n in range(1, rows + 1)]
+    return {"items": items, "next_cursor": rows}
+
+
+def blog_page(rng, rows: int, words: int):
+    created = datetime(2026, 1, 1)
+    items = [Blogs(id=n, title=text(rng, 6), description=text(rng, 12), content=text(rng, words), author="author",
+                   tags=",".join(rng.sample(WORDS, 3)), owner_id=rng.randint(1, 50),
+                   created_at=created + timedelta(minutes=n), updated_at=created + timedelta(minutes=n))
+             for n in range(rows, 0, -1)]
+    return {"items": items, "next_cursor": 1}
+
+
+def before(payload, model=None):
+    return json.dumps(jsonable_encoder(payload), separators=(",", ":")).encode()
+
+
+def per_row_us(function, payload, model, rows: int, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.process_time()
+        function(payload, model)
+        samples.append(time.process_time() - started)
+    return round(min(samples) / rows * 1e6, 2)
+
+
+def compression_report(body: bytes, repeat: int):
+    report = {"identity_bytes": len(body)}
+    for name, levels in (("request", LEVELS), ("cached", PRECOMPRESS_LEVELS)):
+        for encoding in ENCODINGS:
+            samples = []
+            for _ in range(repeat):
+                started = time.process_time()
+                encoded = compress(body, encoding, levels)
+                samples.append(time.process_time() - started)
+            report[f"{encoding}_{name}_bytes"] = len(encoded)
+            report[f"{encoding}_{name}_us"] = round(min(samples) * 1e6, 1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=200, help="rows per product page (the route allows 200)")
+    parser.add_argument("--blogs", type=int, default=100, help="rows per blog page (the route allows 100)")
+    parser.add_argument("--words", type=int, default=600, help="words of content per blog")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    listings = {"products": (product_page(rng, args.products), None, args.products),
+                "blogs": (blog_page(rng, args.blogs, args.words), BlogPage, args.blogs)}
+    results = {}
+    for name, (payload, model, rows) in listings.items():
+        old, new = before(payload), serialize(payload, model)
+        if json.loads(old) != json.loads(new):
+            raise SystemExit(f"{name}: serialized bodies differ")
+        before_us = per_row_us(before, payload, model, rows, args.repeat)
+        after_us = per_row_us(serialize, payload, model, rows, args.repeat)
+        results[name] = {"rows": rows, "before_us_per_row": before_us, "after_us_per_row": after_us,
+                         "speedup": round(before_us / after_us, 1), **compression_report(new, args.repeat // 5 or 1)}
+    print(json.dumps({"encodings": list(ENCODINGS), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Mixed read/write throughput of SQLite under different engine profiles.
+
+Reader threads fetch random products by id and by a short id range while
+writer threads commit single-row stock updates, all through engines built by
+settings.database.create_db_engine with the pragmas of each profile.
+
+    python benchmarks/sqlite_profiles.py --readers 8 --writers 2 --duration 10
+"""
+import argparse
+import json
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from sqlalchemy import text  # noqa: E402
+from settings.database import SQLITE_PRAGMAS, create_db_engine  # noqa: E402
+
+STOCK_SQLITE = {"journal_mode": "DELETE", "synchronous": "FULL", "busy_timeout": 5000,
+                "cache_size": -2000, "mmap_size": 0, "temp_store": "DEFAULT"}
+
+PROFILES = {
+    "stock (rollback journal, FULL)": STOCK_SQLITE,
+    "wal": {**STOCK_SQLITE, "journal_mode": "WAL"},
+    "wal + synchronous=NORMAL": {**STOCK_SQLITE, "journal_mode": "WAL", "synchronous": "NORMAL"},
+    "tuned (settings default)": SQLITE_PRAGMAS,
+}
+
+
+def seed(url: str, rows: int):
+    engine = create_db_engine(url, pragmas=STOCK_SQLITE)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE products (id INTEGER PRIMARY KEY, product_name VARCHAR, "
+                          "description VARCHAR, price INTEGER, available BOOLEAN, quantity INTEGER, owner_id INTEGER)"))
+        conn.execute(text("INSERT INTO products (product_name, description, price, available, quantity) "
+                          "VALUES (:name, :description, :price, 1, 1000)"),
+                     [{"name": f"Product {i}", "description": "x" * 200, "price": i % 1000} for i in range(rows)])
+    engine.dispose()
+
+
+def run_profile(url: str, pragmas: dict, rows: int, readers: int, writers: int, duration: float):
+    engine = create_db_engine(url, pragmas=pragmas, pool_size=readers + writers, max_overflow=0)
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def reader():
+        done = 0
+        with engine.connect() as conn:
+            while time.perf_counter() < deadline:
+                start = random.randint(1, rows)
+                conn.execute(text("SELECT * FROM products WHERE id = :id"), {"id": start}).fetchall()
+                conn.execute(text("SELECT id, price FROM products WHERE id >= :id ORDER BY id LIMIT 20"),
+                             {"id": start}).fetchall()
+                conn.rollback()
+                done += 1
+        with lock:
+            counts["reads"] += done
+
+    def writer():
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text("UPDATE products SET quantity = quantity - 1 WHERE id = :id"),
+                                 {"id": random.randint(1, rows)})
+                done += 1
+            except Exception:
+                errors += 1
+        with lock:
+            counts["writes"] += done
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads += [threading.Thread(target=writer) for _ in range(writers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+    return {
+        "reads_per_sec": round(counts["reads"] / elapsed, 1),
+        "writes_per_sec": round(counts["writes"] / elapsed, 1),
+        "write_errors": counts["errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    results = {}
+    for name, pragmas in PROFILES.items():
+        # A fresh file per profile; journal_mode=WAL persists in the database file
+        with tempfile.TemporaryDirectory(prefix="storeapp-sqlite-") as workdir:
+            url = f"sqlite:///{workdir}/bench.db"
+            seed(url, args.rows)
+            results[name] = run_profile(url, pragmas, args.rows, args.readers, args.writers, args.duration)
+
+    print(json.dumps({"readers": args.readers, "writers": args.writers, "results": results}, indent=2))
+    for name, row in results.items():
+        print(f"{name:<32} {row['reads_per_sec']:>10.1f} reads/s {row['writes_per_sec']:>9.1f} writes/s  errors {row['write_errors']}")
+
+
+if __name__ == "__main__":
+    main()
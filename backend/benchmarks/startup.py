@@ -0,0 +1,105 @@
+"""Cold start: time from launching the server to its first answered request.
+
+Each --app directory is started under uvicorn --repeat times on an empty
+database, which it has to create the schema in, and --repeat times on the
+database those starts left behind, timing process launch to the first 200
+from GET /products. It also times a bare `import main` against that database,
+which every worker start and every test collection pays before anything
+else. SQLite always runs; Postgres runs when --postgres names a scratch
+database, whose public schema is dropped before every empty-database start.
+Compare checkouts the way load.py does:
+
+    git worktree add /tmp/before <commit>
+    python benchmarks/startup.py --app before=/tmp/before/backend --app after=.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from load import free_port
+from workers import reset_postgres
+
+IMPORT_MAIN = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+
+def first_request(app_dir: Path, workdir: str, env: dict, timeout: float):
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/products"
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(app_dir),
+                                "--port", str(port), "--log-level", "warning"], cwd=workdir, env=env)
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"server in {app_dir} exited with status {process.returncode}")
+            try:
+                if httpx.get(url, timeout=timeout).status_code == 200:
+                    return time.perf_counter() - started
+            except httpx.TransportError:
+                time.sleep(0.005)
+        raise RuntimeError(f"server in {app_dir} did not answer within {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def import_time(app_dir: Path, workdir: str, env: dict):
+    output = subprocess.run([sys.executable, "-c", IMPORT_MAIN], cwd=workdir, env={**env, "PYTHONPATH": str(app_dir)},
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure(app_dir: Path, database: str, args):
+    workdir = tempfile.TemporaryDirectory(prefix="storeapp-startup-")
+    db_path = Path(workdir.name) / "storeapp.db"
+    url = args.postgres if database == "postgres" else f"sqlite:///{db_path}"
+    env = {**os.environ, "DATABASE_URL": url}
+
+    def empty_database():
+        if database == "postgres":
+            reset_postgres(args.postgres)
+        for path in Path(workdir.name).glob("storeapp.db*"):
+            path.unlink()
+
+    empty, existing = [], []
+    for _ in range(args.repeat):
+        empty_database()
+        empty.append(first_request(app_dir, workdir.name, env, args.timeout))
+        existing.append(first_request(app_dir, workdir.name, env, args.timeout))
+    imports = [import_time(app_dir, workdir.name, env) for _ in range(args.repeat)]
+    workdir.cleanup()
+
+    def median_ms(samples):
+        return round(statistics.median(samples) * 1000, 1)
+
+    return {"first_request_ms": {"empty_database": median_ms(empty), "existing_database": median_ms(existing)},
+            "import_main_ms": median_ms(imports)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", action="append", metavar="NAME=DIR", help="repeatable; default: this checkout")
+    parser.add_argument("--postgres", help="URL of a scratch Postgres database (wiped before each run)")
+    parser.add_argument("--repeat", type=int, default=5, help="starts per app, database and case")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+    apps = dict(app.split("=", 1) for app in args.app or [f"current={Path(__file__).resolve().parent.parent}"])
+    databases = ["sqlite"] + (["postgres"] if args.postgres else [])
+
+    results = {}
+    for name, app_dir in apps.items():
+        results[name] = {database: measure(Path(app_dir).resolve(), database, args) for database in databases}
+        print(json.dumps({"app": name, **results[name]}), file=sys.stderr)
+    print(json.dumps({"repeat": args.repeat, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
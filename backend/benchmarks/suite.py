@@ -0,0 +1,339 @@
+"""Reproducible mixed-workload load test with a regression check.
+
+Seeds a throwaway database with a synthetic shop (users, products, blogs,
+orders), then drives one or more workload mixes against the app and reports
+requests/sec and p50/p95/p99 per route as JSON:
+
+- browse: product and blog listings and detail pages, search and typeahead
+- checkout: product page, create order, order history and order detail
+- login: password logins followed by a profile read, bcrypt cost included
+- upload: profile picture uploads of small, distinct PNGs
+
+Each virtual user picks its next request from the mix with its own seeded
+random generator, so two runs with the same --seed send the same requests.
+The app runs in-process (--target asgi, no sockets: the application's share
+only) or under uvicorn in a subprocess (--target uvicorn, the whole stack).
+
+Store a run and compare later ones against it; any route whose throughput
+drops, or whose p95 grows, by more than --tolerance percent fails the run:
+
+    python benchmarks/suite.py --mix browse --mix checkout --output baseline.json
+    python benchmarks/suite.py --mix browse --mix checkout --baseline baseline.json
+    python benchmarks/suite.py --current other.json --baseline baseline.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import timedelta
+from pathlib import Path
+
+import httpx
+
+from load import Server, percentile
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+PASSWORD = "benchmark-password"
+SEARCH_TERMS = ("lamp", "chair", "desk", "oak", "steel", "garden", "kitchen", "travel")
+WORDS = SEARCH_TERMS + ("classic", "compact", "modern", "portable", "premium", "vintage")
+
+
+def seed(url: str, users: int, products: int, blogs: int, orders: int, password_hash: str, rng):
+    # Through SQLAlchemy so the same rows go into SQLite or Postgres
+    from sqlalchemy import func, insert, select, text, update
+    from models.models import Blogs, OrderItems, Orders, Products
+    from models.users import User
+    from settings.database import create_db_engine
+
+    engine = create_db_engine(url)
+    with engine.begin() as connection:
+        connection.execute(insert(User), [
+            {"id": n, "username": f"user{n}", "email": f"user{n}@example.com", "first_name": "Bench",
+             "last_name": "User", "hashed_password": password_hash, "is_active": True, "role": "user"}
+            for n in range(1, users + 1)])
+        connection.execute(insert(Products), [
+            {"id": n, "product_name": f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {n}",
+             "description": " ".join(rng.choices(WORDS, k=12)), "price": rng.randint(5, 500), "available": True,
+             "quantity": 1_000_000, "owner_id": None} for n in range(1, products + 1)])
+        connection.execute(insert(Blogs), [
+            {"id": n, "title": f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} notes {n}",
+             "description": " ".join(rng.choices(WORDS, k=20)), "content": " ".join(rng.choices(WORDS, k=400)),
+             "author": f"user{1 + n % users}", "tags": ",".join(rng.sample(WORDS, 3)), "owner_id": 1 + n % users}
+            for n in range(1, blogs + 1)])
+        order_rows, item_rows = [], []
+        for n in range(1, orders + 1):
+            lines = [(rng.randint(1, products), rng.randint(1, 3)) for _ in range(rng.randint(1, 4))]
+            order_rows.append({"id": n, "order_number": f"SEED-{n:08d}", "user_id": 1 + n % users,
+                               "status": "pending", "shipping_address": "1 Bench Street", "shipping_cost": 0,
+                               "total_amount": 0})
+            item_rows += [{"order_id": n, "product_id": product_id, "quantity": quantity, "unit_price": 10}
+                          for product_id, quantity in lines]
+        connection.execute(insert(Orders), order_rows)
+        connection.execute(insert(OrderItems), item_rows)
+        totals = (select(func.sum(OrderItems.quantity * OrderItems.unit_price))
+                  .where(OrderItems.order_id == Orders.id).scalar_subquery())
+        connection.execute(update(Orders).values(total_amount=totals))
+        if connection.dialect.name == "postgresql":
+            # The ids above were explicit; rows the app creates take theirs from the sequences
+            for table in ("users", "products", "blogs", "orders"):
+                connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                        f"(SELECT max(id) FROM {table}))"))
+    engine.dispose()
+
+
+def png(rng):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), tuple(rng.randrange(256) for _ in range(3))).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+class VirtualUser:
+    # One simulated client: a user id, a token and a reproducible stream of choices
+    def __init__(self, client, user_id: int, token: str, sizes: dict, rng):
+        self.client = client
+        self.user_id = user_id
+        self.auth = {"Authorization": f"Bearer {token}"}
+        self.sizes = sizes
+        self.rng = rng
+        self.orders = []
+
+    def product_id(self):
+        # A skewed catalogue: a tenth of the products get most of the views
+        if self.rng.random() < 0.8:
+            return self.rng.randint(1, max(1, self.sizes["products"] // 10))
+        return self.rng.randint(1, self.sizes["products"])
+
+    async def product_list(self):
+        cursor = self.rng.choice((None, self.rng.randint(1, self.sizes["products"])))
+        params = {"limit": 20} | ({"cursor": cursor} if cursor else {})
+        return "GET /products", await self.client.get("/products", params=params)
+
+    async def product_detail(self):
+        return "GET /products/{product_id}", await self.client.get(f"/products/{self.product_id()}")
+
+    async def blog_list(self):
+        return "GET /blogs", await self.client.get("/blogs", params={"limit": 10})
+
+    async def blog_detail(self):
+        blog_id = self.rng.randint(1, self.sizes["blogs"])
+        return "GET /blogs/{blog_id}", await self.client.get(f"/blogs/{blog_id}")
+
+    async def search(self):
+        return "GET /search", await self.client.get("/search", params={"q": self.rng.choice(SEARCH_TERMS)})
+
+    async def suggest(self):
+        term = self.rng.choice(SEARCH_TERMS)
+        return "GET /search/suggest", await self.client.get("/search/suggest",
+                                                            params={"q": term[:self.rng.randint(2, len(term))]})
+
+    async def create_order(self):
+        items = [{"product_id": self.product_id(), "quantity": self.rng.randint(1, 3)}
+                 for _ in range(self.rng.randint(1, 3))]
+        response = await self.client.post("/orders/create_order", headers=self.auth,
+                                          json={"items": items, "shipping_address": "1 Bench Street"})
+        if response.status_code == 201:
+            self.orders.append(response.json()["id"])
+        return "POST /orders/create_order", response
+
+    async def order_history(self):
+        return "GET /orders", await self.client.get("/orders", headers=self.auth, params={"limit": 20})
+
+    async def order_detail(self):
+        if not self.orders:
+            return await self.create_order()
+        return "GET /orders/{order_id}", await self.client.get(f"/orders/{self.rng.choice(self.orders)}",
+                                                               headers=self.auth)
+
+    async def login(self):
+        response = await self.client.post("/auth/token", data={"username": f"user{self.user_id}",
+                                                               "password": PASSWORD})
+        if response.status_code == 200:
+            self.auth = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return "POST /auth/token", response
+
+    async def profile(self):
+        return "GET /users/me", await self.client.get("/users/me", headers=self.auth)
+
+    async def upload(self):
+        files = {"file": ("avatar.png", png(self.rng), "image/png")}
+        return "POST /users/profile-picture", await self.client.post("/users/profile-picture", headers=self.auth,
+                                                                     files=files)
+
+
+# Relative weights of each request in a mix
+MIXES = {
+    "browse": {"product_list": 20, "product_detail": 40, "blog_list": 10, "blog_detail": 15, "search": 10,
+               "suggest": 5},
+    "checkout": {"product_detail": 40, "create_order": 25, "order_history": 20, "order_detail": 15},
+    "login": {"login": 50, "profile": 50},
+    "upload": {"upload": 80, "profile": 20},
+}
+
+
+async def run_mix(client, mix: str, args, tokens: dict, sizes: dict):
+    operations, weights = zip(*MIXES[mix].items())
+    samples = defaultdict(list)
+    errors = defaultdict(int)
+    statuses = defaultdict(int)
+    per_user = max(1, args.requests // args.concurrency)
+
+    async def virtual_user(index: int, count: int, record: bool):
+        rng = random.Random(f"{args.seed}:{mix}:{index}:{record}")
+        user_id = 1 + index % sizes["users"]
+        user = VirtualUser(client, user_id, tokens[user_id], sizes, rng)
+        for _ in range(count):
+            operation = getattr(user, rng.choices(operations, weights)[0])
+            started = time.perf_counter()
+            try:
+                route, response = await operation()
+            except httpx.HTTPError:
+                errors[operation.__name__] += 1
+                continue
+            if record:
+                samples[route].append(time.perf_counter() - started)
+                statuses[response.status_code] += 1
+                if response.status_code >= 400:
+                    errors[route] += 1
+
+    # Warm-up fills caches and pools and is not counted
+    await asyncio.gather(*(virtual_user(n, max(1, args.warmup // args.concurrency), False)
+                           for n in range(args.concurrency)))
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(n, per_user, True) for n in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    routes = {}
+    for route, latencies in sorted(samples.items()):
+        latencies.sort()
+        routes[route] = {"count": len(latencies), "errors": errors[route],
+                         "rps": round(len(latencies) / elapsed, 1),
+                         "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+                         "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+                         "p99_ms": round(percentile(latencies, 0.99) * 1000, 2)}
+    total = sum(len(latencies) for latencies in samples.values())
+    return {"requests": total, "errors": sum(errors.values()), "seconds": round(elapsed, 3),
+            "rps": round(total / elapsed, 1), "statuses": dict(sorted(statuses.items())), "routes": routes}
+
+
+def compare(baseline: dict, current: dict, tolerance: float, min_ms: float):
+    # Small absolute changes on fast routes are noise, whatever the percentage
+    regressions = []
+    for mix, result in current["mixes"].items():
+        for route, now in result["routes"].items():
+            before = baseline.get("mixes", {}).get(mix, {}).get("routes", {}).get(route)
+            if before is None:
+                continue
+            if now["rps"] < before["rps"] * (1 - tolerance / 100):
+                regressions.append({"mix": mix, "route": route, "metric": "rps",
+                                    "baseline": before["rps"], "current": now["rps"]})
+            if (now["p95_ms"] > before["p95_ms"] * (1 + tolerance / 100)
+                    and now["p95_ms"] - before["p95_ms"] > min_ms):
+                regressions.append({"mix": mix, "route": route, "metric": "p95_ms",
+                                    "baseline": before["p95_ms"], "current": now["p95_ms"]})
+    return regressions
+
+
+async def run_all(base_url: str, transport, args, tokens: dict, sizes: dict):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, transport=transport, limits=limits, timeout=args.timeout) as client:
+        return {mix: await run_mix(client, mix, args, tokens, sizes) for mix in args.mix}
+
+
+def benchmark(args):
+    sizes = {"users": args.users, "products": args.products, "blogs": args.blogs, "orders": args.orders}
+    workdir = tempfile.TemporaryDirectory(prefix="storeapp-suite-")
+    os.chdir(workdir.name)
+    # One client address sends everything; the limiter would answer most of it with 429
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+    os.environ.setdefault("NOTIFICATION_WORKERS", "0")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir.name}/storeapp.db"
+    sys.path.insert(0, str(BACKEND_DIR))
+
+    from routers.auth import create_access_token
+    from services.passwords import hash_password
+
+    rng = random.Random(args.seed)
+    password_hash = hash_password(PASSWORD)
+    tokens = {n: create_access_token(f"user{n}", n, timedelta(hours=2)) for n in range(1, args.users + 1)}
+
+    if args.target == "asgi":
+        from main import app
+        from settings.database import async_engine, async_read_engine
+        from settings.migrations import upgrade
+
+        upgrade()
+        seed(os.environ["DATABASE_URL"], args.users, args.products, args.blogs, args.orders, password_hash, rng)
+
+        async def in_process():
+            async with app.router.lifespan_context(app):
+                results = await run_all("http://bench", httpx.ASGITransport(app=app), args, tokens, sizes)
+            await async_engine.dispose()
+            await async_read_engine.dispose()
+            return results
+        mixes = asyncio.run(in_process())
+    else:
+        with Server(BACKEND_DIR, env={"DATABASE_URL": "sqlite:///storeapp.db"}) as server:
+            seed(f"sqlite:///{server.db_path}", args.users, args.products, args.blogs, args.orders, password_hash, rng)
+            mixes = asyncio.run(run_all(server.url, None, args, tokens, sizes))
+    return {"target": args.target, "seed": args.seed, "concurrency": args.concurrency, "dataset": sizes,
+            "mixes": mixes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mix", action="append", choices=sorted(MIXES), help="repeatable; default: all")
+    parser.add_argument("--target", choices=("asgi", "uvicorn"), default="asgi")
+    parser.add_argument("--requests", type=int, default=2000, help="measured requests per mix")
+    parser.add_argument("--warmup", type=int, default=200, help="unmeasured requests per mix")
+    parser.add_argument("--concurrency", type=int, default=16, help="virtual users")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--blogs", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--baseline", help="report to compare against; exits 1 on regressions")
+    parser.add_argument("--current", help="compare this stored report instead of running")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="allowed change in percent")
+    parser.add_argument("--min-ms", type=float, default=1.0, help="ignore p95 growth smaller than this")
+    args = parser.parse_args()
+    args.mix = args.mix or sorted(MIXES)
+    # The run happens in a temporary directory
+    for name in ("output", "baseline", "current"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    if args.current:
+        report = json.loads(Path(args.current).read_text())
+    else:
+        report = benchmark(args)
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(baseline, report, args.tolerance, args.min_ms)
+        report["comparison"] = {"baseline": args.baseline, "tolerance_percent": args.tolerance,
+                                # Numbers from different targets, datasets or seeds are not comparable
+                                "settings_differ": [key for key in ("target", "seed", "concurrency", "dataset")
+                                                    if baseline.get(key) != report.get(key)],
+                                "regressions": regressions}
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    print(output)
+    sys.stdout.flush()
+    code = 1 if report.get("comparison", {}).get("regressions") else 0
+    # aiosqlite worker threads can keep the interpreter alive after the loop closes
+    os._exit(code)
+
+
+if __name__ == "__main__":
+    main()
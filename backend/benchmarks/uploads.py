@@ -0,0 +1,113 @@
+"""Concurrent large uploads: the old blocking copy against services.uploads.
+
+Both handlers are mounted on one in-process app. While the uploads run, a
+ticker coroutine measures how late the event loop wakes it up, which is how
+much every other request on the worker gets delayed.
+
+    python benchmarks/uploads.py --size-mb 10 --uploads 32 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def build_app(workdir: Path, max_bytes: int):
+    from fastapi import FastAPI, File, UploadFile
+    from services import uploads
+
+    uploads.UPLOADS_ROOT = workdir
+    app = FastAPI()
+
+    @app.post("/legacy")
+    async def legacy(file: UploadFile = File(...)):
+        # The handler body the routers used before the upload service
+        target = workdir / "legacy"
+        target.mkdir(exist_ok=True)
+        file_path = target / f"blog_{uuid.uuid4()}.{file.filename.split('.')[-1]}"
+        with file_path.open("wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+        return {"image_url": str(file_path)}
+
+    @app.post("/streamed")
+    async def streamed(file: UploadFile = File(...)):
+        upload = await uploads.store_upload(file, "streamed", max_bytes=max_bytes)
+        return {"image_url": upload.url}
+
+    return app
+
+
+async def run(app, path: str, payloads, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    lags = []
+    running = True
+
+    async def ticker():
+        while running:
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lags.append(time.perf_counter() - started - 0.005)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        async def upload(payload):
+            async with semaphore:
+                response = await client.post(path, files={"file": ("image.jpg", payload, "image/jpeg")})
+                response.raise_for_status()
+
+        tick = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        await asyncio.gather(*(upload(payload) for payload in payloads))
+        elapsed = time.perf_counter() - started
+        running = False
+        await tick
+
+    lags.sort()
+    total_mb = sum(len(payload) for payload in payloads) / (1024 * 1024)
+    return {
+        "uploads_per_sec": round(len(payloads) / elapsed, 2),
+        "mb_per_sec": round(total_mb / elapsed, 1),
+        "loop_lag_p99_ms": round(lags[int(len(lags) * 0.99)] * 1000, 2) if lags else None,
+        "loop_lag_max_ms": round(lags[-1] * 1000, 2) if lags else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=10)
+    parser.add_argument("--uploads", type=int, default=32)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duplicates", action="store_true", help="upload identical files to exercise dedup")
+    args = parser.parse_args()
+
+    size = int(args.size_mb * 1024 * 1024)
+    # JPEG magic so the streamed path accepts the payload
+    unique = 1 if args.duplicates else args.uploads
+    blobs = [b"\xff\xd8\xff" + os.urandom(size - 3) for _ in range(unique)]
+    payloads = [blobs[n % unique] for n in range(args.uploads)]
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="storeapp-uploads-") as workdir:
+        app = build_app(Path(workdir), max_bytes=size + 1)
+        for name, path in (("legacy copyfileobj", "/legacy"), ("streamed upload service", "/streamed")):
+            results[name] = asyncio.run(run(app, path, payloads, args.concurrency))
+            stored = sum(f.stat().st_size for f in (Path(workdir) / path.strip("/")).iterdir()) / (1024 * 1024)
+            results[name]["disk_mb"] = round(stored, 1)
+
+    print(json.dumps({"size_mb": args.size_mb, "uploads": args.uploads, "concurrency": args.concurrency,
+                      "duplicates": args.duplicates, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
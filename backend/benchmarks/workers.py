@@ -0,0 +1,99 @@
+"""Throughput of the pre-forked server (serve.py) by worker count and database.
+
+For each database and each --workers count, starts serve.py on an empty
+database, seeds the suite's synthetic shop and drives the suite's workload
+mixes over HTTP, reporting requests/sec per mix and p95 latency per route.
+SQLite always runs; Postgres runs when --postgres names a scratch database,
+whose public schema is dropped and recreated before every run. Events go
+through the same database there (LISTEN/NOTIFY), as in a multi-worker
+deployment.
+
+The clients run in this process and compete with the workers for CPU; on a
+machine with fewer cores than workers, extra workers cannot add throughput.
+
+    python benchmarks/workers.py --workers 1 4 8 --postgres postgresql://postgres@127.0.0.1/bench
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+from load import Server
+from suite import MIXES, PASSWORD, run_all, seed
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def reset_postgres(url: str):
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(url, isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        connection.execute(text("DROP SCHEMA public CASCADE"))
+        connection.execute(text("CREATE SCHEMA public"))
+    engine.dispose()
+
+
+def run(args, database: str, workers: int, password_hash: str, tokens: dict, sizes: dict):
+    # Connection pools are per worker; they are kept small so 8 workers fit under max_connections
+    env = {"RATE_LIMIT_ENABLED": "0", "NOTIFICATION_WORKERS": "0", "DB_POOL_SIZE": "4", "DB_MAX_OVERFLOW": "4",
+           "DB_READ_POOL_SIZE": "4", "DB_READ_MAX_OVERFLOW": "4"}
+    if database == "postgres":
+        reset_postgres(args.postgres)
+        env |= {"DATABASE_URL": args.postgres, "EVENTS_URL": args.postgres}
+    else:
+        env["DATABASE_URL"] = "sqlite:///storeapp.db"
+    with Server(BACKEND_DIR, env=env, workers=workers) as server:
+        url = args.postgres if database == "postgres" else f"sqlite:///{server.db_path}"
+        # Same seed for every run, so each worker count serves the same data and requests
+        seed(url, sizes["users"], sizes["products"], sizes["blogs"], sizes["orders"], password_hash,
+             random.Random(args.seed))
+        mixes = asyncio.run(run_all(server.url, None, args, tokens, sizes))
+    return {mix: {"requests": result["requests"], "errors": result["errors"], "rps": result["rps"],
+                  "p95_ms": {route: stats["p95_ms"] for route, stats in result["routes"].items()}}
+            for mix, result in mixes.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--postgres", help="URL of a scratch Postgres database (wiped before each run)")
+    parser.add_argument("--mix", action="append", choices=sorted(MIXES), help="repeatable; default: browse, checkout")
+    parser.add_argument("--requests", type=int, default=3000, help="measured requests per mix")
+    parser.add_argument("--warmup", type=int, default=300, help="unmeasured requests per mix")
+    parser.add_argument("--concurrency", type=int, default=64, help="virtual users")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--blogs", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=2000)
+    args = parser.parse_args()
+    args.mix = args.mix or ["browse", "checkout"]
+
+    sys.path.insert(0, str(BACKEND_DIR))
+    from routers.auth import create_access_token
+    from services.passwords import hash_password
+
+    sizes = {"users": args.users, "products": args.products, "blogs": args.blogs, "orders": args.orders}
+    password_hash = hash_password(PASSWORD)
+    tokens = {n: create_access_token(f"user{n}", n, timedelta(hours=2)) for n in range(1, args.users + 1)}
+    databases = ["sqlite"] + (["postgres"] if args.postgres else [])
+
+    results = {}
+    for database in databases:
+        results[database] = {}
+        for workers in args.workers:
+            results[database][workers] = run(args, database, workers, password_hash, tokens, sizes)
+            print(json.dumps({"database": database, "workers": workers, **results[database][workers]}),
+                  file=sys.stderr)
+    print(json.dumps({"cpus": os.cpu_count(), "concurrency": args.concurrency, "dataset": sizes,
+                      "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,44 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from sqlalchemy.orm import Session
-from models.models import Base
-from settings.database import engine
-from routers import auth, blogs, notifications, products, order, users
+from fastapi.responses import ORJSONResponse
+from settings.database import async_engine, async_read_engine
+from settings.migrations import check_schema
+from routers import admin, auth, blogs, media, metrics, notifications, products, order, search, users
+from services.passwords import password_hasher
+from services.uploads import UploadLimitMiddleware
+from services.compression import CompressionMiddleware
+from services.limits import ConcurrencyLimitMiddleware, RateLimitMiddleware
+from services.metrics import MetricsMiddleware
+from services.querylog import QueryLogMiddleware
+from services.images import image_pipeline
+from services.events import event_hub
+from services.notifications import notification_worker
+from services.analytics import rollup_compactor
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from pathlib import Path
 
-# Create uploads directory if it doesn't exist
-UPLOADS_DIR = Path("uploads")
-UPLOADS_DIR.mkdir(exist_ok=True)
+# Importing the app touches neither the database nor the disk; the schema is checked once at startup
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Applies pending migrations unless MIGRATE_ON_STARTUP=0, which makes a stale schema fail the startup
+    await check_schema()
+    await event_hub.start()
+    await notification_worker.start()
+    await rollup_compactor.start()
+    yield
+    await rollup_compactor.stop()
+    await notification_worker.stop()
+    await event_hub.stop()
+    password_hasher.shutdown()
+    image_pipeline.shutdown()
+    await async_engine.dispose()
+    await async_read_engine.dispose()
 
-app = FastAPI()
+# orjson renders what the response models (or jsonable_encoder, for plain returns) produce
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Added before CORS so rejected requests still carry CORS headers; shedding runs first as the cheapest check
+app.add_middleware(RateLimitMiddleware, identify=auth.token_user_id)
+app.add_middleware(ConcurrencyLimitMiddleware)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,7 +48,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-Base.metadata.create_all(bind=engine)
+app.add_middleware(UploadLimitMiddleware, paths=("/users/profile-picture", "/blogs/upload-image"))
+# gzip/br above COMPRESSION_MIN_SIZE; cached responses arrive already compressed and pass through
+app.add_middleware(CompressionMiddleware)
+# Off unless QUERY_DIAGNOSTICS=1
+app.add_middleware(QueryLogMiddleware)
+# Added last so it wraps everything, rejected requests included
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(auth.router)
 app.include_router(users.router)
@@ -29,9 +62,11 @@ app.include_router(blogs.router)
 app.include_router(products.router)
 app.include_router(order.router)
 app.include_router(notifications.router)
-
-# Mount the uploads directory for serving static files
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app.include_router(search.router)
+app.include_router(admin.router)
+app.include_router(metrics.router)
+# Serves /uploads with long-lived caching, conditional GET, ranges and optional proxy offload
+app.include_router(media.router)
 
 # Entry point for the application
 
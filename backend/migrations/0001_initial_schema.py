@@ -0,0 +1,227 @@
+"""Schema as of the switch from create_all to migrations.
+
+On an empty database this creates every table. Databases that create_all
+built at some earlier point get the tables, columns and indexes added since,
+and the new tables are filled from the data already there. Unique constraints
+added since become unique indexes; the stock check constraint is only there
+when products is created here.
+
+The backfills are frozen here along with the tables: they must do what they
+did when this version was written, whatever services/ turns into later.
+"""
+import re
+from collections import defaultdict
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import (TIMESTAMP, Boolean, CheckConstraint, Column, ForeignKey, Index, Integer, MetaData, Numeric,
+                        String, Table, UniqueConstraint, func, inspect, insert, select, update)
+from settings.migrations import add_missing_columns, add_missing_unique_constraints, create_missing_indexes
+
+metadata = MetaData()
+
+users = Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String, unique=True, index=True),
+    Column("email", String, unique=True, index=True),
+    Column("first_name", String),
+    Column("last_name", String),
+    Column("hashed_password", String),
+    Column("is_active", Boolean),
+    Column("role", String),
+    Column("profile_picture", String, nullable=True),
+)
+
+products = Table(
+    "products", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("product_name", String),
+    Column("description", String),
+    Column("price", Integer),
+    Column("available", Boolean),
+    Column("quantity", Integer),
+    Column("owner_id", Integer, ForeignKey("users.id")),
+    Index("ix_products_available_id", "available", "id"),
+    Index("ix_products_owner_id_id", "owner_id", "id"),
+    Index("ix_products_price_id", "price", "id"),
+    Index("ix_products_available_quantity_id", "available", "quantity", "id"),
+    CheckConstraint("quantity >= 0", name="ck_products_quantity_non_negative"),
+)
+
+blogs = Table(
+    "blogs", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("title", String),
+    Column("description", String),
+    # models.types.CompressedText: TEXT, or zlib-compressed BLOBs on SQLite
+    Column("content", String),
+    Column("author", String),
+    Column("tags", String),
+    Column("owner_id", Integer, ForeignKey("users.id")),
+    Column("created_at", TIMESTAMP, server_default=func.now()),
+    Column("updated_at", TIMESTAMP, server_default=func.now()),
+    Index("ix_blogs_created_at_id", "created_at", "id"),
+)
+
+tags = Table(
+    "tags", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String, unique=True, nullable=False),
+    Column("blog_count", Integer, nullable=False, server_default="0"),
+)
+
+blog_tags = Table(
+    "blog_tags", metadata,
+    Column("blog_id", Integer, ForeignKey("blogs.id", ondelete="CASCADE"), primary_key=True),
+    Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True),
+    Column("blog_created_at", TIMESTAMP),
+    Index("ix_blog_tags_tag_id_created_at", "tag_id", "blog_created_at", "blog_id"),
+)
+
+orders = Table(
+    "orders", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("order_number", String, unique=True),
+    Column("user_id", Integer, ForeignKey("users.id"), index=True),
+    Column("idempotency_key", String, nullable=True),
+    Column("total_amount", Numeric(10, 2)),
+    Column("order_date", TIMESTAMP, server_default=func.now()),
+    Column("status", String),
+    Column("shipping_address", String),
+    Column("shipping_cost", Numeric(10, 2)),
+    Column("tracking_number", String),
+    Column("created_at", TIMESTAMP, server_default=func.now()),
+    Column("updated_at", TIMESTAMP, server_default=func.now()),
+    UniqueConstraint("user_id", "idempotency_key", name="uq_orders_user_idempotency_key"),
+)
+
+order_items = Table(
+    "order_items", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("order_id", Integer, ForeignKey("orders.id", ondelete="CASCADE"), index=True, nullable=False),
+    Column("product_id", Integer, ForeignKey("products.id"), index=True, nullable=False),
+    Column("quantity", Integer, nullable=False),
+    Column("unit_price", Numeric(10, 2), nullable=False),
+)
+
+notifications = Table(
+    "notifications", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+    Column("kind", String, nullable=False),
+    Column("title", String),
+    Column("message", String, nullable=False),
+    Column("data", String),
+    Column("created_at", TIMESTAMP, server_default=func.now()),
+    Column("delivered_at", TIMESTAMP),
+    Column("read_at", TIMESTAMP),
+    Index("ix_notifications_user_id_id", "user_id", "id"),
+)
+
+notification_outbox = Table(
+    "notification_outbox", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("notification_id", Integer, ForeignKey("notifications.id", ondelete="CASCADE")),
+    Column("channel", String, nullable=False),
+    Column("payload", String),
+    Column("status", String, nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("available_at", TIMESTAMP, nullable=False),
+    Column("last_error", String),
+    Column("created_at", TIMESTAMP, server_default=func.now()),
+    Column("sent_at", TIMESTAMP),
+    Index("ix_notification_outbox_status_available_at", "status", "available_at", "id"),
+)
+
+notification_counters = Table(
+    "notification_counters", metadata,
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True),
+    Column("unread_count", Integer, nullable=False, server_default="0"),
+    Column("read_through_id", Integer, nullable=False, server_default="0"),
+)
+
+sales_rollups = Table(
+    "sales_rollups", metadata,
+    Column("period", String, primary_key=True),
+    Column("bucket", TIMESTAMP, primary_key=True),
+    Column("status", String, primary_key=True),
+    Column("orders", Integer, nullable=False),
+    Column("revenue", Numeric(14, 2), nullable=False),
+)
+
+sales_rollup_deltas = Table(
+    "sales_rollup_deltas", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("bucket", TIMESTAMP, nullable=False),
+    Column("status", String, nullable=False),
+    Column("orders", Integer, nullable=False),
+    Column("revenue", Numeric(14, 2), nullable=False),
+)
+
+MAX_TAG_LENGTH = 50
+MAX_TAGS_PER_BLOG = 20
+WHITESPACE = re.compile(r"\s+")
+# The one bucket of the "all" sales period
+ALL_TIME = datetime(1970, 1, 1)
+
+
+def parse_tags(value):
+    names = (WHITESPACE.sub(" ", tag).strip().lower()[:MAX_TAG_LENGTH] for tag in (value or "").split(","))
+    return list(dict.fromkeys(name for name in names if name))[:MAX_TAGS_PER_BLOG]
+
+
+def backfill_blog_tags(connection):
+    # tags and blog_tags were created empty just now, so plain inserts cannot conflict
+    rows = connection.execute(select(blogs.c.id, blogs.c.tags, blogs.c.created_at))
+    parsed = [(blog_id, parse_tags(value), created_at) for blog_id, value, created_at in rows]
+    names = sorted({name for _, names, _ in parsed for name in names})
+    if names:
+        connection.execute(insert(tags), [{"name": name} for name in names])
+    tag_ids = dict(connection.execute(select(tags.c.name, tags.c.id)).all())
+    links = [{"blog_id": blog_id, "tag_id": tag_ids[name], "blog_created_at": created_at}
+             for blog_id, names, created_at in parsed for name in names]
+    if links:
+        connection.execute(insert(blog_tags), links)
+    counts = select(func.count()).where(blog_tags.c.tag_id == tags.c.id).scalar_subquery()
+    connection.execute(update(tags).values(blog_count=counts))
+
+
+def backfill_sales_rollups(connection):
+    # Hour, day and all-time totals per status, from a single pass over orders
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    result = connection.execute(select(orders.c.order_date, orders.c.status, orders.c.total_amount)
+                                .execution_options(yield_per=10000))
+    for order_date, status, total_amount in result:
+        hour = (order_date or now).replace(minute=0, second=0, microsecond=0)
+        for period, bucket in (("hour", hour), ("day", hour.replace(hour=0)), ("all", ALL_TIME)):
+            total = totals[(period, bucket, status)]
+            total[0] += 1
+            total[1] += Decimal(total_amount or 0)
+    if totals:
+        connection.execute(insert(sales_rollups), [
+            {"period": period, "bucket": bucket, "status": status, "orders": count, "revenue": revenue}
+            for (period, bucket, status), (count, revenue) in totals.items()])
+
+
+def upgrade(connection):
+    existing = set(inspect(connection).get_table_names())
+    metadata.create_all(connection)
+    for table in metadata.sorted_tables:
+        if table.name in existing:
+            add_missing_columns(connection, table)
+            create_missing_indexes(connection, table)
+            add_missing_unique_constraints(connection, table)
+    created = {table.name for table in metadata.sorted_tables} - existing
+
+    if "blog_tags" in created and "blogs" in existing:
+        backfill_blog_tags(connection)
+    if "notification_counters" in created and "notifications" in existing:
+        connection.execute(insert(notification_counters).from_select(
+            ["user_id", "unread_count"],
+            select(notifications.c.user_id, func.count())
+            .where(notifications.c.read_at.is_(None))
+            .group_by(notifications.c.user_id)))
+    if "sales_rollups" in created and "orders" in existing:
+        backfill_sales_rollups(connection)
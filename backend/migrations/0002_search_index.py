@@ -0,0 +1,13 @@
+"""Full-text search: FTS5 tables and triggers on SQLite, tsvector columns with GIN indexes on Postgres.
+
+Both are built over the rows already in blogs and products. An FTS5 index from
+before blog bodies were compressed is rebuilt over the plain-text view.
+"""
+from models.search import create_pg_search_index, create_search_index
+
+
+def upgrade(connection):
+    if connection.dialect.name == "sqlite":
+        create_search_index(connection)
+    elif connection.dialect.name == "postgresql":
+        create_pg_search_index(connection)
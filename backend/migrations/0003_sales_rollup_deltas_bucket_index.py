@@ -0,0 +1,6 @@
+"""Index pending sales deltas by bucket, which the stats endpoints filter them on."""
+
+
+def upgrade(connection):
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_sales_rollup_deltas_bucket ON sales_rollup_deltas (bucket)")
@@ -1,5 +1,7 @@
 from settings.database import Base
-from sqlalchemy import Column, ForeignKey, Integer, String, Boolean, Numeric, TIMESTAMP, func
+from models.types import CompressedText
+from sqlalchemy.orm import deferred
+from sqlalchemy import CheckConstraint, Column, ForeignKey, Index, Integer, String, Boolean, Numeric, TIMESTAMP, UniqueConstraint, func
 
 class Products(Base):
     __tablename__ = 'products'
@@ -11,22 +13,61 @@ class Products(Base):
     quantity = Column(Integer)
     owner_id = Column(Integer, ForeignKey("users.id"))
 
+    # Composite indexes backing the keyset-paginated listing filters
+    __table_args__ = (
+        Index("ix_products_available_id", "available", "id"),
+        Index("ix_products_owner_id_id", "owner_id", "id"),
+        Index("ix_products_price_id", "price", "id"),
+        # Low-stock view: available products by ascending quantity, straight off the index
+        Index("ix_products_available_quantity_id", "available", "quantity", "id"),
+        # Last line of defence against overselling; checkout decrements conditionally
+        CheckConstraint("quantity >= 0", name="ck_products_quantity_non_negative"),
+    )
+
 class Blogs(Base):
     __tablename__ = 'blogs'
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String)
     description = Column(String)
-    content = Column(String)
+    # Only a single blog needs the body: loaded on first access, or with undefer(Blogs.content)
+    content = deferred(Column(CompressedText))
     author = Column(String)
     tags = Column(String)
     owner_id = Column(Integer, ForeignKey("users.id"))
     created_at = Column(TIMESTAMP, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
 
+    # Newest-first keyset pagination of the blog listing
+    __table_args__ = (
+        Index("ix_blogs_created_at_id", "created_at", "id"),
+    )
+    # Server-set timestamps come back through RETURNING on write, so a returned blog never lazy-loads them
+    __mapper_args__ = {"eager_defaults": True}
+
+class Tags(Base):
+    __tablename__ = 'tags'
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)
+    # Maintained on every blog write so the tag cloud never has to count blog_tags
+    blog_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+class BlogTags(Base):
+    __tablename__ = 'blog_tags'
+    blog_id = Column(Integer, ForeignKey("blogs.id", ondelete="CASCADE"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True)
+    # Copy of blogs.created_at so a tag's posts page newest-first straight off the index
+    blog_created_at = Column(TIMESTAMP)
+
+    __table_args__ = (
+        Index("ix_blog_tags_tag_id_created_at", "tag_id", "blog_created_at", "blog_id"),
+    )
+
 class Orders(Base):
     __tablename__ = 'orders'
     id = Column(Integer, primary_key=True, index=True)
-    order_number = Column(String)
+    order_number = Column(String, unique=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    idempotency_key = Column(String, nullable=True)
     total_amount = Column(Numeric(10, 2))
     order_date = Column(TIMESTAMP, server_default=func.now())
     status = Column(String, default="pending")
@@ -35,3 +76,87 @@ class Orders(Base):
     tracking_number = Column(String)
     created_at = Column(TIMESTAMP, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+    # Retried checkouts carrying the same key resolve to the original order
+    __table_args__ = (
+        UniqueConstraint("user_id", "idempotency_key", name="uq_orders_user_idempotency_key"),
+    )
+
+class OrderItems(Base):
+    __tablename__ = 'order_items'
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id", ondelete="CASCADE"), index=True, nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), index=True, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    unit_price = Column(Numeric(10, 2), nullable=False)
+
+class Notifications(Base):
+    __tablename__ = 'notifications'
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String, nullable=False)
+    title = Column(String)
+    message = Column(String, nullable=False)
+    # JSON encoded extras such as the order a notification is about
+    data = Column(String)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    # Set once the in-app channel has pushed it
+    delivered_at = Column(TIMESTAMP)
+    read_at = Column(TIMESTAMP)
+
+    __table_args__ = (
+        Index("ix_notifications_user_id_id", "user_id", "id"),
+    )
+
+class NotificationOutbox(Base):
+    __tablename__ = 'notification_outbox'
+    id = Column(Integer, primary_key=True, index=True)
+    # Null for broadcasts, which are expanded into per-user rows by the workers
+    notification_id = Column(Integer, ForeignKey("notifications.id", ondelete="CASCADE"))
+    channel = Column(String, nullable=False)
+    payload = Column(String)
+    # pending -> processing -> sent, or back to pending with a later available_at, or dead after the last attempt
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    # Earliest time a worker may claim the row; while processing, when the claim lapses
+    available_at = Column(TIMESTAMP, nullable=False)
+    last_error = Column(String)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    sent_at = Column(TIMESTAMP)
+
+    # Workers claim the oldest due rows of a status straight off this index
+    __table_args__ = (
+        Index("ix_notification_outbox_status_available_at", "status", "available_at", "id"),
+    )
+
+class NotificationCounters(Base):
+    __tablename__ = 'notification_counters'
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    # Changed in the same transactions as the notifications, so "how many unread" is a primary key lookup
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Everything up to this id is read; mark-all-read moves it instead of updating each row
+    read_through_id = Column(Integer, nullable=False, default=0, server_default="0")
+
+class SalesRollups(Base):
+    __tablename__ = 'sales_rollups'
+    # "hour", "day" or "all" (a single bucket covering all time), in UTC
+    period = Column(String, primary_key=True)
+    bucket = Column(TIMESTAMP, primary_key=True)
+    status = Column(String, primary_key=True)
+    orders = Column(Integer, nullable=False, default=0)
+    revenue = Column(Numeric(14, 2), nullable=False, default=0)
+
+class SalesRollupDeltas(Base):
+    __tablename__ = 'sales_rollup_deltas'
+    # Appended by order writes in their own transaction; folded into sales_rollups by the compaction job
+    id = Column(Integer, primary_key=True)
+    # Hour of the order's order_date
+    bucket = Column(TIMESTAMP, nullable=False)
+    status = Column(String, nullable=False)
+    orders = Column(Integer, nullable=False)
+    revenue = Column(Numeric(14, 2), nullable=False)
+
+    # Stats reads sum the pending deltas of their bucket range
+    __table_args__ = (
+        Index("ix_sales_rollup_deltas_bucket", "bucket"),
+    )
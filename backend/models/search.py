@@ -0,0 +1,90 @@
+from sqlalchemy import text
+
+# External-content FTS5 tables: the text lives once in blogs/products and the
+# index only stores postings. Prefix indexes make 2-3 character typeahead cheap.
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+FTS_PREFIX = "2 3"
+
+SEARCH_TABLES = {
+    "blogs_fts": ("blogs", ("title", "description", "content", "tags")),
+    "products_fts": ("products", ("product_name", "description")),
+}
+# Columns stored through models.types.CompressedText; the index reads them with inflate_text()
+COMPRESSED_COLUMNS = {"blogs": ("content",)}
+
+def column_value(source: str, column: str, row: str):
+    value = f"{row}.{column}" if row else column
+    return f"inflate_text({value})" if column in COMPRESSED_COLUMNS.get(source, ()) else value
+
+def content_source(source: str):
+    # FTS5 reads snippets and rebuilds from its content table; with compressed columns that is a view of plain text
+    return f"{source}_search" if source in COMPRESSED_COLUMNS else source
+
+def search_index_ddl(fts_table: str):
+    source, columns = SEARCH_TABLES[fts_table]
+    column_list = ", ".join(columns)
+    new_values = ", ".join(column_value(source, column, "new") for column in columns)
+    old_values = ", ".join(column_value(source, column, "old") for column in columns)
+    insert_new = f"INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.id, {new_values});"
+    delete_old = (f"INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) "
+                  f"VALUES ('delete', old.id, {old_values});")
+    statements = []
+    if source in COMPRESSED_COLUMNS:
+        view_columns = ", ".join(f"{column_value(source, column, '')} AS {column}" for column in columns)
+        statements.append(f"CREATE VIEW IF NOT EXISTS {content_source(source)} AS "
+                          f"SELECT id, {view_columns} FROM {source}")
+    return statements + [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5({column_list}, content='{content_source(source)}', "
+        f"content_rowid='id', tokenize='{FTS_TOKENIZER}', prefix='{FTS_PREFIX}')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {source} BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {source} BEGIN {delete_old} END",
+        # Only indexed columns re-index; stock and timestamp updates leave the index alone
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column_list} ON {source} "
+        f"BEGIN {delete_old} {insert_new} END",
+    ]
+
+# Postgres keeps a weighted tsvector per row in a stored generated column with a GIN index. Like the
+# FTS5 tables it is created by a migration rather than declared in the models, which stay the same for both databases;
+# its four weight classes stand in for the bm25 column weights of services.search
+PG_TS_CONFIG = "simple"
+PG_SEARCH_COLUMN = "search_vector"
+PG_WEIGHTS = {
+    "blogs": {"title": "A", "tags": "B", "description": "C", "content": "D"},
+    "products": {"product_name": "A", "description": "C"},
+}
+
+def tsvector_expression(source: str):
+    return " || ".join(f"setweight(to_tsvector('{PG_TS_CONFIG}', coalesce({column}, '')), '{weight}')"
+                       for column, weight in PG_WEIGHTS[source].items())
+
+def search_document(source: str):
+    # The indexed columns as one text, for ts_headline
+    columns = ", ".join(SEARCH_TABLES[f"{source}_fts"][1])
+    return f"concat_ws(' ', {columns})"
+
+def create_pg_search_index(connection):
+    # Stored rather than an expression index: ranking reads the vector instead of re-parsing every match
+    for source in PG_WEIGHTS:
+        connection.execute(text(f"ALTER TABLE {source} ADD COLUMN IF NOT EXISTS {PG_SEARCH_COLUMN} tsvector "
+                                f"GENERATED ALWAYS AS ({tsvector_expression(source)}) STORED"))
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{source}_search ON {source} "
+                                f"USING gin ({PG_SEARCH_COLUMN})"))
+
+def drop_search_index(connection, fts_table: str):
+    for trigger in ("ai", "ad", "au"):
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {fts_table}_{trigger}"))
+    connection.execute(text(f"DROP TABLE IF EXISTS {fts_table}"))
+
+def create_search_index(connection):
+    for fts_table, (source, _) in SEARCH_TABLES.items():
+        definition = connection.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                                        {"name": fts_table}).scalar()
+        if definition is not None and f"content='{content_source(source)}'" not in definition:
+            # Built over the table itself before its columns were compressed; the index is rebuilt below
+            drop_search_index(connection, fts_table)
+            definition = None
+        for statement in search_index_ddl(fts_table):
+            connection.execute(text(statement))
+        if definition is None:
+            # Index rows that were written before the index existed
+            connection.execute(text(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')"))
@@ -0,0 +1,39 @@
+import os
+import zlib
+from sqlalchemy import String
+from sqlalchemy.types import TypeDecorator
+
+# Text at least this many bytes long is stored zlib-compressed on SQLite; 0 stores everything plain
+COMPRESSED_TEXT_MIN_SIZE = int(os.getenv("COMPRESSED_TEXT_MIN_SIZE", "2048"))
+COMPRESSED_TEXT_LEVEL = 6
+
+def inflate_text(value):
+    # Compressed values are BLOBs and plain ones TEXT, so rows written either way read back the same
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode()
+    return value
+
+class CompressedText(TypeDecorator):
+    # Postgres already compresses large values itself (TOAST), so only SQLite gets compressed bytes
+    impl = String
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or dialect.name != "sqlite" or not COMPRESSED_TEXT_MIN_SIZE:
+            return value
+        encoded = value.encode()
+        if len(encoded) < COMPRESSED_TEXT_MIN_SIZE:
+            return value
+        compressed = zlib.compress(encoded, COMPRESSED_TEXT_LEVEL)
+        return compressed if len(compressed) < len(encoded) else value
+
+    def process_result_value(self, value, dialect):
+        return inflate_text(value)
+
+# SQL functions every SQLite connection needs: the search index reads compressed columns through them
+SQLITE_FUNCTIONS = {"inflate_text": (1, inflate_text)}
+
+def register_sqlite_functions(dbapi_connection):
+    # Works on sqlite3 connections and SQLAlchemy's aiosqlite adapter alike
+    for name, (arguments, function) in SQLITE_FUNCTIONS.items():
+        dbapi_connection.create_function(name, arguments, function, deterministic=True)
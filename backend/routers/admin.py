@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from typing import Annotated, Literal
+from pydantic import BaseModel
+from settings.database import read_db_dependency
+from services.analytics import (LOW_STOCK_THRESHOLD, as_utc, compact_backlog, low_stock, rollup_compactor, sales_series,
+                                sales_summary, utcnow)
+from .auth import get_current_user, is_admin
+
+router = APIRouter(
+    prefix="/admin",
+    tags=["admin"]
+)
+
+user_dependencty = Annotated[dict, Depends(get_current_user)]
+
+# Longest range one request may ask for, in buckets of the period
+MAX_BUCKETS = {"hour": 24 * 31, "day": 366 * 2}
+
+class SalesTotals(BaseModel):
+    # Cancelled orders are left out of orders and revenue
+    orders: int
+    revenue: float
+
+class StatusTotals(SalesTotals):
+    # Every status, cancelled included
+    by_status: dict[str, int]
+
+class SalesBucket(StatusTotals):
+    bucket: datetime
+
+class CompactorStats(BaseModel):
+    running: bool
+    interval: float
+    compacted: int
+
+class StatsSummaryResponse(BaseModel):
+    today: SalesTotals
+    last_7_days: SalesTotals
+    last_30_days: SalesTotals
+    all_time: StatusTotals
+    compactor: CompactorStats
+
+class SalesSeriesResponse(BaseModel):
+    period: str
+    start: datetime
+    end: datetime
+    series: list[SalesBucket]
+
+class LowStockItem(BaseModel):
+    id: int
+    product_name: str | None
+    quantity: int | None
+
+class LowStockPage(BaseModel):
+    items: list[LowStockItem]
+    # "quantity:id" of the last item, for the next request
+    next_cursor: str | None
+
+async def require_admin(db, user: dict):
+    if not await is_admin(db, user):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+# Every stats endpoint reads the precomputed rollups only, never the orders table
+
+@router.get("/stats", status_code=status.HTTP_200_OK, response_model=StatsSummaryResponse)
+async def stats_summary(db: read_db_dependency, user: user_dependencty):
+    await require_admin(db, user)
+    return {**await sales_summary(db), "compactor": rollup_compactor.stats()}
+
+@router.get("/stats/sales", status_code=status.HTTP_200_OK, response_model=SalesSeriesResponse)
+async def stats_sales(db: read_db_dependency, user: user_dependencty,
+                      period: Literal["hour", "day"] = "day",
+                      start: datetime | None = None,
+                      end: datetime | None = None):
+    # Orders and revenue leave out cancelled orders; by_status counts every status. Times are UTC.
+    await require_admin(db, user)
+    step = timedelta(hours=1) if period == "hour" else timedelta(days=1)
+    end = as_utc(end) if end is not None else utcnow() + timedelta(hours=1)
+    start = as_utc(start) if start is not None else end - step * (48 if period == "hour" else 30)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if (end - start) / step > MAX_BUCKETS[period]:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BUCKETS[period]} {period} buckets per request")
+    await compact_backlog(db)
+    return {"period": period, "start": start, "end": end, "series": await sales_series(db, period, start, end)}
+
+@router.get("/stats/low-stock", status_code=status.HTTP_200_OK, response_model=LowStockPage)
+async def stats_low_stock(db: read_db_dependency, user: user_dependencty,
+                          threshold: int = Query(default=LOW_STOCK_THRESHOLD, ge=0),
+                          limit: int = Query(default=50, gt=0, le=200),
+                          cursor: str | None = Query(default=None, pattern=r"^-?\d+:\d+$")):
+    # Lowest quantity first; the cursor is "quantity:id" of the last product on the previous page
+    await require_admin(db, user)
+    position = tuple(int(part) for part in cursor.split(":")) if cursor else None
+    return await low_stock(db, threshold, limit, position)
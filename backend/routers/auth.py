@@ -1,11 +1,16 @@
 from datetime import timedelta, timezone, datetime
+import hashlib
+import os
+import time
 from typing_extensions import Annotated
 from fastapi import APIRouter, Depends, status, HTTPException
-from pydantic import BaseModel
+from fastapi.requests import HTTPConnection
+from pydantic import BaseModel, ConfigDict
 from models.users import User
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-from settings.database import SessionLocal
+from sqlalchemy import select
+from settings.database import db_dependency, read_db_dependency
+from services.cache import LRUCache, publish_invalidation, share_invalidations
+from services.passwords import password_hasher
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from jose import jwt, JWTError
 
@@ -14,19 +19,59 @@ router = APIRouter(
     tags=["auth"],
 )
 
-SECRET_KEY = "YourSecretKey"
-ALGORITHM = "YourAlgorithm" #Example HS256
+# Set SECRET_KEY in every real deployment; the default only suits local runs
+SECRET_KEY = os.getenv("SECRET_KEY", "YourSecretKey")
+ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl='auth/token')
 
-def autenticate_user(username:str, password:str, db):
-    user = db.query(User).filter(User.username == username).first()
+# Every account starts with this role; admins are made server-side with `python -m services.accounts`
+DEFAULT_ROLE = "customer"
+ADMIN_ROLE = "admin"
+
+# Verified token claims, keyed by token digest and expiring with the token itself
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+token_cache = LRUCache(max_entries=TOKEN_CACHE_SIZE)
+
+# Serialized /users/me profiles; PROFILE_CACHE_TTL=0 turns the cache off
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", "300"))
+profile_cache = LRUCache(max_entries=PROFILE_CACHE_SIZE, default_ttl=PROFILE_CACHE_TTL)
+
+def get_cached_profile(user_id: int):
+    if PROFILE_CACHE_TTL <= 0:
+        return None
+    return profile_cache.get(user_id)
+
+def cache_profile(user_id: int, profile: dict):
+    if PROFILE_CACHE_TTL > 0:
+        profile_cache.set(user_id, profile)
+
+async def drop_profiles(user_ids):
+    profile_cache.delete(*user_ids)
+
+share_invalidations("profiles", drop_profiles)
+
+async def invalidate_profile(user_id: int):
+    # Every worker holds its own copy of the profile
+    await publish_invalidation("profiles", user_ids=[user_id])
+
+async def is_admin(db, user: dict):
+    user_model = await db.get(User, user["user_id"])
+    return user_model is not None and user_model.role == ADMIN_ROLE
+
+async def autenticate_user(username:str, password:str, db):
+    user = (await db.execute(select(User).where(User.username == username))).scalar_one_or_none()
     if not user:
         return False
-    if not bcrypt_context.verify(password, user.hashed_password):
+    valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not valid:
         return False
+    # Transparently upgrade hashes made with an outdated cost
+    if new_hash is not None:
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 def create_access_token(username: str, user_id: int, expires_delta=timedelta):
@@ -36,6 +81,14 @@ def create_access_token(username: str, user_id: int, expires_delta=timedelta):
     return jwt.encode(encode, SECRET_KEY, algorithm=ALGORITHM)
 
 async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
+    return decode_token(token)
+
+def decode_token(token: str):
+    token_key = hashlib.sha256(token.encode()).digest()
+    claims = token_cache.get(token_key)
+    if claims is not None:
+        return claims
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -44,8 +97,26 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-    
-    return {"username": username, "user_id": user_id}
+
+    claims = {"username": username, "user_id": user_id}
+    expires_in = payload.get("exp", 0) - time.time()
+    if expires_in > 0:
+        token_cache.set(token_key, claims, ttl=expires_in)
+    return claims
+
+def token_user_id(token: str):
+    # Used by the rate limiter before any route runs; raises on an invalid token like decode_token
+    return decode_token(token)["user_id"]
+
+async def get_stream_user(connection: HTTPConnection):
+    # EventSource and browser WebSockets cannot send headers, so streams also take ?access_token=
+    authorization = connection.headers.get("authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        token = connection.query_params.get("access_token")
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return decode_token(token)
 
 class CreateUserRequest(BaseModel):
     username: str
@@ -53,33 +124,33 @@ class CreateUserRequest(BaseModel):
     first_name: str
     last_name: str
     password: str
-    role: str 
 
 class UpdateUserRequest(BaseModel):
     username: str
     email: str
     first_name: str
     last_name: str
-    role: str
 
 class ChangePasswordRequest(BaseModel):
     password: str
     new_password: str
 
+class UserResponse(BaseModel):
+    # Never the password hash
+    model_config = ConfigDict(from_attributes=True)
+    id: int
+    username: str | None
+    email: str | None
+    first_name: str | None
+    last_name: str | None
+    role: str | None
+    profile_picture: str | None = None
+
 class Token(BaseModel):
     access_token: str
     token_type: str
-    
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
 
-@router.post("/register", status_code=status.HTTP_201_CREATED)
+@router.post("/register", status_code=status.HTTP_201_CREATED, response_model=UserResponse)
 async def create_user(db: db_dependency, 
                       create_user_request: CreateUserRequest):
     create_user_model = User(
@@ -87,34 +158,35 @@ async def create_user(db: db_dependency,
         username=create_user_request.username,
         first_name=create_user_request.first_name,
         last_name=create_user_request.last_name,
-        hashed_password=bcrypt_context.hash(create_user_request.password),
+        hashed_password=await password_hasher.hash(create_user_request.password),
         is_active=True,
-        role=create_user_request.role
+        # Never taken from the request, or anyone could register an admin
+        role=DEFAULT_ROLE
     )
 
     db.add(create_user_model)
-    db.commit()
+    await db.commit()
 
     if create_user_model is not None:
         return create_user_model
     raise HTTPException(status_code=400, detail="User creation failed.")
 
-@router.put("/update", status_code=status.HTTP_200_OK)
+@router.put("/update", status_code=status.HTTP_200_OK, response_model=UserResponse)
 async def update_user(user: Annotated[dict, Depends(get_current_user)],
                       db: db_dependency,
                       update_user_request: UpdateUserRequest):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication required")
         
-    user_model = db.query(User).filter(User.id == user["user_id"]).first()
+    user_model = await db.get(User, user["user_id"])
     if user_model is None:
         raise HTTPException(status_code=404, detail="User not found")
     user_model.username = update_user_request.username
     user_model.email = update_user_request.email
     user_model.first_name = update_user_request.first_name
     user_model.last_name = update_user_request.last_name
-    user_model.role = update_user_request.role
-    db.commit()
+    await db.commit()
+    await invalidate_profile(user_model.id)
     return user_model
 
 @router.put("/change_password", status_code=status.HTTP_200_OK)
@@ -124,23 +196,23 @@ async def change_password(user: Annotated[dict, Depends(get_current_user)],
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication required")
         
-    user_model = db.query(User).filter(User.id == user["user_id"]).first()
+    user_model = await db.get(User, user["user_id"])
     if user_model is None:
         raise HTTPException(status_code=404, detail="User not found")
         
     # Verify current password
-    if not bcrypt_context.verify(change_password_request.password, user_model.hashed_password):
+    if not await password_hasher.verify(change_password_request.password, user_model.hashed_password):
         raise HTTPException(status_code=401, detail="Current password is incorrect")
         
     # Update password
-    user_model.hashed_password = bcrypt_context.hash(change_password_request.new_password)
-    db.commit()
+    user_model.hashed_password = await password_hasher.hash(change_password_request.new_password)
+    await db.commit()
     return {"message": "Password updated successfully"}
 
 @router.post("/token", response_model=Token, status_code=status.HTTP_200_OK)
 async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
                                  db: db_dependency):
-    authentication = autenticate_user(form_data.username, form_data.password, db)
+    authentication = await autenticate_user(form_data.username, form_data.password, db)
     if not authentication:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     
@@ -149,4 +221,11 @@ async def login_for_access_token(form_data: Annotated[OAuth2PasswordRequestForm,
         user_id=authentication.id,
         expires_delta=timedelta(minutes=30)
     )
-    return {"access_token": token, "token_type": "bearer"}
\ No newline at end of file
+    return {"access_token": token, "token_type": "bearer"}
+
+@router.get("/cache_stats", status_code=status.HTTP_200_OK)
+async def cache_stats(db: read_db_dependency, user: Annotated[dict, Depends(get_current_user)]):
+    # Operational counters, for admins only like the rest of /admin
+    if not await is_admin(db, user):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return {"tokens": token_cache.stats(), "profiles": profile_cache.stats()}
@@ -1,33 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, Path, status, File, UploadFile
-from typing import Annotated
-from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from models.models import Blogs
-from settings.database import engine, SessionLocal
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, status, File, UploadFile
+from typing import Annotated, Literal
+from datetime import datetime
+from pydantic import BaseModel, ConfigDict, Field
+from sqlalchemy import delete, exists, select, tuple_
+from sqlalchemy.orm import aliased, undefer
+from models.models import Blogs, BlogTags, Tags
+from settings.database import db_dependency, read_db_dependency
+from services.cache import response_cache
+from services.uploads import store_upload
+from services.images import image_pipeline, srcset
+from services.tags import clear_blog_tags, parse_tags, set_blog_tags
 from .auth import get_current_user
-import shutil
-import os
-from pathlib import Path
-import uuid
 
 router = APIRouter(
     prefix="/blogs",
     tags=["blogs"]
 )
 
-# Create uploads directory for blog images if it doesn't exist
-BLOG_UPLOADS_DIR = Path("uploads/blog_images")
-BLOG_UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
-
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
 user_dependencty = Annotated[dict, Depends(get_current_user)]
 
 class BlogRequest(BaseModel):
@@ -37,77 +26,172 @@ class BlogRequest(BaseModel):
     author: str = Field(min_length=3, max_length=50)
     tags: str = Field(min_length=3)
 
-@router.get("", status_code=status.HTTP_200_OK)
-async def all_blogs(db: db_dependency):
-    return db.query(Blogs).all()
+class BlogSummary(BaseModel):
+    # What list views show; the body is only sent by GET /blogs/{blog_id}
+    model_config = ConfigDict(from_attributes=True)
+    id: int
+    title: str | None
+    description: str | None
+    author: str | None
+    tags: str | None
+    owner_id: int | None
+    created_at: datetime | None
+    updated_at: datetime | None
+
+class BlogResponse(BlogSummary):
+    content: str | None
+
+class BlogPage(BaseModel):
+    items: list[BlogSummary]
+    next_cursor: int | None
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_FILTER_TAGS = 10
+
+def newer_than_cursor(created_at, row_id, cursor_created_at, cursor: int):
+    # Newest first; id breaks ties between posts written in the same second. The row-value
+    # comparison lets SQLite seek straight into the (created_at, id) index
+    return tuple_(created_at, row_id) < tuple_(cursor_created_at, cursor)
+
+async def tagged_blog_ids(db, names: list, match: str, cursor: int | None, limit: int):
+    tags = (await db.execute(select(Tags.id, Tags.blog_count).where(Tags.name.in_(names)))).all()
+    if not tags or (match == "all" and len(tags) < len(names)):
+        return []
+
+    if match == "all":
+        # Walk the rarest tag's index range and probe the others per row
+        tags = sorted(tags, key=lambda tag: tag.blog_count)
+        base = aliased(BlogTags)
+        query = select(base.blog_id, base.blog_created_at).where(base.tag_id == tags[0].id)
+        for tag in tags[1:]:
+            query = query.where(exists().where(BlogTags.blog_id == base.blog_id, BlogTags.tag_id == tag.id))
+    else:
+        base = BlogTags
+        query = select(base.blog_id, base.blog_created_at).where(base.tag_id.in_([tag.id for tag in tags])).distinct()
+
+    if cursor is not None:
+        cursor_created_at = select(BlogTags.blog_created_at).where(BlogTags.blog_id == cursor).limit(1).scalar_subquery()
+        query = query.where(newer_than_cursor(base.blog_created_at, base.blog_id, cursor_created_at, cursor))
+    query = query.order_by(base.blog_created_at.desc(), base.blog_id.desc()).limit(limit)
+    return (await db.execute(query)).scalars().all()
 
-@router.get("/{blog_id}", status_code=status.HTTP_200_OK)
-async def single_blog(db: db_dependency, blog_id: int = Path(gt=0)):
-    blog_model = db.query(Blogs).filter(Blogs.id == blog_id).first()
-    if blog_model is not None:
-        return blog_model
-    raise HTTPException(status_code=404, detail="Blog not found")
+@router.get("", status_code=status.HTTP_200_OK, response_model=BlogPage)
+async def all_blogs(request: Request,
+                    db: read_db_dependency,
+                    tag: list[str] = Query(default=[], max_length=MAX_FILTER_TAGS),
+                    match: Literal["all", "any"] = "all",
+                    cursor: int | None = Query(default=None, gt=0),
+                    limit: int = Query(default=DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE)):
+    # Newest first; the cursor is the id of the last blog on the previous page. Blogs.content is
+    # deferred, so the rows below are loaded without their bodies
+    names = parse_tags(",".join(tag))
 
-@router.post("/new_blog", status_code=status.HTTP_201_CREATED)
+    async def load_blogs():
+        if names:
+            ids = await tagged_blog_ids(db, names, match, cursor, limit + 1)
+            rows = {blog.id: blog for blog in (await db.execute(select(Blogs).where(Blogs.id.in_(ids)))).scalars()}
+            blogs = [rows[blog_id] for blog_id in ids if blog_id in rows]
+        else:
+            query = select(Blogs)
+            if cursor is not None:
+                cursor_created_at = select(Blogs.created_at).where(Blogs.id == cursor).scalar_subquery()
+                query = query.where(newer_than_cursor(Blogs.created_at, Blogs.id, cursor_created_at, cursor))
+            query = query.order_by(Blogs.created_at.desc(), Blogs.id.desc()).limit(limit + 1)
+            blogs = (await db.execute(query)).scalars().all()
+
+        items = blogs[:limit]
+        next_cursor = items[-1].id if len(blogs) > limit else None
+        # No Last-Modified: deletes and tag changes leave max(updated_at) where it was, so only the ETag validates
+        return {"items": items, "next_cursor": next_cursor}, None
+
+    key = await response_cache.list_key("blogs", request)
+    return await response_cache.respond(request, key, load_blogs, BlogPage)
+
+@router.get("/tags", status_code=status.HTTP_200_OK)
+async def tag_cloud(request: Request, db: read_db_dependency, limit: int = Query(default=100, gt=0, le=1000)):
+    async def load_tags():
+        # blog_count is kept current by the blog writes, so this is an index-ordered read, not a GROUP BY
+        rows = await db.execute(select(Tags.name, Tags.blog_count).where(Tags.blog_count > 0)
+                                .order_by(Tags.blog_count.desc(), Tags.name).limit(limit))
+        return [{"tag": name, "count": count} for name, count in rows.all()], None
+
+    key = await response_cache.list_key("tags", request)
+    return await response_cache.respond(request, key, load_tags)
+
+@router.get("/{blog_id}", status_code=status.HTTP_200_OK, response_model=BlogResponse)
+async def single_blog(request: Request, db: read_db_dependency, blog_id: int = Path(gt=0)):
+    async def load_blog():
+        blog_model = await db.get(Blogs, blog_id, options=[undefer(Blogs.content)])
+        if blog_model is None:
+            raise HTTPException(status_code=404, detail="Blog not found")
+        return blog_model, blog_model.updated_at
+
+    key = response_cache.item_key("blogs", blog_id)
+    return await response_cache.respond(request, key, load_blog, BlogResponse)
+
+@router.post("/new_blog", status_code=status.HTTP_201_CREATED, response_model=BlogResponse)
 async def create_blog(db: db_dependency, user: user_dependencty, blog_request: BlogRequest):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
-    blog_model = Blogs(**blog_request.dict(), owner_id=user.get("id"))
+    blog_model = Blogs(**blog_request.dict(), owner_id=user["user_id"])
     db.add(blog_model)
-    db.commit()
+    # Also loads the server-side created_at that blog_tags copies (Blogs uses eager_defaults)
+    await db.flush()
+    tags_changed = await set_blog_tags(db, blog_model, blog_model.tags)
+    await db.commit()
+    await response_cache.invalidate("blogs")
+    if tags_changed:
+        await response_cache.invalidate("tags")
     return blog_model
 
-@router.put("/{blog_id}", status_code=status.HTTP_200_OK)
+@router.put("/{blog_id}", status_code=status.HTTP_200_OK, response_model=BlogResponse)
 async def update_blog(db: db_dependency, user: user_dependencty, blog_request: BlogRequest, blog_id: int = Path(gt=0)):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
-    blog_model = db.query(Blogs).filter(Blogs.id == blog_id).first()
+    blog_model = await db.get(Blogs, blog_id)
     if blog_model is None:
         raise HTTPException(status_code=404, detail="Blog not found")
-    if blog_model.owner_id != user.get("id"):
+    if blog_model.owner_id != user["user_id"]:
         raise HTTPException(status_code=403, detail="You are not authorized to update this blog")
     blog_model.title = blog_request.title
     blog_model.description = blog_request.description
     blog_model.content = blog_request.content
     blog_model.author = blog_request.author
     blog_model.tags = blog_request.tags
-    db.commit()
+    tags_changed = await set_blog_tags(db, blog_model, blog_model.tags)
+    await db.commit()
+    await response_cache.invalidate("blogs", blog_id)
+    if tags_changed:
+        await response_cache.invalidate("tags")
     return blog_model
 
 @router.delete("/{blog_id}", status_code=status.HTTP_200_OK)
 async def delete_blog(db: db_dependency, user: user_dependencty, blog_id: int = Path(gt=0)):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
-    blog_model = db.query(Blogs).filter(Blogs.id == blog_id).first()
+    blog_model = await db.get(Blogs, blog_id)
     if blog_model is None:
         raise HTTPException(status_code=404, detail="Blog not found")
-    if blog_model.owner_id != user.get("id"):
+    if blog_model.owner_id != user["user_id"]:
         raise HTTPException(status_code=403, detail="You are not authorized to delete this blog")
-    db.query(Blogs).filter(Blogs.id == blog_id).delete()
-    db.commit()
+    await clear_blog_tags(db, blog_id)
+    await db.execute(delete(Blogs).where(Blogs.id == blog_id))
+    await db.commit()
+    await response_cache.invalidate("blogs", blog_id)
+    await response_cache.invalidate("tags")
     return {"status": "success", "message": "Blog deleted successfully"}
 
 @router.post("/upload-image", status_code=status.HTTP_200_OK)
 async def upload_blog_image(user: user_dependencty, 
-                          db: db_dependency,
                           file: UploadFile = File(...)):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
     
-    # Validate file type
-    valid_content_types = ["image/jpeg", "image/png", "image/gif", "image/webp"]
-    if file.content_type not in valid_content_types:
-        raise HTTPException(status_code=400, detail="Invalid file type. Only JPEG, PNG, GIF, and WebP are allowed.")
-    
-    # Create a unique filename
-    file_extension = file.filename.split(".")[-1]
-    unique_id = str(uuid.uuid4())
-    filename = f"blog_{unique_id}.{file_extension}"
-    file_path = BLOG_UPLOADS_DIR / filename
-    
-    # Save the file
-    with file_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Streamed to disk, type sniffed from content and stored under its content hash
+    upload = await store_upload(file, "blog_images", allowed_types=("image/jpeg", "image/png", "image/gif", "image/webp"))
+    # Resized and WebP variants are produced off the request path
+    image_pipeline.submit(upload.path)
     
     # Return the URL to the uploaded image
-    return {"image_url": f"/uploads/blog_images/{filename}"}
\ No newline at end of file
+    return {"image_url": upload.url, "srcset": srcset(upload.path)}
\ No newline at end of file
@@ -0,0 +1,126 @@
+import mimetypes
+import os
+import re
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+from starlette.concurrency import run_in_threadpool
+from services import uploads
+
+router = APIRouter(
+    prefix=uploads.UPLOADS_URL,
+    tags=["media"],
+)
+
+# Leave empty to stream from the app, or hand the bytes to a front proxy:
+# "x-accel-redirect" (nginx) or "x-sendfile" (Apache mod_xsendfile, lighttpd)
+MEDIA_OFFLOAD = os.getenv("MEDIA_OFFLOAD", "").lower()
+# nginx `internal` location aliased to the uploads directory
+MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "/_protected_uploads")
+MEDIA_MAX_AGE = int(os.getenv("MEDIA_MAX_AGE", "3600"))
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Upload names are the sha256 of the content, optionally followed by a variant ("<hash>.thumb.webp")
+CONTENT_ADDRESSED = re.compile(r"^[0-9a-f]{64}(\.[a-z]+)?\.[a-z0-9]+$")
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+def cache_control(name: str):
+    if CONTENT_ADDRESSED.match(name):
+        return f"public, max-age={IMMUTABLE_MAX_AGE}, immutable"
+    return f"public, max-age={MEDIA_MAX_AGE}"
+
+def etag_for(name: str, stat_result: os.stat_result, encoding: str = None):
+    # A content-addressed name already is the validator; older names fall back to mtime and size
+    tag = name if CONTENT_ADDRESSED.match(name) else f"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"
+    return f'"{tag}-{encoding}"' if encoding else f'"{tag}"'
+
+def accepted_encodings(request: Request):
+    accepted = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+def not_modified(request: Request, etag: str, stat_result: os.stat_result):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in candidates or etag in candidates
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def resolve(path: str):
+    root = uploads.UPLOADS_ROOT.resolve()
+    parts = Path(path).parts
+    # Dotfiles cover in-progress ".upload-*" temp files and ".<name>.tmp" variant writes
+    if not parts or any(part.startswith(".") for part in parts):
+        return None
+    target = (root / path).resolve()
+    if not target.is_relative_to(root):
+        return None
+    return target
+
+def stat_file(path: Path):
+    try:
+        stat_result = path.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return stat_result if stat.S_ISREG(stat_result.st_mode) else None
+
+def pick_representation(target: Path, encodings: set):
+    # Precompressed siblings ("style.css.br") are written offline; images are served as stored
+    for encoding, suffix in PRECOMPRESSED:
+        if encoding in encodings:
+            sibling = target.with_name(target.name + suffix)
+            stat_result = stat_file(sibling)
+            if stat_result is not None:
+                return sibling, stat_result, encoding
+    stat_result = stat_file(target)
+    if stat_result is None:
+        return None
+    return target, stat_result, None
+
+def offload_headers(target: Path):
+    if MEDIA_OFFLOAD == "x-accel-redirect":
+        relative = target.relative_to(uploads.UPLOADS_ROOT.resolve()).as_posix()
+        return {"X-Accel-Redirect": f"{MEDIA_ACCEL_PREFIX.rstrip('/')}/{relative}"}
+    if MEDIA_OFFLOAD == "x-sendfile":
+        return {"X-Sendfile": str(target)}
+    return None
+
+@router.api_route("/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def serve_media(path: str, request: Request):
+    target = resolve(path)
+    representation = await run_in_threadpool(pick_representation, target, accepted_encodings(request)) \
+        if target is not None else None
+    if representation is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    served, stat_result, encoding = representation
+
+    name = target.name
+    headers = {
+        "Cache-Control": cache_control(name),
+        "ETag": etag_for(name, stat_result, encoding),
+        "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+        "Vary": "Accept-Encoding",
+    }
+    if not_modified(request, headers["ETag"], stat_result):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    offload = offload_headers(served)
+    if offload is not None:
+        # The proxy streams the file and answers Range itself; the app only authorises and labels it
+        return Response(headers={**headers, **offload}, media_type=media_type)
+    # FileResponse handles Range/If-Range and uses http.response.pathsend when the server offers it
+    return FileResponse(served, headers=headers, media_type=media_type, stat_result=stat_result)
@@ -0,0 +1,18 @@
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from services.cache import response_cache
+from services.metrics import CONTENT_TYPE, METRICS_TOKEN, register_cache, registry
+from .auth import profile_cache, token_cache
+
+router = APIRouter(tags=["metrics"])
+
+register_cache("response", response_cache.stats)
+register_cache("token", token_cache.stats)
+register_cache("profile", profile_cache.stats)
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    # Prometheus text exposition; rendered on demand, nothing is computed between scrapes
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
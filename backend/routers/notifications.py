@@ -1,10 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, Path, status
-from typing import Annotated
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, status
+from typing import Annotated, Literal
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from models.models import Blogs
-from settings.database import engine, SessionLocal
-from .auth import get_current_user
+from sqlalchemy import select
+from models.models import NotificationOutbox, Notifications
+from models.users import User
+from settings.database import db_dependency, read_db_dependency
+from services.cache import response_cache
+from services.notifications import (BROADCAST, NOTIFICATION_CHANNELS, UNREAD_NAMESPACE, enqueue_broadcast,
+                                    enqueue_notification, mark_all_read, mark_read, notification_worker,
+                                    notify_committed, outbox_stats, read_through_id, retry_dead, unread_count)
+from .auth import get_current_user, is_admin
+import json
 
 router = APIRouter(
     prefix="/notifications",
@@ -12,26 +19,220 @@ router = APIRouter(
 )
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
 user_dependencty = Annotated[dict, Depends(get_current_user)]
 
+ChannelName = Literal["in_app", "email"]
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
 class NotificationRequest(BaseModel):
     user_id: int = Field(gt=0)
     message: str = Field(min_length=3)
+    title: str | None = Field(default=None, max_length=200)
+    channels: list[ChannelName] = Field(default=list(NOTIFICATION_CHANNELS), min_length=1)
+
+class BroadcastRequest(BaseModel):
+    message: str = Field(min_length=3)
+    title: str | None = Field(default=None, max_length=200)
+    kind: str = Field(default="announcement", min_length=1, max_length=50)
+    channels: list[ChannelName] = Field(default=list(NOTIFICATION_CHANNELS), min_length=1)
+    active_only: bool = True
+
+class NotificationResponse(BaseModel):
+    id: int
+    kind: str
+    title: str | None
+    message: str
+    data: dict | None
+    created_at: datetime | None
+    read: bool
+
+class NotificationPage(BaseModel):
+    items: list[NotificationResponse]
+    next_cursor: int | None
+
+class UnreadCountResponse(BaseModel):
+    unread: int
+
+class ReadResponse(BaseModel):
+    id: int
+    read: bool
+    unread: int
+
+class QueuedNotificationResponse(BaseModel):
+    id: int
+    user_id: int
+    status: str
+
+class QueuedBroadcastResponse(BaseModel):
+    id: int
+    status: str
+
+class BroadcastStatusResponse(BaseModel):
+    id: int
+    status: str
+    notified: int
+    attempts: int
+    last_error: str | None
+    created_at: datetime | None
+    finished_at: datetime | None
+
+class WorkerStats(BaseModel):
+    workers: int
+    sent: int
+    retried: int
+    dead: int
+    expanded: int
+
+class OutboxStatsResponse(BaseModel):
+    # {channel: {status: rows}}
+    outbox: dict[str, dict[str, int]]
+    worker: WorkerStats
+
+class DeadLetterResponse(BaseModel):
+    id: int
+    notification_id: int | None
+    channel: str
+    attempts: int
+    last_error: str | None
+    created_at: datetime | None
 
-@router.post("/new_notification", status_code=status.HTTP_201_CREATED)
+class DeadLetterPage(BaseModel):
+    items: list[DeadLetterResponse]
+    next_cursor: int | None
+
+class RetryResponse(BaseModel):
+    requeued: int
+
+async def require_admin(db, user: dict):
+    if not await is_admin(db, user):
+        raise HTTPException(status_code=403, detail="Only admins can send notifications")
+
+def notification_to_dict(notification: Notifications, watermark: int):
+    return {
+        "id": notification.id,
+        "kind": notification.kind,
+        "title": notification.title,
+        "message": notification.message,
+        "data": json.loads(notification.data) if notification.data else None,
+        "created_at": notification.created_at,
+        "read": notification.read_at is not None or notification.id <= watermark,
+    }
+
+def broadcast_status(row: NotificationOutbox):
+    payload = json.loads(row.payload)
+    return {
+        "id": row.id,
+        "status": row.status,
+        "notified": payload["notified"],
+        "attempts": row.attempts,
+        "last_error": row.last_error,
+        "created_at": row.created_at,
+        "finished_at": row.sent_at,
+    }
+
+@router.get("", status_code=status.HTTP_200_OK, response_model=NotificationPage)
+async def get_notifications(db: read_db_dependency, user: user_dependencty,
+                            cursor: int | None = Query(default=None, gt=0),
+                            limit: int = Query(default=DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE),
+                            unread: bool = False):
+    # Newest first off the (user_id, id) index; the cursor is the last id of the previous page
+    watermark = await read_through_id(db, user["user_id"])
+    query = select(Notifications).where(Notifications.user_id == user["user_id"])
+    if unread:
+        query = query.where(Notifications.id > watermark, Notifications.read_at.is_(None))
+    if cursor is not None:
+        query = query.where(Notifications.id < cursor)
+    rows = (await db.execute(query.order_by(Notifications.id.desc()).limit(limit + 1))).scalars().all()
+    page = rows[:limit]
+    return {
+        "items": [notification_to_dict(notification, watermark) for notification in page],
+        "next_cursor": page[-1].id if len(rows) > limit else None,
+    }
+
+@router.get("/unread-count", status_code=status.HTTP_200_OK, response_model=UnreadCountResponse)
+async def get_unread_count(request: Request, db: read_db_dependency, user: user_dependencty):
+    # Asked on every page view: served from the cache, and from one primary key lookup when not cached
+    async def load():
+        return {"unread": await unread_count(db, user["user_id"])}, None
+    return await response_cache.respond(request, response_cache.item_key(UNREAD_NAMESPACE, user["user_id"]), load)
+
+@router.post("/read-all", status_code=status.HTTP_200_OK, response_model=UnreadCountResponse)
+async def read_all_notifications(db: db_dependency, user: user_dependencty,
+                                 up_to: int | None = Query(default=None, gt=0)):
+    remaining = await mark_all_read(db, user["user_id"], up_to)
+    await db.commit()
+    await response_cache.invalidate_items(UNREAD_NAMESPACE, [user["user_id"]])
+    return {"unread": remaining}
+
+@router.post("/{notification_id}/read", status_code=status.HTTP_200_OK, response_model=ReadResponse)
+async def read_notification(db: db_dependency, user: user_dependencty, notification_id: int = Path(gt=0)):
+    changed = await mark_read(db, user["user_id"], notification_id)
+    if changed is None:
+        raise HTTPException(status_code=404, detail="Notification not found")
+    await db.commit()
+    if changed:
+        await response_cache.invalidate_items(UNREAD_NAMESPACE, [user["user_id"]])
+    return {"id": notification_id, "read": True, "unread": await unread_count(db, user["user_id"])}
+
+@router.post("/new_notification", status_code=status.HTTP_201_CREATED, response_model=QueuedNotificationResponse)
 async def create_notification(db: db_dependency, user: user_dependencty, notification_request: NotificationRequest):
-    users_mails = db.query(Users).filter(Users.id == notification_request.user_id).first()
-    if users_mails is None:
-        raise HTTPException(status_code=401, detail="User not found")
-    notification_model = Notifications(**notification_request.dict(), owner_id=user.get("id"))
-    db.add(notification_model)
-    db.commit()
-    return notification_model
\ No newline at end of file
+    await require_admin(db, user)
+    if await db.get(User, notification_request.user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    # Delivery happens in the workers; the request only records what is owed
+    notification_id = await enqueue_notification(
+        db, notification_request.user_id, "message", notification_request.message, title=notification_request.title,
+        data={"sender_id": user["user_id"]}, channels=list(dict.fromkeys(notification_request.channels)))
+    await db.commit()
+    await notify_committed(notification_request.user_id)
+    return {"id": notification_id, "user_id": notification_request.user_id, "status": "queued"}
+
+@router.post("/broadcast", status_code=status.HTTP_202_ACCEPTED, response_model=QueuedBroadcastResponse)
+async def broadcast(db: db_dependency, user: user_dependencty, broadcast_request: BroadcastRequest):
+    await require_admin(db, user)
+    # A single outbox row whatever the audience size; workers expand it in chunks
+    broadcast_id = await enqueue_broadcast(
+        db, broadcast_request.kind, broadcast_request.message, title=broadcast_request.title,
+        channels=list(dict.fromkeys(broadcast_request.channels)), active_only=broadcast_request.active_only)
+    await db.commit()
+    notification_worker.wake()
+    return {"id": broadcast_id, "status": "queued"}
+
+@router.get("/broadcast/{broadcast_id}", status_code=status.HTTP_200_OK, response_model=BroadcastStatusResponse)
+async def get_broadcast(db: read_db_dependency, user: user_dependencty, broadcast_id: int = Path(gt=0)):
+    await require_admin(db, user)
+    row = await db.get(NotificationOutbox, broadcast_id)
+    if row is None or row.channel != BROADCAST:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+    return broadcast_status(row)
+
+@router.get("/outbox", status_code=status.HTTP_200_OK, response_model=OutboxStatsResponse)
+async def get_outbox_stats(db: read_db_dependency, user: user_dependencty):
+    await require_admin(db, user)
+    return {"outbox": await outbox_stats(db), "worker": notification_worker.stats()}
+
+@router.get("/dead-letters", status_code=status.HTTP_200_OK, response_model=DeadLetterPage)
+async def get_dead_letters(db: read_db_dependency, user: user_dependencty,
+                           cursor: int | None = Query(default=None, gt=0),
+                           limit: int = Query(default=50, gt=0, le=200)):
+    await require_admin(db, user)
+    query = select(NotificationOutbox).where(NotificationOutbox.status == "dead")
+    if cursor is not None:
+        query = query.where(NotificationOutbox.id < cursor)
+    rows = (await db.execute(query.order_by(NotificationOutbox.id.desc()).limit(limit + 1))).scalars().all()
+    page = rows[:limit]
+    return {
+        "items": [{"id": row.id, "notification_id": row.notification_id, "channel": row.channel,
+                   "attempts": row.attempts, "last_error": row.last_error, "created_at": row.created_at}
+                  for row in page],
+        "next_cursor": page[-1].id if len(rows) > limit else None,
+    }
+
+@router.post("/dead-letters/retry", status_code=status.HTTP_200_OK, response_model=RetryResponse)
+async def retry_dead_letters(db: db_dependency, user: user_dependencty, channel: str | None = None):
+    await require_admin(db, user)
+    requeued = await retry_dead(db, channel)
+    await db.commit()
+    notification_worker.wake()
+    return {"requeued": requeued}
@@ -1,79 +1,371 @@
-from fastapi import APIRouter, Depends, HTTPException, Path, status
-from typing import Annotated
+from fastapi import APIRouter, Depends, Header, HTTPException, Path, Query, WebSocket, status
+from fastapi.responses import StreamingResponse
+from typing import Annotated, Literal
+from decimal import Decimal
 from datetime import datetime
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
-from models.models import Products
-from settings.database import engine, SessionLocal
-from .auth import get_current_user
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from models.models import Orders, OrderItems, Products
+from settings.database import AsyncReadSessionLocal, db_dependency, read_db_dependency
+from services.analytics import order_placed, order_removed, order_status_changed, utcnow
+from services.bulk import FORMATS, stream_export
+from services.cache import response_cache
+from services.events import event_hub, order_topic, sse_stream, user_orders_topic, websocket_stream
+from services.notifications import enqueue_notification, notify_committed
+from .auth import get_current_user, get_stream_user, is_admin
+import uuid
 
 router = APIRouter(
     prefix="/orders",
     tags=["orders"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
 user_dependencty = Annotated[dict, Depends(get_current_user)]
+stream_user_dependency = Annotated[dict, Depends(get_stream_user)]
 
-class OrderRequest(BaseModel):
+ORDER_STATUSES = ("pending", "paid", "shipped", "delivered", "cancelled")
+# Statuses an order may move to from each status; cancelled and delivered are final, so stock
+# returned on cancellation can never be handed out a second time
+ORDER_TRANSITIONS = {
+    "pending": ("paid", "shipped", "cancelled"),
+    "paid": ("shipped", "cancelled"),
+    "shipped": ("delivered",),
+    "delivered": (),
+    "cancelled": (),
+}
+# Only admins move orders through fulfilment; owners may still change where an order ships
+ADMIN_ONLY_FIELDS = ("status", "tracking_number")
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+class OrderItemRequest(BaseModel):
     product_id: int = Field(gt=0)
     quantity: int = Field(gt=0)
-    total_price: float = Field(gt=0)
-    user_id: int = Field(gt=0)
-    public_id: str = Field(default="pending")
-    order_id: int = Field(gt=0)
-    order_status: str = Field(default="pending")
-    order_date: datetime = Field(default=datetime.now())
-    order_payment: str = Field(default="pending")
-    order_shipping: str = Field(default="pending")
-    order_address: str = Field(default="pending")
-    order_traking_number: str = Field(default="pending")
-
-@router.post("/create_order", status_code=status.HTTP_201_CREATED)
-async def create_order(db: db_dependency, order_request: OrderRequest, user: user_dependencty):
+
+class OrderRequest(BaseModel):
+    items: list[OrderItemRequest] = Field(min_length=1)
+    shipping_address: str = Field(min_length=3)
+    shipping_cost: Decimal = Field(default=Decimal("0"), ge=0)
+
+class OrderUpdateRequest(BaseModel):
+    status: str | None = Field(default=None, pattern="^(" + "|".join(ORDER_STATUSES) + ")$")
+    shipping_address: str | None = Field(default=None, min_length=3)
+    tracking_number: str | None = Field(default=None, min_length=1)
+
+class OrderItemResponse(BaseModel):
+    product_id: int
+    quantity: int
+    unit_price: float | None
+
+class OrderResponse(BaseModel):
+    id: int
+    order_number: str | None
+    user_id: int | None
+    status: str | None
+    total_amount: float | None
+    shipping_address: str | None
+    shipping_cost: float | None
+    tracking_number: str | None
+    order_date: datetime | None
+    items: list[OrderItemResponse]
+
+class OrderPage(BaseModel):
+    items: list[OrderResponse]
+    next_cursor: int | None
+
+def order_to_dict(order: Orders, items):
+    return {
+        "id": order.id,
+        "order_number": order.order_number,
+        "user_id": order.user_id,
+        "status": order.status,
+        "total_amount": order.total_amount,
+        "shipping_address": order.shipping_address,
+        "shipping_cost": order.shipping_cost,
+        "tracking_number": order.tracking_number,
+        "order_date": order.order_date,
+        "items": [
+            {"product_id": item.product_id, "quantity": item.quantity, "unit_price": item.unit_price}
+            for item in items
+        ],
+    }
+
+async def load_items(db, order_id: int):
+    return (await db.execute(select(OrderItems).where(OrderItems.order_id == order_id))).scalars().all()
+
+async def find_idempotent_order(db, user_id: int, idempotency_key: str):
+    return (await db.execute(
+        select(Orders).where(Orders.user_id == user_id, Orders.idempotency_key == idempotency_key)
+    )).scalar_one_or_none()
+
+async def get_authorized_order(db, user: dict, order_id: int):
+    order_model = await db.get(Orders, order_id)
+    if order_model is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if order_model.user_id != user["user_id"] and not await is_admin(db, user):
+        raise HTTPException(status_code=403, detail="You are not authorized to access this order")
+    return order_model
+
+async def restock(db, items):
+    for item in items:
+        await db.execute(
+            update(Products)
+            .where(Products.id == item.product_id)
+            .values(quantity=Products.quantity + item.quantity)
+        )
+
+def order_event(order: Orders, event_type: str):
+    return {
+        "type": event_type,
+        "order_id": order.id,
+        "order_number": order.order_number,
+        "status": order.status,
+        "tracking_number": order.tracking_number,
+        "updated_at": order.updated_at,
+    }
+
+async def publish_order_event(order: Orders, event_type: str):
+    event = order_event(order, event_type)
+    await event_hub.publish(order_topic(order.id), event)
+    await event_hub.publish(user_orders_topic(order.user_id), event)
+
+async def notify_order(db, order: Orders, kind: str, title: str, message: str):
+    # Queued in the order's own transaction, delivered by the notification workers after commit
+    await enqueue_notification(db, order.user_id, kind, message, title=title,
+                               data={"order_id": order.id, "order_number": order.order_number, "status": order.status})
+
+async def invalidate_products(items):
+    for item in items:
+        await response_cache.invalidate("products", item.product_id)
+
+@router.post("/create_order", status_code=status.HTTP_201_CREATED, response_model=OrderResponse)
+async def create_order(db: db_dependency, order_request: OrderRequest, user: user_dependencty,
+                       idempotency_key: Annotated[str | None, Header(max_length=255)] = None):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
-    order_model = Products(**order_request.dict())
+
+    if idempotency_key is not None:
+        existing = await find_idempotent_order(db, user["user_id"], idempotency_key)
+        if existing is not None:
+            return order_to_dict(existing, await load_items(db, existing.id))
+
+    # Merge repeated lines and lock products in id order so concurrent checkouts cannot deadlock
+    quantities = {}
+    for item in order_request.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+
+    items = []
+    total = Decimal(order_request.shipping_cost)
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        # Conditional decrement: the row only changes if enough stock is left at write time
+        price = (await db.execute(
+            update(Products)
+            .where(Products.id == product_id,
+                   Products.available == True,
+                   Products.quantity >= quantity)
+            .values(quantity=Products.quantity - quantity)
+            .returning(Products.price)
+        )).scalar_one_or_none()
+        if price is None:
+            await db.rollback()
+            raise HTTPException(status_code=409, detail=f"Insufficient stock for product {product_id}")
+        # Through str so a float price keeps its decimal digits instead of its binary expansion
+        unit_price = Decimal(str(price))
+        total += unit_price * quantity
+        items.append(OrderItems(product_id=product_id, quantity=quantity, unit_price=unit_price))
+
+    order_model = Orders(
+        order_number=uuid.uuid4().hex,
+        user_id=user["user_id"],
+        idempotency_key=idempotency_key,
+        total_amount=total,
+        # From the app clock rather than the database's now(), which on Postgres follows the session time zone
+        order_date=utcnow(),
+        status="pending",
+        shipping_address=order_request.shipping_address,
+        shipping_cost=order_request.shipping_cost,
+    )
     db.add(order_model)
-    db.commit()
-    return {"message": "Order created successfully"}
-
-@router.get("", status_code=status.HTTP_200_OK)
-async def get_orders(db: db_dependency):
-    return db.query(Products).all()
-
-@router.get("/{order_id}", status_code=status.HTTP_200_OK)
-async def get_order(db: db_dependency, order_id: int = Path(gt=0)):
-    order_model = db.query(Products).filter(Products.id == order_id).first()
-    if order_model is not None:
-        return order_model
-    raise HTTPException(status_code=404, detail="Order not found")
-
-@router.put("/{order_id}", status_code=status.HTTP_200_OK)
-async def update_order(db: db_dependency, order_request: OrderRequest, order_id: int = Path(gt=0), user: user_dependencty = None):
+    try:
+        await db.flush()
+        for item in items:
+            item.order_id = order_model.id
+        db.add_all(items)
+        await order_placed(db, order_model)
+        await notify_order(db, order_model, "order.placed", "Order placed",
+                           f"We received your order {order_model.order_number}.")
+        await db.commit()
+    except IntegrityError:
+        # A concurrent retry with the same key won the race; its order is the answer
+        await db.rollback()
+        if idempotency_key is None:
+            raise
+        existing = await find_idempotent_order(db, user["user_id"], idempotency_key)
+        if existing is None:
+            # Some other constraint failed; there is no earlier order to answer with
+            raise HTTPException(status_code=409, detail="Order could not be created")
+        return order_to_dict(existing, await load_items(db, existing.id))
+
+    await notify_committed(order_model.user_id)
+    await invalidate_products(items)
+    await db.refresh(order_model)
+    await publish_order_event(order_model, "order.created")
+    return order_to_dict(order_model, items)
+
+@router.get("", status_code=status.HTTP_200_OK, response_model=OrderPage)
+async def get_orders(db: read_db_dependency, user: user_dependencty,
+                     cursor: int | None = Query(default=None, gt=0),
+                     limit: int = Query(default=DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE)):
+    query = select(Orders)
+    if not await is_admin(db, user):
+        query = query.where(Orders.user_id == user["user_id"])
+    if cursor is not None:
+        query = query.where(Orders.id < cursor)
+    orders = (await db.execute(query.order_by(Orders.id.desc()).limit(limit + 1))).scalars().all()
+
+    page = orders[:limit]
+    items_by_order = {order.id: [] for order in page}
+    if page:
+        order_items = (await db.execute(
+            select(OrderItems).where(OrderItems.order_id.in_(items_by_order))
+        )).scalars().all()
+        for item in order_items:
+            items_by_order[item.order_id].append(item)
+    return {
+        "items": [order_to_dict(order, items_by_order[order.id]) for order in page],
+        "next_cursor": page[-1].id if len(orders) > limit else None,
+    }
+
+# One exported row per order line; orders without lines still appear once
+EXPORT_COLUMNS = ("order_id", "order_number", "user_id", "status", "total_amount", "shipping_cost", "order_date",
+                  "product_id", "quantity", "unit_price")
+
+@router.get("/export", status_code=status.HTTP_200_OK)
+async def export_orders(db: read_db_dependency, user: user_dependencty,
+                        format: Literal["ndjson", "csv"] = "ndjson"):
+    query = (
+        select(Orders.id, Orders.order_number, Orders.user_id, Orders.status, Orders.total_amount,
+               Orders.shipping_cost, Orders.order_date, OrderItems.product_id, OrderItems.quantity,
+               OrderItems.unit_price)
+        .outerjoin(OrderItems, OrderItems.order_id == Orders.id)
+        .order_by(Orders.id, OrderItems.id)
+    )
+    if not await is_admin(db, user):
+        query = query.where(Orders.user_id == user["user_id"])
+    return StreamingResponse(stream_export(AsyncReadSessionLocal, query, EXPORT_COLUMNS, format),
+                             media_type=FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="orders.{format}"'})
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+async def subscribe_to_order(db, user: dict, order_id: int):
+    # Subscribed before the snapshot is read so no change can fall in between
+    subscription = event_hub.subscribe(order_topic(order_id))
+    try:
+        order_model = await get_authorized_order(db, user, order_id)
+    except HTTPException:
+        event_hub.unsubscribe(subscription)
+        raise
+    finally:
+        # A stream can stay open for hours; it must not pin a pooled connection
+        await db.close()
+    return subscription, order_event(order_model, "order.snapshot")
+
+@router.get("/events", status_code=status.HTTP_200_OK)
+async def my_order_events(user: stream_user_dependency):
+    subscription = event_hub.subscribe(user_orders_topic(user["user_id"]))
+    return StreamingResponse(sse_stream(subscription), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.get("/{order_id}/events", status_code=status.HTTP_200_OK)
+async def order_events(db: read_db_dependency, user: stream_user_dependency, order_id: int = Path(gt=0)):
+    subscription, snapshot = await subscribe_to_order(db, user, order_id)
+    return StreamingResponse(sse_stream(subscription, snapshot), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.websocket("/ws")
+async def order_updates_socket(websocket: WebSocket, db: read_db_dependency, user: stream_user_dependency,
+                               order_id: int | None = Query(default=None, gt=0)):
+    # One order with ?order_id=, otherwise every order of the connected user
+    if order_id is not None:
+        subscription, snapshot = await subscribe_to_order(db, user, order_id)
+    else:
+        await db.close()
+        subscription, snapshot = event_hub.subscribe(user_orders_topic(user["user_id"])), None
+    await websocket.accept()
+    await websocket_stream(websocket, subscription, snapshot)
+
+@router.get("/{order_id}", status_code=status.HTTP_200_OK, response_model=OrderResponse)
+async def get_order(db: read_db_dependency, user: user_dependencty, order_id: int = Path(gt=0)):
+    order_model = await get_authorized_order(db, user, order_id)
+    return order_to_dict(order_model, await load_items(db, order_id))
+
+@router.put("/{order_id}", status_code=status.HTTP_200_OK, response_model=OrderResponse)
+async def update_order(db: db_dependency, order_request: OrderUpdateRequest, user: user_dependencty, order_id: int = Path(gt=0)):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
-    order_model = db.query(Products).filter(Products.id == order_id).first()
-    if order_model is None:
-        raise HTTPException(status_code=404, detail="Order not found")
-    order_model.update(order_request.dict())
-    db.commit()
-    return {"message": "Order updated successfully"}
+    order_model = await get_authorized_order(db, user, order_id)
+    changes = order_request.model_dump(exclude_none=True)
+    if any(field in changes for field in ADMIN_ONLY_FIELDS) and not await is_admin(db, user):
+        raise HTTPException(status_code=403, detail="Only admins can change an order's status or tracking number")
+    new_status = changes.get("status", order_model.status)
+    if new_status != order_model.status and new_status not in ORDER_TRANSITIONS.get(order_model.status, ()):
+        raise HTTPException(status_code=409,
+                            detail=f"An order cannot go from {order_model.status} to {new_status}")
+    items = await load_items(db, order_id)
+
+    old_status, pushed = order_model.status, (order_model.status, order_model.tracking_number)
+    if changes:
+        # Conditional on the status read above: a concurrent change or delete leaves nothing to update,
+        # so each transition returns stock and records sales at most once
+        result = await db.execute(
+            update(Orders).where(Orders.id == order_id, Orders.status == old_status).values(**changes))
+        if result.rowcount != 1:
+            raise HTTPException(status_code=409, detail="The order was changed meanwhile; reload it and try again")
+    restocked = new_status == "cancelled" and old_status != "cancelled"
+    if restocked:
+        await restock(db, items)
+    status_changed = new_status != old_status
+    if status_changed:
+        await order_status_changed(db, order_model, old_status)
+        await notify_order(db, order_model, "order.status_changed", "Order update",
+                           f"Your order {order_model.order_number} is now {order_model.status}.")
+    await db.commit()
+    if status_changed:
+        await notify_committed(order_model.user_id)
+    if restocked:
+        await invalidate_products(items)
+    await db.refresh(order_model)
+    # Trackers only hear about changes they display
+    if (order_model.status, order_model.tracking_number) != pushed:
+        await publish_order_event(order_model, "order.updated")
+    return order_to_dict(order_model, items)
 
-@router.delete("/{order_id}", status_code=status.HTTP_200_OK, dependencies=[Depends(get_current_user)])
-async def delete_order(db: db_dependency, order_id: int = Path(gt=0), user: user_dependencty = None):
+@router.delete("/{order_id}", status_code=status.HTTP_200_OK)
+async def delete_order(db: db_dependency, user: user_dependencty, order_id: int = Path(gt=0)):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
-    order_model = db.query(Products).filter(Products.id == order_id).first()
-    if order_model is None:
-        raise HTTPException(status_code=404, detail="Order not found")
-    db.query(Products).filter(Products.id == order_id).delete()
-    db.commit()
-    return {"message": "Order deleted successfully"}
\ No newline at end of file
+    order_model = await get_authorized_order(db, user, order_id)
+    # Owners may withdraw an order nobody has acted on yet; anything further along is left to admins
+    deletable = ORDER_STATUSES if await is_admin(db, user) else ("pending",)
+    if order_model.status not in deletable:
+        raise HTTPException(status_code=403, detail=f"Only admins can delete a {order_model.status} order")
+    items = await load_items(db, order_id)
+    await db.execute(delete(OrderItems).where(OrderItems.order_id == order_id))
+    # Conditional on the status read above, like update_order; stock and sales go by the status actually removed
+    removed_status = (await db.execute(
+        delete(Orders).where(Orders.id == order_id, Orders.status == order_model.status,
+                             Orders.status.in_(deletable)).returning(Orders.status)
+    )).scalar_one_or_none()
+    if removed_status is None:
+        raise HTTPException(status_code=409, detail="The order was changed meanwhile; reload it and try again")
+    # Stock held by an open order goes back on the shelf; a cancelled order's stock already went back
+    restocked = removed_status in ("pending", "paid")
+    if restocked:
+        await restock(db, items)
+    await order_removed(db, order_model, removed_status)
+    await db.commit()
+    if restocked:
+        await invalidate_products(items)
+    await publish_order_event(order_model, "order.deleted")
+    return {"message": "Order deleted successfully"}
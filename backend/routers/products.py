@@ -1,24 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, Path, status
-from typing import Annotated
-from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, status
+from fastapi.responses import StreamingResponse
+from typing import Annotated, Literal
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import SQLAlchemyError
 from models.models import Products
-from settings.database import engine, SessionLocal
-from .auth import get_current_user
+from settings.database import AsyncReadSessionLocal, db_dependency, read_db_dependency
+from services.bulk import (BULK_BATCH_SIZE, FORMATS, MAX_BULK_BATCH_SIZE, MAX_REPORTED_ERRORS, detect_format,
+                           iter_records, stream_export)
+from services.cache import response_cache
+from .auth import get_current_user, is_admin
 
 router = APIRouter(
     prefix="/products",
     tags=["products"]
 )
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
 user_dependencty = Annotated[dict, Depends(get_current_user)]
 
 class ProductRequest(BaseModel):
@@ -27,51 +24,222 @@ class ProductRequest(BaseModel):
     price: float = Field(gt=0)
     stock: int = Field(gt=0)
 
-@router.get("", status_code=status.HTTP_200_OK)
-async def all_products(db: db_dependency):
-    return db.query(Products).all()
+class ProductImportRow(ProductRequest):
+    stock: int = Field(ge=0)
+    available: bool = True
+
+class ProductResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+    id: int
+    product_name: str | None
+    description: str | None
+    price: int | float | None
+    available: bool | None
+    quantity: int | None
+    owner_id: int | None
+
+class ProductListItem(BaseModel):
+    # `fields` projects columns away, so only the id is always present
+    id: int
+    product_name: str | None = None
+    description: str | None = None
+    price: int | float | None = None
+    available: bool | None = None
+    quantity: int | None = None
+    owner_id: int | None = None
+
+class ProductPage(BaseModel):
+    items: list[ProductListItem]
+    next_cursor: int | None
+
+# Exported rows use the column names; imports accept them so an export can be loaded back
+IMPORT_ALIASES = {"product_name": "name", "quantity": "stock"}
+
+def product_values(product_request: ProductRequest):
+    # The request speaks name/stock; the table stores product_name/quantity
+    return {
+        "product_name": product_request.name,
+        "description": product_request.description,
+        "price": product_request.price,
+        "quantity": product_request.stock,
+    }
+
+# Columns a client may request through the `fields` projection
+PRODUCT_FIELDS = ("id", "product_name", "description", "price", "available", "quantity", "owner_id")
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def parse_fields(fields: str | None):
+    if not fields:
+        return list(PRODUCT_FIELDS)
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in PRODUCT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    # The id is always returned because it is the pagination cursor
+    return ["id"] + [field for field in dict.fromkeys(requested) if field != "id"]
+
+@router.get("", status_code=status.HTTP_200_OK, response_model=ProductPage)
+async def all_products(request: Request,
+                       db: read_db_dependency,
+                       cursor: int | None = Query(default=None, gt=0),
+                       limit: int = Query(default=DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE),
+                       min_price: int | None = Query(default=None, ge=0),
+                       max_price: int | None = Query(default=None, ge=0),
+                       available: bool | None = None,
+                       owner_id: int | None = Query(default=None, gt=0),
+                       fields: str | None = None):
+    columns = parse_fields(fields)
+
+    async def load_page():
+        query = select(*[getattr(Products, column) for column in columns])
+        if min_price is not None:
+            query = query.where(Products.price >= min_price)
+        if max_price is not None:
+            query = query.where(Products.price <= max_price)
+        if available is not None:
+            query = query.where(Products.available == available)
+        if owner_id is not None:
+            query = query.where(Products.owner_id == owner_id)
+        if cursor is not None:
+            query = query.where(Products.id > cursor)
+
+        # Fetch one extra row to know whether another page exists
+        rows = (await db.execute(query.order_by(Products.id).limit(limit + 1))).mappings().all()
+        items = [dict(row) for row in rows[:limit]]
+        next_cursor = items[-1]["id"] if len(rows) > limit else None
+        return {"items": items, "next_cursor": next_cursor}, None
+
+    # Rows are already plain dicts of the projected columns, so they go straight to orjson
+    key = await response_cache.list_key("products", request)
+    return await response_cache.respond(request, key, load_page)
 
-@router.get("/{product_id}", status_code=status.HTTP_200_OK)
-async def single_product(db: db_dependency, product_id: int = Path(gt=0)):
-    product_model = db.query(Products).filter(Products.id == product_id).first()
-    if product_model is not None:
-        return product_model
-    raise HTTPException(status_code=404, detail="Product not found")
+@router.get("/export", status_code=status.HTTP_200_OK)
+async def export_products(db: read_db_dependency, user: user_dependencty,
+                          format: Literal["ndjson", "csv"] = "ndjson"):
+    if user is None or not await is_admin(db, user):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    columns = list(PRODUCT_FIELDS)
+    query = select(*[getattr(Products, column) for column in columns]).order_by(Products.id)
+    return StreamingResponse(stream_export(AsyncReadSessionLocal, query, columns, format), media_type=FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="products.{format}"'})
 
-@router.post("/new_product", status_code=status.HTTP_201_CREATED)
+@router.get("/{product_id}", status_code=status.HTTP_200_OK, response_model=ProductResponse)
+async def single_product(request: Request, db: read_db_dependency, product_id: int = Path(gt=0)):
+    async def load_product():
+        product_model = await db.get(Products, product_id)
+        if product_model is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return product_model, None
+
+    key = response_cache.item_key("products", product_id)
+    return await response_cache.respond(request, key, load_product, ProductResponse)
+
+@router.post("/new_product", status_code=status.HTTP_201_CREATED, response_model=ProductResponse)
 async def create_product(db: db_dependency, user: user_dependencty, product_request: ProductRequest):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
-    product_model = Products(**product_request.dict(), owner_id=user.get("id"))
+    product_model = Products(**product_values(product_request), owner_id=user["user_id"])
     db.add(product_model)
-    db.commit()
+    await db.commit()
+    await response_cache.invalidate("products")
     return product_model
 
-@router.put("/{product_id}", status_code=status.HTTP_200_OK)
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def fail(self, line: int, error: str):
+        # Every failure is counted, only the first MAX_REPORTED_ERRORS are kept
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+    def summary(self):
+        return {"inserted": self.inserted, "failed": self.failed, "errors": self.errors,
+                "errors_truncated": self.failed > len(self.errors)}
+
+async def insert_batch(db, rows, report: ImportReport):
+    # One executemany and one commit per batch; a failing batch is retried row by row to find the culprit
+    try:
+        await db.execute(insert(Products), [values for _, values in rows])
+        await db.commit()
+        report.inserted += len(rows)
+        return
+    except SQLAlchemyError:
+        await db.rollback()
+    for line, values in rows:
+        try:
+            await db.execute(insert(Products), [values])
+            await db.commit()
+            report.inserted += 1
+        except SQLAlchemyError as exc:
+            await db.rollback()
+            report.fail(line, str(getattr(exc, "orig", None) or exc))
+
+def validation_message(exc: ValidationError):
+    return "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors())
+
+@router.post("/bulk", status_code=status.HTTP_200_OK)
+async def bulk_create_products(request: Request, db: db_dependency, user: user_dependencty,
+                               batch_size: int = Query(default=BULK_BATCH_SIZE, gt=0, le=MAX_BULK_BATCH_SIZE),
+                               format: Literal["ndjson", "csv"] | None = None):
+    if user is None:
+        raise HTTPException(status_code=401, detail="Authentication failed")
+    if not await is_admin(db, user):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    # The admin lookup must not hold a transaction open while the body streams in
+    await db.rollback()
+
+    report = ImportReport()
+    batch = []
+    async for line, record in iter_records(request.stream(), detect_format(request.headers.get("content-type"), format)):
+        if isinstance(record, str):
+            report.fail(line, record)
+            continue
+        try:
+            row = ProductImportRow.model_validate({IMPORT_ALIASES.get(key, key): value for key, value in record.items()})
+        except ValidationError as exc:
+            report.fail(line, validation_message(exc))
+            continue
+        batch.append((line, {**product_values(row), "available": row.available, "owner_id": user["user_id"]}))
+        if len(batch) >= batch_size:
+            await insert_batch(db, batch, report)
+            batch = []
+    if batch:
+        await insert_batch(db, batch, report)
+
+    if report.inserted:
+        await response_cache.invalidate("products")
+    return report.summary()
+
+@router.put("/{product_id}", status_code=status.HTTP_200_OK, response_model=ProductResponse)
 async def update_product(db: db_dependency, user: user_dependencty, product_request: ProductRequest, product_id: int = Path(gt=0)):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
-    product_model = db.query(Products).filter(Products.id == product_id).first()
+    product_model = await db.get(Products, product_id)
     if product_model is None:
         raise HTTPException(status_code=404, detail="Product not found")
-    if product_model.owner_id != user.get("id"):
+    if product_model.owner_id != user["user_id"]:
         raise HTTPException(status_code=403, detail="You are not authorized to update this product")
-    product_model.name = product_request.name
-    product_model.description = product_request.description
-    product_model.price = product_request.price
-    product_model.stock = product_request.stock
-    db.commit()
+    for column, value in product_values(product_request).items():
+        setattr(product_model, column, value)
+    await db.commit()
+    await response_cache.invalidate("products", product_id)
     return product_model
 
 @router.delete("/{product_id}", status_code=status.HTTP_200_OK)
 async def delete_product(db: db_dependency, user: user_dependencty, product_id: int = Path(gt=0)):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication failed")
-    product_model = db.query(Products).filter(Products.id == product_id).first()
+    product_model = await db.get(Products, product_id)
     if product_model is None:
         raise HTTPException(status_code=404, detail="Product not found")
-    if product_model.owner_id != user.get("id"):
+    if product_model.owner_id != user["user_id"]:
         raise HTTPException(status_code=403, detail="You are not authorized to delete this product")
-    db.query(Products).filter(Products.id == product_id).delete()
-    db.commit()
+    await db.execute(delete(Products).where(Products.id == product_id))
+    await db.commit()
+    await response_cache.invalidate("products", product_id)
     return {"message": "Product deleted successfully"}  
\ No newline at end of file
@@ -0,0 +1,40 @@
+from typing import Literal
+from fastapi import APIRouter, HTTPException, Query, status
+from settings.database import read_db_dependency
+from services.search import SEARCH_DIALECTS, SEARCH_KINDS, search, tag_facets
+
+router = APIRouter(
+    prefix="/search",
+    tags=["search"]
+)
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Ranked results page by offset; deep pages are not useful and cost a full sort
+MAX_OFFSET = 1000
+
+@router.get("", status_code=status.HTTP_200_OK)
+async def search_all(db: read_db_dependency,
+                     q: str = Query(min_length=1, max_length=200),
+                     type: Literal["all", "blog", "product"] = "all",
+                     prefix: bool = True,
+                     limit: int = Query(default=DEFAULT_PAGE_SIZE, gt=0, le=MAX_PAGE_SIZE),
+                     offset: int = Query(default=0, ge=0, le=MAX_OFFSET),
+                     facets: bool = False):
+    if db.bind.dialect.name not in SEARCH_DIALECTS:
+        raise HTTPException(status_code=501, detail="Full-text search requires SQLite FTS5 or PostgreSQL")
+    kinds = tuple(SEARCH_KINDS) if type == "all" else (type,)
+    results = await search(db, q, kinds=kinds, limit=limit, offset=offset, prefix=prefix)
+    if facets and "blog" in kinds:
+        results["facets"] = await tag_facets(db, q, prefix=prefix)
+    return results
+
+@router.get("/suggest", status_code=status.HTTP_200_OK)
+async def suggest(db: read_db_dependency,
+                  q: str = Query(min_length=1, max_length=100),
+                  limit: int = Query(default=8, gt=0, le=20)):
+    # Typeahead: the last word is matched as a prefix and only ids and titles are returned
+    if db.bind.dialect.name not in SEARCH_DIALECTS:
+        raise HTTPException(status_code=501, detail="Full-text search requires SQLite FTS5 or PostgreSQL")
+    results = await search(db, q, limit=limit, prefix=True)
+    return [{"type": item["type"], "id": item["id"], "title": item["title"]} for item in results["items"]]
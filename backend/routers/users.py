@@ -1,31 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, status, File, UploadFile
-from sqlalchemy.orm import Session
+from sqlalchemy import or_, select
 from typing_extensions import Annotated
 from models.users import User
-from settings.database import SessionLocal
-from routers.auth import get_current_user
-import shutil
-import os
+from settings.database import db_dependency, read_db_dependency
+from routers.auth import UserResponse, get_current_user, get_cached_profile, cache_profile, invalidate_profile
 from pydantic import BaseModel
-from pathlib import Path
+from services.uploads import store_upload
+from services.images import image_pipeline, srcset
 
 router = APIRouter(
     prefix="/users",
     tags=["users"],
 )
 
-# Create uploads directory if it doesn't exist
-UPLOADS_DIR = Path("uploads/profile_pictures")
-UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-db_dependency = Annotated[Session, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 
 class UpdateProfileRequest(BaseModel):
@@ -34,17 +21,21 @@ class UpdateProfileRequest(BaseModel):
     first_name: str
     last_name: str
 
-@router.get("/me", status_code=status.HTTP_200_OK)
-async def get_user(user: user_dependency, db: db_dependency):
+@router.get("/me", status_code=status.HTTP_200_OK, response_model=UserResponse)
+async def get_user(user: user_dependency, db: read_db_dependency):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication required")
+
+    profile = get_cached_profile(user["user_id"])
+    if profile is not None:
+        return profile
     
-    user_model = db.query(User).filter(User.id == user["user_id"]).first()
+    user_model = await db.get(User, user["user_id"])
     
     if user_model is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return {
+    profile = {
         "id": user_model.id,
         "username": user_model.username,
         "email": user_model.email,
@@ -53,29 +44,34 @@ async def get_user(user: user_dependency, db: db_dependency):
         "role": user_model.role,
         "profile_picture": user_model.profile_picture
     }
+    cache_profile(user_model.id, profile)
+    return profile
 
-@router.put("/profile", status_code=status.HTTP_200_OK)
+@router.put("/profile", status_code=status.HTTP_200_OK, response_model=UserResponse)
 async def update_profile(user: user_dependency, 
                         db: db_dependency,
                         profile_data: UpdateProfileRequest):
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication required")
     
-    user_model = db.query(User).filter(User.id == user["user_id"]).first()
+    user_model = await db.get(User, user["user_id"])
     
     if user_model is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Check if username already exists (if changed)
-    if profile_data.username != user_model.username:
-        existing_user = db.query(User).filter(User.username == profile_data.username).first()
-        if existing_user:
+    # Username and email (whichever changed) are checked for clashes in a single lookup
+    username_changed = profile_data.username != user_model.username
+    email_changed = profile_data.email != user_model.email
+    clashes = []
+    if username_changed:
+        clashes.append(User.username == profile_data.username)
+    if email_changed:
+        clashes.append(User.email == profile_data.email)
+    if clashes:
+        taken = (await db.execute(select(User.username, User.email).where(or_(*clashes)))).all()
+        if username_changed and any(row.username == profile_data.username for row in taken):
             raise HTTPException(status_code=400, detail="Username already exists")
-    
-    # Check if email already exists (if changed)
-    if profile_data.email != user_model.email:
-        existing_user = db.query(User).filter(User.email == profile_data.email).first()
-        if existing_user:
+        if email_changed and any(row.email == profile_data.email for row in taken):
             raise HTTPException(status_code=400, detail="Email already exists")
     
     user_model.username = profile_data.username
@@ -83,7 +79,8 @@ async def update_profile(user: user_dependency,
     user_model.first_name = profile_data.first_name
     user_model.last_name = profile_data.last_name
     
-    db.commit()
+    await db.commit()
+    await invalidate_profile(user_model.id)
     
     return {
         "id": user_model.id,
@@ -102,27 +99,19 @@ async def upload_profile_picture(user: user_dependency,
     if user is None:
         raise HTTPException(status_code=401, detail="Authentication required")
     
-    user_model = db.query(User).filter(User.id == user["user_id"]).first()
+    user_model = await db.get(User, user["user_id"])
     
     if user_model is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Validate file type
-    valid_content_types = ["image/jpeg", "image/png", "image/gif"]
-    if file.content_type not in valid_content_types:
-        raise HTTPException(status_code=400, detail="Invalid file type. Only JPEG, PNG, and GIF are allowed.")
-    
-    # Create a unique filename
-    file_extension = file.filename.split(".")[-1]
-    filename = f"user_{user_model.id}.{file_extension}"
-    file_path = UPLOADS_DIR / filename
-    
-    # Save the file
-    with file_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Streamed to disk, type sniffed from content and stored under its content hash
+    upload = await store_upload(file, "profile_pictures", allowed_types=("image/jpeg", "image/png", "image/gif"))
+    # Resized and WebP variants are produced off the request path
+    image_pipeline.submit(upload.path)
     
     # Update the user's profile picture field
-    user_model.profile_picture = f"/uploads/profile_pictures/{filename}"
-    db.commit()
+    user_model.profile_picture = upload.url
+    await db.commit()
+    await invalidate_profile(user_model.id)
     
-    return {"profile_picture": user_model.profile_picture}
\ No newline at end of file
+    return {"profile_picture": user_model.profile_picture, "srcset": srcset(upload.path)}
\ No newline at end of file
@@ -0,0 +1,208 @@
+"""Production launcher: pre-forked uvicorn workers sharing one listening socket.
+
+The master applies pending migrations and imports the app once before forking,
+so workers only check the schema version and share the loaded code and the
+OpenAPI document copy-on-write. It then restarts any worker that dies and, on
+SIGTERM or SIGINT, stops them all, letting in-flight requests finish for up to
+--graceful-timeout seconds.
+
+    python serve.py --workers 4 --port 8000
+
+`python main.py` stays the single-process development server with reload.
+State that must agree across workers lives behind URLs: CACHE_URL and
+RATE_LIMIT_URL (Redis), EVENTS_URL (Redis, or Postgres LISTEN/NOTIFY).
+"""
+import argparse
+import logging
+import os
+import random
+import signal
+import sys
+import time
+
+import uvicorn
+
+logger = logging.getLogger("storeapp.serve")
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+# Same variable uvicorn and gunicorn read
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+# A worker exiting sooner than this after start is restarted only after a pause, not in a tight loop
+RESTART_BACKOFF = 1.0
+
+
+def warm_up():
+    # Everything done here is done once instead of once per worker
+    from settings.migrations import ensure_schema
+
+    applied = ensure_schema()
+    if applied:
+        logger.info("applied migrations %s", ", ".join(applied))
+    import main
+    from services.cache import CACHE_URL
+    from services.events import event_hub
+    from services.limits import RATE_LIMIT_ENABLED, RATE_LIMIT_URL
+    from settings.database import async_engine, async_read_engine, engine
+
+    main.app.openapi()
+    # Connections opened so far must not be shared with the children
+    engine.dispose()
+    async_engine.sync_engine.dispose()
+    async_read_engine.sync_engine.dispose()
+    return main.app, {
+        "CACHE_URL": CACHE_URL.startswith("memory://"),
+        "RATE_LIMIT_URL": RATE_LIMIT_ENABLED and RATE_LIMIT_URL.startswith("memory://"),
+        "EVENTS_URL": not event_hub.shared,
+    }
+
+
+def warn_per_worker_state(per_worker: dict, workers: int):
+    if workers < 2:
+        return
+    if per_worker["EVENTS_URL"]:
+        logger.warning("EVENTS_URL is in-process: live order and notification streams only see events from "
+                       "their own worker, and cache invalidations stay on the worker that made them. "
+                       "Point it at Redis or at the Postgres DATABASE_URL")
+    if per_worker["RATE_LIMIT_URL"]:
+        logger.warning("RATE_LIMIT_URL is in-process: each of the %d workers allows the full rate", workers)
+    if per_worker["CACHE_URL"] and not per_worker["EVENTS_URL"]:
+        logger.info("CACHE_URL is in-process: each worker caches on its own; invalidations are shared "
+                    "through EVENTS_URL")
+
+
+def run_worker(config: uvicorn.Config, sock):
+    from settings.database import async_engine, async_read_engine, engine
+
+    # Pools copied from the master are dropped without touching the master's connections
+    for pool_engine in (engine, async_engine.sync_engine, async_read_engine.sync_engine):
+        pool_engine.dispose(close=False)
+    random.seed()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+    # uvicorn installs its own SIGTERM/SIGINT handlers: stop accepting, drain, then run the shutdown lifespan
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+    # Same status uvicorn exits with when the app fails to start
+    return 0 if server.started else 3
+
+
+class Master:
+    def __init__(self, config: uvicorn.Config, sock, workers: int, graceful_timeout: float):
+        self.config = config
+        self.sock = sock
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.children = {}
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = run_worker(self.config, self.sock)
+            except BaseException:
+                logger.exception("worker %d failed", os.getpid())
+            finally:
+                logging.shutdown()
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+        logger.info("started worker %d", pid)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+
+    def reap(self):
+        # Returns how long the restarted workers had been running, shortest first
+        lifetimes = []
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            started = self.children.pop(pid, None)
+            if started is not None:
+                log = logger.info if self.stopping else logger.warning
+                log("worker %d exited with status %d", pid, os.waitstatus_to_exitcode(status))
+                lifetimes.append(time.monotonic() - started)
+        return sorted(lifetimes)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for _ in range(self.workers):
+            self.spawn()
+        while not self.stopping:
+            time.sleep(0.5)
+            lifetimes = self.reap()
+            if lifetimes and not self.stopping:
+                if lifetimes[0] < RESTART_BACKOFF:
+                    time.sleep(RESTART_BACKOFF)
+                for _ in lifetimes:
+                    self.spawn()
+        self.shutdown()
+
+    def shutdown(self):
+        logger.info("stopping %d workers", len(self.children))
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        # uvicorn's own graceful timeout bounds the drain; the lifespan shutdown gets a few seconds more
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while self.children and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.reap()
+        for pid in self.children:
+            logger.warning("worker %d did not stop in time, killing it", pid)
+            os.kill(pid, signal.SIGKILL)
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    parser.add_argument("--graceful-timeout", type=float, default=GRACEFUL_TIMEOUT,
+                        help="seconds workers get to finish in-flight requests on shutdown")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-access-log", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper(), format="%(asctime)s %(process)d %(levelname)s %(message)s")
+
+    if not hasattr(os, "fork"):
+        # No pre-forking here (Windows): uvicorn's spawn-based workers each import the app themselves
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers,
+                    timeout_graceful_shutdown=args.graceful_timeout, log_level=args.log_level,
+                    access_log=not args.no_access_log)
+        return
+
+    from settings.migrations import SchemaOutOfDate
+
+    started = time.perf_counter()
+    try:
+        app, per_worker = warm_up()
+    except SchemaOutOfDate as error:
+        sys.exit(f"serve.py: {error}")
+    logger.info("app loaded in %.2fs", time.perf_counter() - started)
+    warn_per_worker_state(per_worker, args.workers)
+
+    config = uvicorn.Config(app, host=args.host, port=args.port, log_level=args.log_level,
+                            access_log=not args.no_access_log, timeout_graceful_shutdown=args.graceful_timeout)
+    sock = config.bind_socket()
+    if args.workers <= 1:
+        # Single worker: serve from this process, with the same graceful shutdown
+        uvicorn.Server(config).run(sockets=[sock])
+        return
+    Master(config, sock, args.workers, args.graceful_timeout).run()
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    main()
@@ -0,0 +1,25 @@
+import argparse
+
+from sqlalchemy import update
+from models.users import User
+from settings.database import SessionLocal
+
+
+def set_role(username: str, role: str):
+    # Roles are only ever set here, never from a request body; /users/me shows the change once its cache expires
+    with SessionLocal() as db:
+        changed = db.execute(update(User).where(User.username == username).values(role=role)).rowcount
+        db.commit()
+    return bool(changed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage user accounts")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    set_role_parser = subcommands.add_parser("set-role", help="give a user a role, e.g. admin")
+    set_role_parser.add_argument("username")
+    set_role_parser.add_argument("role")
+    args = parser.parse_args()
+    if not set_role(args.username, args.role):
+        parser.exit(1, f"no user named {args.username}\n")
+    print(f"{args.username} is now {args.role}")
@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models.models import Orders, Products, SalesRollupDeltas, SalesRollups
+from settings.database import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Seconds between compaction runs inside the app; 0 leaves compaction to `python -m services.analytics compact`
+ANALYTICS_COMPACT_INTERVAL = float(os.getenv("ANALYTICS_COMPACT_INTERVAL", "30"))
+ANALYTICS_COMPACT_BATCH = int(os.getenv("ANALYTICS_COMPACT_BATCH", "5000"))
+# Stats reads fold the deltas in themselves once more than this many are pending, so a stopped or
+# lagging compactor cannot make them scan an ever-growing table
+ANALYTICS_MAX_PENDING = int(os.getenv("ANALYTICS_MAX_PENDING", "10000"))
+LOW_STOCK_THRESHOLD = int(os.getenv("LOW_STOCK_THRESHOLD", "10"))
+
+PERIODS = ("hour", "day", "all")
+# The one bucket of the "all" period
+ALL_TIME = datetime(1970, 1, 1)
+# Orders in these statuses do not count towards revenue
+NON_REVENUE_STATUSES = ("cancelled",)
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def as_utc(moment: datetime):
+    # Rollups store naive UTC; times with an offset are converted, naive ones are taken as UTC already
+    return moment.astimezone(timezone.utc).replace(tzinfo=None) if moment.tzinfo is not None else moment
+
+
+def bucket_start(moment: datetime, period: str):
+    if period == "all":
+        return ALL_TIME
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if period == "day" else moment
+
+
+async def record_sales(db, changes):
+    # `changes` are (order_date, status, orders, revenue); written in the caller's transaction
+    rows = [{"bucket": bucket_start(order_date or utcnow(), "hour"), "status": status, "orders": orders,
+             "revenue": Decimal(revenue or 0)} for order_date, status, orders, revenue in changes]
+    if rows:
+        await db.execute(insert(SalesRollupDeltas), rows)
+
+
+async def order_placed(db, order: Orders):
+    # create_order sets order_date from utcnow(), so placing, status changes and rebuild() all bucket by it
+    await record_sales(db, [(order.order_date, order.status, 1, order.total_amount)])
+
+
+async def order_status_changed(db, order: Orders, old_status: str):
+    # Called after the guarded UPDATE matched `old_status`, so the change is recorded exactly once
+    await record_sales(db, [(order.order_date, old_status, -1, -(order.total_amount or 0)),
+                            (order.order_date, order.status, 1, order.total_amount)])
+
+
+async def order_removed(db, order: Orders, status: str):
+    # `status` is what the guarded DELETE returned, not what the request read earlier
+    await record_sales(db, [(order.order_date, status, -1, -(order.total_amount or 0))])
+
+
+def expand(hourly):
+    # {(hour, status): [orders, revenue]} -> rollup rows for every period
+    totals = defaultdict(lambda: [0, Decimal(0)])
+    for (hour, status), (orders, revenue) in hourly.items():
+        for period in PERIODS:
+            total = totals[(period, bucket_start(hour, period), status)]
+            total[0] += orders
+            total[1] += Decimal(revenue)
+    return [{"period": period, "bucket": bucket, "status": status, "orders": orders, "revenue": revenue}
+            for (period, bucket, status), (orders, revenue) in totals.items() if orders or revenue]
+
+
+def merge_rollups(connection, rows):
+    # Adds to existing rollup rows; `connection` is a sync Connection or Session
+    if not rows:
+        return
+    table = SalesRollups.__table__
+    dialect_name = connection.get_bind().dialect.name if hasattr(connection, "get_bind") else connection.dialect.name
+    dialect = {"sqlite": sqlite, "postgresql": postgresql}.get(dialect_name)
+    if dialect is not None:
+        statement = dialect.insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.period, table.c.bucket, table.c.status],
+            set_={"orders": table.c.orders + statement.excluded.orders,
+                  "revenue": table.c.revenue + statement.excluded.revenue})
+        connection.execute(statement, rows)
+        return
+    for row in rows:
+        key = (table.c.period == row["period"], table.c.bucket == row["bucket"], table.c.status == row["status"])
+        result = connection.execute(update(table).where(*key).values(orders=table.c.orders + row["orders"],
+                                                                     revenue=table.c.revenue + row["revenue"]))
+        if not result.rowcount:
+            connection.execute(insert(table).values(**row))
+
+
+async def compact(db, batch_size: int = ANALYTICS_COMPACT_BATCH):
+    # Deleting with RETURNING claims the deltas, so two compactors never fold the same row twice
+    oldest = select(SalesRollupDeltas.id).order_by(SalesRollupDeltas.id).limit(batch_size)
+    claimed = (await db.execute(
+        delete(SalesRollupDeltas).where(SalesRollupDeltas.id.in_(oldest))
+        .returning(SalesRollupDeltas.bucket, SalesRollupDeltas.status, SalesRollupDeltas.orders,
+                   SalesRollupDeltas.revenue)
+        .execution_options(synchronize_session=False)
+    )).all()
+    hourly = defaultdict(lambda: [0, Decimal(0)])
+    for bucket, status, orders, revenue in claimed:
+        total = hourly[(bucket, status)]
+        total[0] += orders
+        total[1] += Decimal(revenue)
+    await db.run_sync(merge_rollups, expand(hourly))
+    return len(claimed)
+
+
+def rebuild(connection):
+    # Recomputes every rollup from the orders table: a full scan, for first setup and repairs
+    connection.execute(delete(SalesRollups))
+    connection.execute(delete(SalesRollupDeltas))
+    hourly = defaultdict(lambda: [0, Decimal(0)])
+    result = connection.execute(
+        select(Orders.order_date, Orders.status, Orders.total_amount).execution_options(yield_per=10000))
+    for order_date, status, total_amount in result:
+        total = hourly[(bucket_start(order_date or utcnow(), "hour"), status)]
+        total[0] += 1
+        total[1] += Decimal(total_amount or 0)
+    rows = expand(hourly)
+    merge_rollups(connection, rows)
+    return len(rows)
+
+
+def _series(rows):
+    # Rollup rows of one period (plus pending deltas) -> per-bucket totals, oldest first
+    buckets = defaultdict(lambda: {"orders": 0, "revenue": Decimal(0), "by_status": defaultdict(int)})
+    for bucket, status, orders, revenue in rows:
+        entry = buckets[bucket]
+        entry["by_status"][status] += orders
+        if status not in NON_REVENUE_STATUSES:
+            entry["orders"] += orders
+            entry["revenue"] += Decimal(revenue)
+    return [{"bucket": bucket, "orders": entry["orders"], "revenue": entry["revenue"],
+             "by_status": {status: count for status, count in sorted(entry["by_status"].items()) if count}}
+            for bucket, entry in sorted(buckets.items())]
+
+
+async def compact_backlog(db, limit: int = ANALYTICS_MAX_PENDING):
+    # min and max of the primary key come straight from its index; their spread bounds the pending count
+    oldest, newest = (await db.execute(select(func.min(SalesRollupDeltas.id), func.max(SalesRollupDeltas.id)))).one()
+    if oldest is not None and newest - oldest >= limit:
+        return await rollup_compactor.run_once()
+    return 0
+
+
+async def pending_deltas(db, period: str, start: datetime, end: datetime):
+    # Changes the compaction job has not folded in yet; bounded by how often it runs
+    rows = (await db.execute(
+        select(SalesRollupDeltas.bucket, SalesRollupDeltas.status, func.sum(SalesRollupDeltas.orders),
+               func.sum(SalesRollupDeltas.revenue))
+        .where(SalesRollupDeltas.bucket >= bucket_start(start, "hour"), SalesRollupDeltas.bucket < end)
+        .group_by(SalesRollupDeltas.bucket, SalesRollupDeltas.status)
+    )).all()
+    return [(bucket_start(bucket, period), status, orders, revenue or 0) for bucket, status, orders, revenue in rows]
+
+
+async def sales_series(db, period: str, start: datetime, end: datetime):
+    # Reads one rollup row per bucket and status in the range, however many orders it covers
+    start = bucket_start(start, period)
+    rows = (await db.execute(
+        select(SalesRollups.bucket, SalesRollups.status, SalesRollups.orders, SalesRollups.revenue)
+        .where(SalesRollups.period == period, SalesRollups.bucket >= start, SalesRollups.bucket < end)
+    )).all()
+    return _series([tuple(row) for row in rows] + await pending_deltas(db, period, start, end))
+
+
+async def sales_summary(db, now: datetime | None = None):
+    await compact_backlog(db)
+    now = now or utcnow()
+    today = bucket_start(now, "day")
+    daily = await sales_series(db, "day", today - timedelta(days=29), now + timedelta(hours=1))
+
+    def window(days: int):
+        since = today - timedelta(days=days - 1)
+        entries = [entry for entry in daily if entry["bucket"] >= since]
+        return {"orders": sum(entry["orders"] for entry in entries),
+                "revenue": sum((entry["revenue"] for entry in entries), Decimal(0))}
+
+    all_time = await sales_series(db, "all", ALL_TIME, now + timedelta(hours=1))
+    return {
+        "today": window(1),
+        "last_7_days": window(7),
+        "last_30_days": window(30),
+        "all_time": all_time[0] if all_time else {"orders": 0, "revenue": Decimal(0), "by_status": {}},
+    }
+
+
+async def low_stock(db, threshold: int = LOW_STOCK_THRESHOLD, limit: int = 50, cursor: tuple | None = None):
+    # Walks ix_products_available_quantity_id from the lowest quantity; the cursor is (quantity, id)
+    query = (select(Products.id, Products.product_name, Products.quantity)
+             .where(Products.available == True, Products.quantity <= threshold))
+    if cursor is not None:
+        quantity, product_id = cursor
+        query = query.where((Products.quantity > quantity)
+                            | ((Products.quantity == quantity) & (Products.id > product_id)))
+    rows = (await db.execute(query.order_by(Products.quantity, Products.id).limit(limit + 1))).mappings().all()
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = f"{items[-1]['quantity']}:{items[-1]['id']}" if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+class RollupCompactor:
+    # Folds order deltas into the rollups every `interval` seconds; several processes may run one
+    def __init__(self, session_factory=AsyncSessionLocal, interval: float = ANALYTICS_COMPACT_INTERVAL,
+                 batch_size: int = ANALYTICS_COMPACT_BATCH):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self.compacted = 0
+        self._task = None
+        self._stopping = asyncio.Event()
+
+    async def start(self):
+        if self._task is None and self.interval > 0:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping.set()
+        await self._task
+        self._task = None
+
+    async def run_once(self):
+        # Drains everything queued so far, one batch per transaction
+        total = 0
+        while True:
+            async with self.session_factory() as db:
+                claimed = await compact(db, self.batch_size)
+                await db.commit()
+            total += claimed
+            if claimed < self.batch_size:
+                break
+        self.compacted += total
+        return total
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("sales rollup compaction failed")
+
+    def stats(self):
+        return {"running": self._task is not None, "interval": self.interval, "compacted": self.compacted}
+
+
+rollup_compactor = RollupCompactor()
+
+
+async def _compact():
+    return await RollupCompactor(interval=0).run_once()
+
+
+async def _rebuild():
+    async with AsyncSessionLocal() as db:
+        rows = await db.run_sync(rebuild)
+        await db.commit()
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the sales rollups behind /admin/stats")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("compact", help="fold queued order changes into the rollups once")
+    subcommands.add_parser("rebuild", help="recompute all rollups from the orders table")
+    args = parser.parse_args()
+    if args.command == "compact":
+        print(f"compacted {asyncio.run(_compact())} changes")
+    else:
+        print(f"rebuilt {asyncio.run(_rebuild())} rollup rows")
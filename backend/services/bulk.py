@@ -0,0 +1,115 @@
+import codecs
+import csv
+import io
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "1000"))
+MAX_BULK_BATCH_SIZE = 10000
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+MAX_REPORTED_ERRORS = 1000
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+def detect_format(content_type: str | None, requested: str | None = None):
+    if requested:
+        return requested
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    return "csv" if content_type in ("text/csv", "application/csv") else "ndjson"
+
+async def iter_lines(chunks):
+    # Decodes a streamed body into lines without holding more than one partial line
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.removesuffix("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.removesuffix("\r")
+
+async def iter_ndjson(chunks):
+    # Yields (line_number, record or error message); blank lines are skipped
+    line_number = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield line_number, f"Invalid JSON: {exc}"
+            continue
+        yield line_number, record if isinstance(record, dict) else "Expected a JSON object"
+
+async def iter_csv(chunks):
+    # The first record is the header; quoted fields may span lines
+    header = None
+    record, start, line_number = "", 0, 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        if not record:
+            start = line_number
+        record = f"{record}\n{line}" if record else line
+        # RFC 4180 escapes quotes by doubling them, so an odd count means the record continues
+        if record.count('"') % 2:
+            continue
+        text, record = record, ""
+        if not text.strip():
+            continue
+        try:
+            values = next(csv.reader([text]))
+        except csv.Error as exc:
+            yield start, f"Invalid CSV: {exc}"
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+        elif len(values) != len(header):
+            yield start, f"Expected {len(header)} columns, got {len(values)}"
+        else:
+            yield start, {name: value for name, value in zip(header, values) if value != ""}
+    if record:
+        yield start, "Invalid CSV: unterminated quoted field"
+
+def iter_records(chunks, data_format: str):
+    return iter_csv(chunks) if data_format == "csv" else iter_ndjson(chunks)
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def encode_rows(rows, columns, data_format: str, header: bool = False):
+    if data_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        if header:
+            writer.writerow(columns)
+        writer.writerows([_csv_value(value) for value in row] for row in rows)
+        return buffer.getvalue()
+    return "".join(json.dumps(dict(zip(columns, row)), default=_json_default, separators=(",", ":")) + "\n"
+                   for row in rows)
+
+async def stream_export(session_factory, query, columns, data_format: str, chunk_rows: int = EXPORT_CHUNK_ROWS):
+    # Runs after the request's own session is gone, so it opens one for the life of the stream.
+    # yield_per keeps a server-side cursor open and only `chunk_rows` rows in memory at a time.
+    async with session_factory() as db:
+        result = await db.stream(query.execution_options(yield_per=chunk_rows))
+        if data_format == "csv":
+            yield encode_rows([], columns, data_format, header=True)
+        async for rows in result.partitions():
+            yield encode_rows(rows, columns, data_format)
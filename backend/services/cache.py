@@ -0,0 +1,347 @@
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import NamedTuple
+from urllib.parse import urlencode
+
+import orjson
+from decimal import Decimal
+from fastapi import Request, Response
+from fastapi.encoders import decimal_encoder, jsonable_encoder
+from pydantic_core import to_json
+from services.compression import negotiate, precompress
+from services.events import event_hub
+
+CACHE_URL = os.getenv("CACHE_URL", "memory://")
+CACHE_TTL = int(os.getenv("CACHE_TTL", "60"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+INVALIDATION_TOPIC = "cache:invalidate"
+# Caches kept in this process by name: what one worker invalidates, the others drop on hearing of it
+_local_caches = {}
+_pending = set()
+
+
+def process_id():
+    # Read on every call: pre-forked workers inherit the module from the master
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def share_invalidations(name: str, drop):
+    # `drop(**details)` is a coroutine removing this process's copies of what `details` names
+    _local_caches[name] = drop
+
+
+async def publish_invalidation(name: str, **details):
+    # Applied here before the caller responds; other workers apply it once the event reaches them
+    await _local_caches[name](**details)
+    if event_hub.shared:
+        await event_hub.publish(INVALIDATION_TOPIC, {"cache": name, "origin": process_id(), **details})
+
+
+def _invalidated_elsewhere(message: str):
+    details = json.loads(message)
+    drop = _local_caches.get(details.pop("cache"))
+    if details.pop("origin") != process_id() and drop is not None:
+        task = asyncio.get_running_loop().create_task(drop(**details))
+        _pending.add(task)
+        task.add_done_callback(_pending.discard)
+
+
+event_hub.listen(INVALIDATION_TOPIC, _invalidated_elsewhere)
+
+
+class LRUCache:
+    # Thread-safe LRU with per-entry expiry, bounded by entry count and total size
+    def __init__(self, max_entries=1024, max_bytes=None, default_ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, size=1):
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    last_modified: str | None = None
+    # (encoding, body) pairs compressed once when the entry is built
+    encodings: tuple = ()
+
+    @property
+    def size(self):
+        return len(self.body) + sum(len(encoded) for _, encoded in self.encodings)
+
+    def not_modified(self, request: Request):
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            # Weak comparison: compressed representations are sent with a W/ ETag
+            return (self.etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+                    or if_none_match.strip() == "*")
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and self.last_modified:
+            try:
+                return parsedate_to_datetime(self.last_modified) <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def to_response(self, request: Request):
+        headers = {"ETag": self.etag, "Cache-Control": "no-cache"}
+        if self.last_modified:
+            headers["Last-Modified"] = self.last_modified
+        body = self.body
+        if self.encodings:
+            headers["Vary"] = "Accept-Encoding"
+            encoding = negotiate(request.headers.get("accept-encoding"), [name for name, _ in self.encodings])
+            if encoding is not None:
+                body = dict(self.encodings)[encoding]
+                headers["Content-Encoding"] = encoding
+                headers["ETag"] = "W/" + self.etag
+        if self.not_modified(request):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.lru = LRUCache(max_entries=max_entries, max_bytes=max_bytes)
+        self._counters = {}
+
+    async def get(self, key):
+        return self.lru.get(key)
+
+    async def set(self, key, entry: CachedResponse, ttl):
+        self.lru.set(key, entry, ttl=ttl, size=entry.size)
+
+    async def delete(self, *keys):
+        self.lru.delete(*keys)
+
+    async def get_counter(self, key):
+        return self._counters.get(key, 0)
+
+    async def incr(self, key):
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+    def stats(self):
+        return self.lru.stats()
+
+
+REDIS_ENTRY_VERSION = b"v2"
+
+
+class RedisBackend:
+    # Works against any server speaking the Redis protocol; pass `client` to use a stand-in
+    def __init__(self, url=None, client=None):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError as exc:
+                raise RuntimeError("CACHE_URL points at Redis but the `redis` package is not installed") from exc
+            client = redis.from_url(url)
+        self.client = client
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        raw = await self.client.get(key)
+        # Entries written in an older layout are treated as misses and replaced
+        if raw is None or not raw.startswith(REDIS_ENTRY_VERSION):
+            self.misses += 1
+            return None
+        self.hits += 1
+        _, etag, last_modified, sizes, payload = raw.split(b"\n", 4)
+        encodings, offset = [], 0
+        for item in filter(None, sizes.decode().split(",")):
+            encoding, _, size = item.partition("=")
+            encodings.append((encoding, payload[offset:offset + int(size)]))
+            offset += int(size)
+        return CachedResponse(payload[offset:], etag.decode(), last_modified.decode() or None, tuple(encodings))
+
+    async def set(self, key, entry: CachedResponse, ttl):
+        # Header lines, then the compressed variants back to back, then the plain body
+        sizes = ",".join(f"{encoding}={len(encoded)}" for encoding, encoded in entry.encodings)
+        raw = b"\n".join([REDIS_ENTRY_VERSION, entry.etag.encode(), (entry.last_modified or "").encode(),
+                          sizes.encode(), b"".join(encoded for _, encoded in entry.encodings) + entry.body])
+        await self.client.set(key, raw, ex=ttl)
+
+    async def delete(self, *keys):
+        if keys:
+            await self.client.delete(*keys)
+
+    async def get_counter(self, key):
+        value = await self.client.get(key)
+        return int(value) if value is not None else 0
+
+    async def incr(self, key):
+        return await self.client.incr(key)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl=CACHE_TTL, name: str = "responses"):
+        self.backend = backend
+        self.ttl = ttl
+        self.name = name
+        # A memory backend is one copy per worker, so invalidations go to every worker
+        self.local = isinstance(backend, MemoryBackend)
+        if self.local:
+            share_invalidations(name, self.drop)
+
+    @classmethod
+    def from_url(cls, url=CACHE_URL, ttl=CACHE_TTL):
+        if url.startswith(("redis://", "rediss://", "unix://")):
+            return cls(RedisBackend(url), ttl=ttl)
+        return cls(MemoryBackend(), ttl=ttl)
+
+    def item_key(self, namespace: str, item_id):
+        return f"{namespace}:item:{item_id}"
+
+    async def list_key(self, namespace: str, request: Request):
+        # List keys embed a namespace version so one increment retires every cached page
+        version = await self.backend.get_counter(f"{namespace}:list:version")
+        query = urlencode(sorted(request.query_params.multi_items()))
+        return f"{namespace}:list:v{version}:{query}"
+
+    def generation_key(self, key: str):
+        return f"{key}:generation"
+
+    async def respond(self, request: Request, key: str, loader, model=None):
+        # `model` is the route's Pydantic response model; without one the payload must be plain data
+        entry = await self.backend.get(key)
+        if entry is None:
+            # An invalidation while the loader runs bumps the generation: what the loader read may predate
+            # that write, so it is served this once but not stored
+            generation = await self.backend.get_counter(self.generation_key(key))
+            payload, last_modified = await loader()
+            entry = build_entry(payload, last_modified, model)
+            if await self.backend.get_counter(self.generation_key(key)) == generation:
+                await self.backend.set(key, entry, self.ttl)
+        return entry.to_response(request)
+
+    async def invalidate(self, namespace: str, item_id=None):
+        await self._invalidate(namespace=namespace, item_ids=[] if item_id is None else [item_id], lists=True)
+
+    async def invalidate_items(self, namespace: str, item_ids):
+        # Only the per-item entries; cached lists of the namespace stay valid
+        item_ids = list(item_ids)
+        if item_ids:
+            await self._invalidate(namespace=namespace, item_ids=item_ids)
+
+    async def _invalidate(self, **details):
+        if self.local:
+            await publish_invalidation(self.name, **details)
+        else:
+            await self.drop(**details)
+
+    async def drop(self, namespace: str, item_ids=(), lists: bool = False):
+        keys = [self.item_key(namespace, item_id) for item_id in item_ids]
+        # Generations first: a fill that checked before the bump is removed by the delete after it
+        for key in keys:
+            await self.backend.incr(self.generation_key(key))
+        if keys:
+            await self.backend.delete(*keys)
+        if lists:
+            await self.backend.incr(f"{namespace}:list:version")
+
+    def stats(self):
+        return self.backend.stats()
+
+
+def http_date(value: datetime | None):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+
+def json_default(value):
+    # What orjson cannot serialize natively, encoded the way FastAPI would
+    if isinstance(value, Decimal):
+        return decimal_encoder(value)
+    return jsonable_encoder(value)
+
+
+def serialize(payload, model=None):
+    if model is not None:
+        # Validated from ORM attributes and dumped by pydantic-core, with no jsonable_encoder pass
+        return to_json(model.model_validate(payload, from_attributes=True))
+    return orjson.dumps(payload, default=json_default)
+
+
+def build_entry(payload, last_modified: datetime | None = None, model=None):
+    body = serialize(payload, model)
+    etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+    return CachedResponse(body, etag, http_date(last_modified), precompress(body))
+
+
+response_cache = ResponseCache.from_url()
@@ -0,0 +1,271 @@
+import asyncio
+import json
+import os
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.engine import make_url
+
+EVENTS_URL = os.getenv("EVENTS_URL", "memory://")
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "32"))
+EVENT_HEARTBEAT = float(os.getenv("EVENT_HEARTBEAT", "15"))
+EVENT_CHANNEL_PREFIX = "events:"
+# The one NOTIFY channel on Postgres; payloads are "<topic>\n<message>"
+PG_EVENT_CHANNEL = "events"
+
+# Put in place of the backlog when a subscriber falls too far behind
+DROPPED = object()
+
+
+class SlowConsumer(Exception):
+    pass
+
+
+class Subscription:
+    # One per open connection, so kept as small as possible
+    __slots__ = ("topics", "queue")
+
+    def __init__(self, topics, queue_size: int):
+        self.topics = topics
+        self.queue = asyncio.Queue(maxsize=queue_size)
+
+    async def get(self, timeout: float | None = None):
+        # Returns an encoded event, None when `timeout` passes quietly, or raises SlowConsumer
+        try:
+            message = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if message is DROPPED:
+            raise SlowConsumer()
+        return message
+
+
+class MemoryBroker:
+    # Single process: publishing is local delivery
+    async def start(self, deliver):
+        self.deliver = deliver
+
+    async def publish(self, topic: str, message: str):
+        self.deliver(topic, message)
+
+    async def stop(self):
+        pass
+
+
+class RedisBroker:
+    # Every worker publishes to and listens on Redis, so a subscriber sees events from all workers
+    def __init__(self, url=None, client=None):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError as exc:
+                raise RuntimeError("EVENTS_URL points at Redis but the `redis` package is not installed") from exc
+            client = redis.from_url(url)
+        self.client = client
+        self._listener = None
+
+    async def start(self, deliver):
+        self.deliver = deliver
+        self._pubsub = self.client.pubsub()
+        await self._pubsub.psubscribe(f"{EVENT_CHANNEL_PREFIX}*")
+        self._listener = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        async for message in self._pubsub.listen():
+            if message["type"] != "pmessage":
+                continue
+            channel = message["channel"].decode() if isinstance(message["channel"], bytes) else message["channel"]
+            data = message["data"].decode() if isinstance(message["data"], bytes) else message["data"]
+            self.deliver(channel.removeprefix(EVENT_CHANNEL_PREFIX), data)
+
+    async def publish(self, topic: str, message: str):
+        await self.client.publish(f"{EVENT_CHANNEL_PREFIX}{topic}", message)
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await self._pubsub.aclose()
+            self._listener = None
+
+
+class PostgresBroker:
+    # LISTEN/NOTIFY, usually on the app's own database: events shared between workers without Redis.
+    # Postgres caps a payload at 8000 bytes, which order and notification events stay well under
+    def __init__(self, url: str):
+        self.dsn = make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self._connection = None
+        self._lock = asyncio.Lock()
+
+    async def start(self, deliver):
+        try:
+            import asyncpg
+        except ImportError as exc:
+            raise RuntimeError("EVENTS_URL points at Postgres but the `asyncpg` package is not installed") from exc
+        self.deliver = deliver
+        self._connection = await asyncpg.connect(self.dsn)
+        await self._connection.add_listener(PG_EVENT_CHANNEL, self._notified)
+
+    def _notified(self, connection, pid, channel, payload):
+        topic, _, message = payload.partition("\n")
+        self.deliver(topic, message)
+
+    async def publish(self, topic: str, message: str):
+        # One connection serves both directions; asyncpg runs one query on it at a time
+        async with self._lock:
+            await self._connection.execute("SELECT pg_notify($1, $2)", PG_EVENT_CHANNEL, f"{topic}\n{message}")
+
+    async def stop(self):
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+
+
+class EventHub:
+    def __init__(self, broker, queue_size: int = EVENT_QUEUE_SIZE):
+        self.broker = broker
+        self.queue_size = queue_size
+        self._topics = {}
+        self._listeners = {}
+        self._started = False
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_url(cls, url=EVENTS_URL, queue_size: int = EVENT_QUEUE_SIZE):
+        if url.startswith(("redis://", "rediss://", "unix://")):
+            return cls(RedisBroker(url), queue_size=queue_size)
+        if url.startswith(("postgresql://", "postgresql+", "postgres://")):
+            return cls(PostgresBroker(url), queue_size=queue_size)
+        return cls(MemoryBroker(), queue_size=queue_size)
+
+    @property
+    def shared(self):
+        # Whether events published here reach the other workers
+        return not isinstance(self.broker, MemoryBroker)
+
+    async def start(self):
+        if not self._started:
+            await self.broker.start(self.deliver)
+            self._started = True
+
+    async def stop(self):
+        if self._started:
+            await self.broker.stop()
+            self._started = False
+
+    def subscribe(self, *topics: str):
+        subscription = Subscription(topics, self.queue_size)
+        for topic in topics:
+            self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def listen(self, topic: str, callback):
+        # In-process handler called with every encoded message on `topic`, whichever worker published it
+        self._listeners.setdefault(topic, []).append(callback)
+
+    def unsubscribe(self, subscription: Subscription):
+        for topic in subscription.topics:
+            subscribers = self._topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._topics[topic]
+
+    async def publish(self, topic: str, event: dict):
+        # Encoded once here; every subscriber on every worker gets the same string
+        await self.start()
+        self.published += 1
+        await self.broker.publish(topic, json.dumps(jsonable_encoder(event), separators=(",", ":")))
+
+    def deliver(self, topic: str, message: str):
+        # Never waits on a subscriber: a full queue means the consumer is cut off, not that publishing slows down
+        for callback in self._listeners.get(topic, ()):
+            callback(message)
+        for subscription in tuple(self._topics.get(topic, ())):
+            try:
+                subscription.queue.put_nowait(message)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                self.dropped += 1
+                self.unsubscribe(subscription)
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                subscription.queue.put_nowait(DROPPED)
+
+    def stats(self):
+        return {
+            "topics": len(self._topics),
+            "subscriptions": sum(len(subscribers) for subscribers in self._topics.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped_consumers": self.dropped,
+        }
+
+
+event_hub = EventHub.from_url()
+
+
+def order_topic(order_id: int):
+    return f"order:{order_id}"
+
+
+def user_orders_topic(user_id: int):
+    return f"user:{user_id}:orders"
+
+
+def user_notifications_topic(user_id: int):
+    return f"user:{user_id}:notifications"
+
+
+def sse(event: str, data: str):
+    return f"event: {event}\ndata: {data}\n\n"
+
+
+async def sse_stream(subscription: Subscription, initial: dict | None = None, heartbeat: float = EVENT_HEARTBEAT):
+    # Comment lines keep proxies from timing the stream out; a dropped consumer is told and then
+    # closed, and EventSource reconnects on its own
+    try:
+        if initial is not None:
+            yield sse("snapshot", json.dumps(jsonable_encoder(initial), separators=(",", ":")))
+        while True:
+            try:
+                message = await subscription.get(timeout=heartbeat)
+            except SlowConsumer:
+                yield sse("dropped", '{"reason":"slow consumer"}')
+                return
+            yield ": keepalive\n\n" if message is None else sse("message", message)
+    finally:
+        event_hub.unsubscribe(subscription)
+
+
+async def websocket_stream(websocket, subscription: Subscription, initial: dict | None = None,
+                           heartbeat: float = EVENT_HEARTBEAT):
+    # Reads run alongside so a client close is noticed while the connection is otherwise idle
+    receiver = asyncio.create_task(websocket.receive())
+    try:
+        if initial is not None:
+            await websocket.send_json({"event": "snapshot", "data": jsonable_encoder(initial)})
+        while True:
+            getter = asyncio.create_task(subscription.get(timeout=heartbeat))
+            done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if receiver in done:
+                if receiver.result()["type"] == "websocket.disconnect":
+                    getter.cancel()
+                    return
+                # Client messages are ignored; the channel is push-only
+                receiver = asyncio.create_task(websocket.receive())
+                if getter not in done:
+                    getter.cancel()
+                    continue
+            try:
+                message = getter.result()
+            except SlowConsumer:
+                await websocket.close(code=1013, reason="slow consumer")
+                return
+            if message is None:
+                await websocket.send_text('{"event":"keepalive"}')
+            else:
+                await websocket.send_text(f'{{"event":"message","data":{message}}}')
+    finally:
+        receiver.cancel()
+        event_hub.unsubscribe(subscription)
@@ -0,0 +1,141 @@
+import argparse
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from services.uploads import UPLOADS_ROOT, upload_url
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it uploads are served at original size only
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "80"))
+JPEG_QUALITY = int(os.getenv("JPEG_QUALITY", "85"))
+
+# Longest edge in pixels for each derivative
+VARIANTS = {"thumb": 160, "medium": 640, "large": 1280}
+IMAGE_DIRECTORIES = ("blog_images", "profile_pictures")
+SOURCE_SUFFIXES = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+DERIVATIVE_NAME = re.compile(r"\.(" + "|".join(VARIANTS) + r")\.\w+$")
+SAVE_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}
+
+def is_source_image(path: Path):
+    return path.suffix.lower() in SOURCE_SUFFIXES and not DERIVATIVE_NAME.search(path.name) \
+        and not path.name.startswith(".")
+
+def fallback_suffix(path: Path):
+    # GIF derivatives are stored as PNG (first frame); everything else keeps its format
+    suffix = path.suffix.lower()
+    return ".png" if suffix == ".gif" else suffix
+
+def variant_paths(path: Path, variant: str):
+    return (path.with_name(f"{path.stem}.{variant}{fallback_suffix(path)}"),
+            path.with_name(f"{path.stem}.{variant}.webp"))
+
+def srcset(path: Path):
+    images = {"original": upload_url(path)}
+    if Image is None:
+        return images
+    for variant in VARIANTS:
+        fallback, webp = variant_paths(path, variant)
+        images[variant] = {"src": upload_url(fallback), "webp": upload_url(webp), "max_size": VARIANTS[variant]}
+    return images
+
+def _save(image, target: Path, image_format: str):
+    temp = target.with_name(f".{target.name}.tmp")
+    options = {"quality": WEBP_QUALITY} if image_format == "WEBP" else {}
+    if image_format == "JPEG":
+        options = {"quality": JPEG_QUALITY, "optimize": True, "progressive": True}
+        image = image.convert("RGB")
+    image.save(temp, image_format, **options)
+    os.replace(temp, target)
+
+def generate_variants(path: str, force: bool = False):
+    # Runs inside a worker process
+    source = Path(path)
+    written = 0
+    with Image.open(source) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ("RGB", "RGBA"):
+            has_alpha = "A" in original.mode or "transparency" in original.info
+            original = original.convert("RGBA" if has_alpha else "RGB")
+        for variant, size in VARIANTS.items():
+            fallback, webp = variant_paths(source, variant)
+            if not force and fallback.exists() and webp.exists():
+                continue
+            resized = original.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            _save(resized, fallback, SAVE_FORMATS[fallback_suffix(source)])
+            _save(resized, webp, "WEBP")
+            written += 1
+    return written
+
+class ImagePipeline:
+    def __init__(self, workers=IMAGE_WORKERS):
+        self.workers = workers
+        self.submitted = 0
+        self.failed = 0
+        self._executor = None
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def submit(self, path: Path):
+        if not self.enabled:
+            return None
+        future = self.executor.submit(generate_variants, str(path))
+        self.submitted += 1
+        future.add_done_callback(lambda done: self._log_failure(path, done))
+        return future
+
+    def _log_failure(self, path: Path, future):
+        if not future.cancelled() and future.exception() is not None:
+            self.failed += 1
+            logger.warning("image variants failed for %s: %s", path, future.exception())
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+image_pipeline = ImagePipeline()
+
+def backfill(directories=IMAGE_DIRECTORIES, force: bool = False, workers: int = IMAGE_WORKERS):
+    sources = [path for directory in directories if (UPLOADS_ROOT / directory).is_dir()
+               for path in sorted((UPLOADS_ROOT / directory).iterdir()) if is_source_image(path)]
+    generated = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(generate_variants, str(path), force): path for path in sources}
+        for future in as_completed(futures):
+            try:
+                generated += future.result()
+            except Exception as exc:
+                failed += 1
+                print(f"failed: {futures[future]}: {exc}")
+    return {"sources": len(sources), "variants_written": generated, "failed": failed}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate resized and WebP variants for stored uploads")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subcommands.add_parser("backfill", help="process every existing upload")
+    backfill_parser.add_argument("directories", nargs="*", default=list(IMAGE_DIRECTORIES),
+                                 help="directories under the uploads root (default: %(default)s)")
+    backfill_parser.add_argument("--force", action="store_true", help="regenerate variants that already exist")
+    backfill_parser.add_argument("--workers", type=int, default=IMAGE_WORKERS)
+    args = parser.parse_args()
+    if Image is None:
+        parser.error("Pillow is not installed")
+    print(backfill(args.directories, force=args.force, workers=args.workers))
@@ -0,0 +1,295 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatchcase
+from typing import NamedTuple
+
+from fastapi.responses import JSONResponse
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL", "memory://")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# JSON list of rules shaped like DEFAULT_RATE_LIMITS; they are matched before the defaults
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+
+# In-flight requests per process before new ones are shed with 503; 0 turns shedding off
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "256"))
+SHED_RETRY_AFTER = int(os.getenv("SHED_RETRY_AFTER", "1"))
+# Long-lived streams would hold a slot for hours
+SHED_EXEMPT = ("/orders/events", "/orders/*/events")
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+# First matching rule wins; all requests matching a rule share its buckets.
+# "ip" limits key on the client address, "user" limits on the bearer token's user.
+DEFAULT_RATE_LIMITS = [
+    # Every login and registration pays for a bcrypt hash
+    {"name": "login", "methods": ["POST"], "paths": ["/auth/token"], "ip": "10/minute burst 20"},
+    {"name": "register", "methods": ["POST"], "paths": ["/auth/register"], "ip": "5/minute burst 10"},
+    {"name": "password", "methods": ["PUT"], "paths": ["/auth/change_password"], "ip": "10/minute",
+     "user": "5/minute"},
+    {"name": "uploads", "methods": ["POST"], "paths": ["/users/profile-picture", "/blogs/upload-image"],
+     "ip": "30/minute burst 10", "user": "20/minute burst 10"},
+    {"name": "writes", "methods": ["POST", "PUT", "PATCH", "DELETE"], "paths": ["*"],
+     "ip": "600/minute burst 200", "user": "300/minute burst 100"},
+]
+
+
+class Limit(NamedTuple):
+    # Tokens added per second, and how many can pile up
+    rate: float
+    burst: int
+
+
+class RateRule(NamedTuple):
+    name: str
+    methods: frozenset
+    paths: tuple
+    ip: Limit | None
+    user: Limit | None
+
+    def matches(self, method: str, path: str):
+        return (not self.methods or method in self.methods) and any(fnmatchcase(path, p) for p in self.paths)
+
+
+def parse_limit(spec: str | None):
+    # "10/minute" refills 10 tokens a minute and allows a burst of 10; "10/minute burst 30" allows 30
+    if not spec:
+        return None
+    amount, _, rest = spec.partition("/")
+    period, _, burst = rest.strip().partition(" burst ")
+    count = int(amount)
+    return Limit(count / PERIODS[period.strip().removesuffix("s")], int(burst) if burst else count)
+
+
+def parse_rules(rules):
+    return [RateRule(rule["name"], frozenset(method.upper() for method in rule.get("methods", ())),
+                     tuple(rule["paths"]), parse_limit(rule.get("ip")), parse_limit(rule.get("user")))
+            for rule in rules]
+
+
+def configured_rules(extra: str = RATE_LIMITS):
+    return parse_rules((json.loads(extra) if extra else []) + DEFAULT_RATE_LIMITS)
+
+
+def take_token(tokens: float, updated: float, now: float, limit: Limit, cost: float = 1):
+    # Returns (tokens left, seconds until the request would be allowed; 0 when it is)
+    tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / limit.rate
+
+
+class MemoryLimiterBackend:
+    # Per process: with several workers each one enforces the limit on its own share of traffic
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, limit: Limit, cost: float = 1):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (limit.burst, now))
+            tokens, retry_after = take_token(tokens, updated, now, limit, cost)
+            self._buckets[key] = (tokens, now)
+            # The least recently seen clients go first; a forgotten bucket only comes back full
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    async def refund(self, key: str, limit: Limit, cost: float = 1):
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(limit.burst, tokens + cost), updated)
+
+    def stats(self):
+        return {"keys": len(self._buckets)}
+
+
+# Refill and take in one round trip; Redis' own clock keeps workers on different hosts consistent
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - updated) * rate)
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(retry_after)
+"""
+
+# Gives back what a take removed, never beyond the burst; a bucket that expired meanwhile is full anyway
+REFUND_SCRIPT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', math.min(tonumber(ARGV[1]), tokens + tonumber(ARGV[2])))
+end
+return 0
+"""
+
+
+class RedisLimiterBackend:
+    # Shared by every worker, so a limit holds across the whole deployment
+    def __init__(self, url=None, client=None, prefix: str = "ratelimit:"):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError as exc:
+                raise RuntimeError("RATE_LIMIT_URL points at Redis but the `redis` package is not installed") from exc
+            client = redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        self._refund = client.register_script(REFUND_SCRIPT)
+
+    async def take(self, key: str, limit: Limit, cost: float = 1):
+        result = await self._script(keys=[self.prefix + key], args=[limit.rate, limit.burst, cost])
+        return float(result)
+
+    async def refund(self, key: str, limit: Limit, cost: float = 1):
+        await self._refund(keys=[self.prefix + key], args=[limit.burst, cost])
+
+    def stats(self):
+        return {}
+
+
+def limiter_backend(url: str = RATE_LIMIT_URL):
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisLimiterBackend(url)
+    return MemoryLimiterBackend()
+
+
+def bearer_token(scope):
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            return token.strip() if scheme.lower() == "bearer" else None
+    return None
+
+
+def too_many_requests(retry_after: float, detail: str, status_code: int = 429):
+    return JSONResponse({"detail": detail}, status_code=status_code,
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+class RateLimitMiddleware:
+    # `identify` maps a bearer token to a user id (or None); per-user limits are skipped without one.
+    # Client addresses come from the ASGI scope, so behind a proxy run uvicorn with --proxy-headers.
+    def __init__(self, app, identify=None, rules=None, backend=None, enabled: bool = RATE_LIMIT_ENABLED):
+        self.app = app
+        self.identify = identify
+        self.rules = configured_rules() if rules is None else rules
+        self.backend = limiter_backend() if backend is None else backend
+        self.enabled = enabled
+        self.limited = 0
+
+    def match(self, method: str, path: str):
+        for rule in self.rules:
+            if rule.matches(method, path):
+                return rule
+        return None
+
+    def user_key(self, scope):
+        token = bearer_token(scope)
+        if not token or self.identify is None:
+            return None
+        try:
+            return self.identify(token)
+        except Exception:
+            # Invalid tokens are rejected by the route itself; here they just count per IP
+            return None
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        rule = self.match(scope["method"], scope["path"])
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        checks = []
+        if rule.ip is not None and scope.get("client"):
+            checks.append((f"{rule.name}:ip:{scope['client'][0]}", rule.ip))
+        if rule.user is not None:
+            user_id = self.user_key(scope)
+            if user_id is not None:
+                checks.append((f"{rule.name}:user:{user_id}", rule.user))
+        taken = []
+        for key, limit in checks:
+            try:
+                retry_after = await self.backend.take(key, limit)
+            except Exception as exc:
+                # A limiter outage must not take the API down with it
+                logger.warning("rate limiter unavailable, letting request through: %s", exc)
+                break
+            if retry_after > 0:
+                # A rejected request costs nothing: buckets it already took from get their token back
+                await self.refund(taken)
+                self.limited += 1
+                metrics.rate_limited.inc(labels=(rule.name,))
+                await too_many_requests(retry_after, "Too many requests")(scope, receive, send)
+                return
+            taken.append((key, limit))
+        await self.app(scope, receive, send)
+
+    async def refund(self, taken):
+        for key, limit in taken:
+            try:
+                await self.backend.refund(key, limit)
+            except Exception as exc:
+                logger.warning("rate limiter unavailable, token not refunded: %s", exc)
+
+    def stats(self):
+        return {"limited": self.limited, **self.backend.stats()}
+
+
+class ConcurrencyLimitMiddleware:
+    # Sheds load instead of queueing it: past the threshold new requests get 503 straight away,
+    # so the ones already running finish in time and clients back off
+    def __init__(self, app, max_in_flight: int = MAX_IN_FLIGHT, retry_after: int = SHED_RETRY_AFTER,
+                 exempt=SHED_EXEMPT):
+        self.app = app
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.exempt = tuple(exempt)
+        self.in_flight = 0
+        self.shed = 0
+
+    async def __call__(self, scope, receive, send):
+        if (self.max_in_flight <= 0 or scope["type"] != "http"
+                or any(fnmatchcase(scope["path"], pattern) for pattern in self.exempt)):
+            await self.app(scope, receive, send)
+            return
+        if self.in_flight >= self.max_in_flight:
+            self.shed += 1
+            metrics.shed.inc()
+            await too_many_requests(self.retry_after, "Server busy, try again shortly", 503)(scope, receive, send)
+            return
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    def stats(self):
+        return {"in_flight": self.in_flight, "max_in_flight": self.max_in_flight, "shed": self.shed}
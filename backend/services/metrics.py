@@ -0,0 +1,427 @@
+import asyncio
+import bisect
+import os
+import threading
+import weakref
+from time import perf_counter
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# When set, /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Dialect methods every statement goes through, timed by instrument_engine
+EXECUTE_METHODS = ("do_execute", "do_execute_no_params", "do_executemany")
+# Observations held back and added to the histograms in one go, by the middleware and the engine wrappers;
+# a scrape adds them too
+REQUEST_BATCH = int(os.getenv("METRICS_REQUEST_BATCH", "512"))
+
+# [statements, seconds] each task ran since its request last collected them. The engine wrappers keep these,
+# so a request registers nothing: the middleware looks its task up only when _statements_run moved while it
+# ran. Registering every request (in a ContextVar or by task) cost more than the rest of the middleware.
+_task_statements = {}
+# Outermost task that started each task, whose request its statements count towards
+_parent_tasks = {}
+_statements_run = 0
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    # Label values are passed as a tuple in the order of `labelnames`
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), collect=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Optional callable returning {label values: value}, read at scrape time
+        self.collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def values(self):
+        if self.collect is not None:
+            return self.collect()
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        # One slot per bucket, stored uncumulated and summed up when scraped, then the running sum
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series[index] += 1
+            series[-1] += value
+
+    def observe_many(self, values, labels=()):
+        # Several values of one series under one lock: sorted once, then counted per bucket by bisection.
+        # Sorts `values` in place.
+        values.sort()
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            below = 0
+            for index, bound in enumerate(self.buckets):
+                upto = bisect.bisect_right(values, bound, below)
+                series[index] += upto - below
+                below = upto
+            series[-2] += len(values) - below
+            series[-1] += sum(values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((labels, list(series)) for labels, series in self._values.items())
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), series):
+                cumulative += bucket_count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Batch:
+    # Values of one histogram series held back until enough pile up or a scrape comes: appending to a list
+    # costs far less than observe() on every statement
+    def __init__(self, histogram, labels, size=REQUEST_BATCH):
+        self.histogram = histogram
+        self.labels = labels
+        self.size = size
+        self.values = []
+        self._lock = threading.Lock()
+        _batches.append(self)
+
+    def flush(self):
+        # Sync engines append from threads: only the values copied here are taken off the list
+        with self._lock:
+            values = self.values[:]
+            del self.values[:len(values)]
+        if values:
+            self.histogram.observe_many(values, self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        # Called before rendering, to add observations that are still held back
+        self.flushers = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        for flush in self.flushers:
+            flush()
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    "http_request_duration_seconds", "Time to handle a request, by route template",
+    ("method", "route", "status"))
+request_queries = registry.histogram(
+    "http_request_db_queries", "Database statements executed per request", ("method", "route"),
+    buckets=QUERY_COUNT_BUCKETS)
+request_db_seconds = registry.histogram(
+    "http_request_db_duration_seconds", "Time spent in database statements per request", ("method", "route"))
+query_duration = registry.histogram(
+    "db_query_duration_seconds", "Duration of single database statements", ("engine",), buckets=QUERY_BUCKETS)
+pool_wait = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ("engine",),
+    buckets=QUERY_BUCKETS)
+upload_bytes = registry.counter("upload_bytes_total", "Bytes of uploaded files received", ("directory",))
+uploads = registry.counter("uploads_total", "Uploaded files stored", ("directory", "deduplicated"))
+rate_limited = registry.counter("rate_limited_requests_total", "Requests rejected with 429", ("rule",))
+shed = registry.counter("shed_requests_total", "Requests rejected with 503 by the concurrency limit")
+
+_pools = {}
+_caches = {}
+_middlewares = weakref.WeakSet()
+_batches = []
+# Event loops whose task factory inherit_requests has wrapped
+_task_factory_loops = weakref.WeakSet()
+registry.flushers.append(lambda: [middleware.flush() for middleware in list(_middlewares)])
+registry.flushers.append(lambda: [batch.flush() for batch in _batches])
+
+
+def _pool_values():
+    values = {}
+    for name, engine in _pools.items():
+        pool = engine.pool
+        for state in ("size", "checkedout", "checkedin", "overflow"):
+            # Not every pool class (e.g. in-memory SQLite's) keeps these counts
+            reader = getattr(pool, state, None)
+            if reader is not None:
+                values[(name, state)] = reader()
+    return values
+
+
+def _cache_values(field: str):
+    def collect():
+        values = {}
+        for name, stats in _caches.items():
+            current = stats()
+            if field == "ratio":
+                lookups = current.get("hits", 0) + current.get("misses", 0)
+                values[(name,)] = current.get("hits", 0) / lookups if lookups else 0.0
+            elif field in current:
+                values[(name,)] = current[field]
+        return values
+    return collect
+
+
+registry.gauge("db_pool_connections", "Connections of each database pool by state", ("engine", "state"),
+               collect=_pool_values)
+registry.counter("cache_hits_total", "Cache lookups that found an entry", ("cache",), collect=_cache_values("hits"))
+registry.counter("cache_misses_total", "Cache lookups that found nothing", ("cache",),
+                 collect=_cache_values("misses"))
+registry.gauge("cache_hit_ratio", "Hits over lookups since start", ("cache",), collect=_cache_values("ratio"))
+registry.gauge("http_requests_in_flight", "Requests currently being handled",
+               collect=lambda: {(): sum(middleware.in_flight for middleware in _middlewares)})
+
+
+def register_cache(name: str, stats):
+    # `stats` returns a dict with "hits" and "misses", as LRUCache.stats() and ResponseCache.stats() do
+    _caches[name] = stats
+
+
+def _time_checkouts(engine, batch: Batch):
+    # SQLAlchemy has no event for the start of a checkout, so the pool's own getter is timed
+    pool = engine.pool
+    do_get = pool._do_get
+    waits = batch.values
+
+    def timed_do_get():
+        started = perf_counter()
+        try:
+            return do_get()
+        finally:
+            waits.append(perf_counter() - started)
+            if len(waits) >= batch.size:
+                batch.flush()
+    pool._do_get = timed_do_get
+
+
+def _timed_execute(execute, batch: Batch):
+    durations = batch.values
+
+    def timed(cursor, statement, *args):
+        global _statements_run
+        started = perf_counter()
+        result = execute(cursor, statement, *args)
+        elapsed = perf_counter() - started
+        durations.append(elapsed)
+        if len(durations) >= batch.size:
+            batch.flush()
+        # Threads have no running loop, and their statements belong to no request
+        loop = asyncio._get_running_loop()
+        task = asyncio.current_task(loop) if loop is not None else None
+        if task is not None:
+            task = _parent_tasks.get(task, task)
+            totals = _task_statements.get(task)
+            if totals is None:
+                totals = _task_statements[task] = [0, 0.0]
+                task.add_done_callback(_forget_statements)
+            totals[0] += 1
+            totals[1] += elapsed
+            _statements_run += 1
+        return result
+    return timed
+
+
+def instrument_engine(engine, name: str, enabled: bool = METRICS_ENABLED):
+    if not enabled:
+        return
+    engine = getattr(engine, "sync_engine", engine)
+    _pools[name] = engine
+    # The dialect's execute methods are wrapped rather than listened to: a single cursor event listener
+    # switches on event dispatch for every begin, execute and commit on the engine, several times the cost
+    dialect = engine.dialect
+    statements = Batch(query_duration, (name,))
+    for method in EXECUTE_METHODS:
+        setattr(dialect, method, _timed_execute(getattr(dialect, method), statements))
+
+    # dispose() swaps in a fresh pool, whose getter is timed again
+    dispose = engine.dispose
+    checkouts = Batch(pool_wait, (name,))
+
+    def dispose_and_retime(close: bool = True):
+        dispose(close)
+        _time_checkouts(engine, checkouts)
+    engine.dispose = dispose_and_retime
+
+    _time_checkouts(engine, checkouts)
+
+
+def _forget_statements(task):
+    _task_statements.pop(task, None)
+
+
+def _forget_parent(task):
+    _parent_tasks.pop(task, None)
+
+
+def inherit_requests(loop):
+    # Tasks started while handling a request (Starlette streams a response body from one) count their
+    # statements towards it; this costs on task creation, not on every request
+    if loop in _task_factory_loops:
+        return
+    _task_factory_loops.add(loop)
+    previous = loop.get_task_factory()
+
+    def task_factory(loop, coro, **kwargs):
+        task = previous(loop, coro, **kwargs) if previous is not None else asyncio.Task(coro, loop=loop, **kwargs)
+        parent = asyncio.current_task(loop)
+        if parent is not None:
+            _parent_tasks[task] = _parent_tasks.get(parent, parent)
+            task.add_done_callback(_forget_parent)
+        return task
+    loop.set_task_factory(task_factory)
+
+
+class MetricsMiddleware:
+    # Outermost, so the latency recorded is what the load balancer sees
+    def __init__(self, app, enabled: bool = METRICS_ENABLED):
+        self.app = app
+        self.enabled = enabled
+        # A plain attribute summed at scrape time; a locked gauge would cost more on every request
+        self.in_flight = 0
+        # (method, route, status, seconds, [statements, db seconds] or None) of requests not yet in the
+        # histograms
+        self.pending = []
+        _middlewares.add(self)
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            if self.enabled and scope["type"] == "lifespan":
+                inherit_requests(asyncio.get_running_loop())
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        # A closure rather than an object with __call__, which is more than twice as slow to call
+        def send_and_catch_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            # Hands back send's awaitable rather than awaiting it, which saves a coroutine per message
+            return send(message)
+
+        statements_run = _statements_run
+        self.in_flight += 1
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_and_catch_status)
+        finally:
+            elapsed = perf_counter() - started
+            self.in_flight -= 1
+            # Unchanged means no statement ran anywhere meanwhile, this request's included
+            totals = (_task_statements.pop(asyncio.current_task(), None)
+                      if _statements_run != statements_run else None)
+            self.pending.append((scope["method"], scope.get("route"), status, elapsed, totals))
+            if len(self.pending) >= REQUEST_BATCH:
+                self.flush()
+
+    def flush(self):
+        # Requests and scrapes both run on the event loop, so swapping the list needs no lock
+        pending, self.pending = self.pending, []
+        durations, statements = {}, []
+        for method, route, status, seconds, totals in pending:
+            # Templates, not raw paths, keep the number of series bounded
+            route = route.path if route is not None else "unmatched"
+            series = durations.get((method, route, status))
+            if series is None:
+                series = durations[(method, route, status)] = []
+            series.append(seconds)
+            if totals is not None:
+                statements.append((method, route, totals))
+        requests = {}
+        for labels, seconds in durations.items():
+            requests[labels[:2]] = requests.get(labels[:2], 0) + len(seconds)
+            request_duration.observe_many(seconds, labels)
+        queries, db_seconds = {}, {}
+        for method, route, (count, seconds) in statements:
+            queries.setdefault((method, route), []).append(count)
+            db_seconds.setdefault((method, route), []).append(seconds)
+        # Requests without statements are only counted, and go in as zeros here
+        for labels, count in requests.items():
+            counts = queries.get(labels, [])
+            request_queries.observe_many([0] * (count - len(counts)) + counts, labels)
+            request_db_seconds.observe_many([0.0] * (count - len(counts)) + db_seconds.get(labels, []), labels)
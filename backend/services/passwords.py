@@ -0,0 +1,77 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "64"))
+
+# Hashes made with a different cost are reported by needs_update and upgraded on login
+bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+# Module-level so they can be pickled into a process pool
+def hash_password(password: str):
+    return bcrypt_context.hash(password)
+
+def verify_password(password: str, hashed_password: str):
+    return bcrypt_context.verify(password, hashed_password)
+
+def verify_and_update_password(password: str, hashed_password: str):
+    return bcrypt_context.verify_and_update(password, hashed_password)
+
+
+class PasswordHasher:
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_QUEUE, executor=PASSWORD_HASH_EXECUTOR):
+        self.workers = workers
+        self.max_pending = max(max_pending, workers)
+        self.executor_kind = executor
+        self.pending = 0
+        self.rejected = 0
+        self._executor = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                # bcrypt releases the GIL, so threads scale across cores too
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def run(self, fn, *args):
+        # Only touched from the event loop thread, so the counter needs no lock
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=503,
+                                detail="Too many password operations in progress, try again shortly",
+                                headers={"Retry-After": "1"})
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str):
+        return await self.run(hash_password, password)
+
+    async def verify(self, password: str, hashed_password: str):
+        return await self.run(verify_password, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str):
+        return await self.run(verify_and_update_password, password, hashed_password)
+
+    def stats(self):
+        return {"pending": self.pending, "rejected": self.rejected, "max_pending": self.max_pending}
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher()
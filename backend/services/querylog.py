@@ -0,0 +1,195 @@
+import json
+import logging
+import os
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import NamedTuple
+
+from sqlalchemy import event
+
+# Off by default: every statement is recorded and slow ones are explained, which costs a round trip each
+QUERY_DIAGNOSTICS = os.getenv("QUERY_DIAGNOSTICS", "0") == "1"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "50"))
+# The same statement shape this many times in one request is reported as N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "3"))
+# One JSON object per request; without a path the records go through the logging setup of the process
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", "")
+
+logger = logging.getLogger(__name__)
+
+# Statements of the request being handled; None outside requests
+current_trace = ContextVar("query_trace", default=None)
+# Traces opened by assert_query_budget around the current code: the task or thread that opened them and
+# what it awaits, but not background workers polling on their own
+current_budgets = ContextVar("query_budgets", default=())
+_watched = set()
+
+PLACEHOLDER_LIST = re.compile(r"\(\s*(?:\?|%s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%s|\$\d+|:\w+))*\s*\)")
+LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str):
+    # Bound parameters already hide the values; IN lists of any length and inlined literals are folded too
+    shape = LITERAL.sub("?", WHITESPACE.sub(" ", statement).strip())
+    return PLACEHOLDER_LIST.sub("(?)", shape)
+
+
+class Statement(NamedTuple):
+    sql: str
+    shape: str
+    ms: float
+    plan: list | None
+
+
+class QueryTrace:
+    def __init__(self):
+        self.statements = []
+
+    def add(self, statement: Statement):
+        self.statements.append(statement)
+
+    @property
+    def total_ms(self):
+        return sum(statement.ms for statement in self.statements)
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD):
+        counts = Counter(statement.shape for statement in self.statements)
+        return [{"shape": shape, "count": count,
+                 "ms": round(sum(s.ms for s in self.statements if s.shape == shape), 3)}
+                for shape, count in counts.most_common() if count >= threshold]
+
+    def slow(self, slow_ms: float = SLOW_QUERY_MS):
+        return [statement for statement in self.statements if statement.ms >= slow_ms]
+
+    def to_dict(self):
+        return {
+            "queries": len(self.statements),
+            "db_ms": round(self.total_ms, 3),
+            "statements": [{"sql": s.sql, "ms": round(s.ms, 3), **({"plan": s.plan} if s.plan else {})}
+                           for s in self.statements],
+            "slow": len(self.slow()),
+            "n_plus_one": self.repeated(),
+        }
+
+
+def explain(conn, statement: str, parameters):
+    # Runs on a raw cursor of the same connection, so it sees the same transaction and fires no events
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        # SQLite returns (id, parent, notused, detail); Postgres one line of text per row
+        return [str(row[-1]) for row in cursor.fetchall()]
+    except Exception as exc:
+        return [f"EXPLAIN failed: {exc}"]
+    finally:
+        cursor.close()
+
+
+def watch_engine(engine, slow_ms: float = SLOW_QUERY_MS):
+    engine = getattr(engine, "sync_engine", engine)
+    if engine in _watched:
+        return
+    _watched.add(engine)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_statement(conn, cursor, statement, parameters, context, executemany):
+        context._querylog_started = perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def record_statement(conn, cursor, statement, parameters, context, executemany):
+        trace = current_trace.get()
+        budgets = current_budgets.get()
+        if trace is None and not budgets:
+            return
+        # None for a statement that was already running when the listeners were attached
+        started = getattr(context, "_querylog_started", None)
+        if started is None:
+            return
+        elapsed_ms = (perf_counter() - started) * 1000
+        plan = explain(conn, statement, parameters) if elapsed_ms >= slow_ms and not executemany else None
+        entry = Statement(statement, statement_shape(statement), elapsed_ms, plan)
+        if trace is not None:
+            trace.add(entry)
+        for budget in budgets:
+            budget.add(entry)
+
+
+def watch_sessions(*factories):
+    # Session factories share their engine's connections, so the listeners go on the bound engines
+    for factory in factories:
+        watch_engine(factory.kw["bind"])
+
+
+def enable_query_diagnostics(*factories, path: str = QUERY_LOG_PATH):
+    watch_sessions(*factories)
+    logger.setLevel(logging.INFO)
+    if path and not logger.handlers:
+        handler = logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+
+
+class QueryLogMiddleware:
+    # Logs every request's statements as one JSON object; a warning when it has slow or repeated ones
+    def __init__(self, app, enabled: bool = QUERY_DIAGNOSTICS):
+        self.app = app
+        self.enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        trace = QueryTrace()
+        token = current_trace.set(trace)
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_trace.reset(token)
+            route = scope.get("route")
+            record = {"method": scope["method"], "path": scope["path"],
+                      "route": route.path if route is not None else None, "status": status,
+                      "duration_ms": round((perf_counter() - started) * 1000, 3), **trace.to_dict()}
+            level = logging.WARNING if record["slow"] or record["n_plus_one"] else logging.INFO
+            logger.log(level, json.dumps(record, default=str))
+
+
+@contextmanager
+def assert_query_budget(max_queries: int, allow_repeats: bool = False, factories=None):
+    # For tests and scripts (benchmarks/query_budgets.py): fails when the block runs more statements than
+    # the budget, or (unless allowed) the same statement shape N_PLUS_ONE_THRESHOLD times. Only statements
+    # run from this context count, so call the app in-process (httpx.ASGITransport) rather than on a thread
+    if factories is None:
+        from settings.database import AsyncReadSessionLocal, AsyncSessionLocal, SessionLocal
+        factories = (SessionLocal, AsyncSessionLocal, AsyncReadSessionLocal)
+    watch_sessions(*factories)
+    trace = QueryTrace()
+    token = current_budgets.set(current_budgets.get() + (trace,))
+    try:
+        yield trace
+    finally:
+        current_budgets.reset(token)
+
+    problems = []
+    if len(trace.statements) > max_queries:
+        problems.append(f"{len(trace.statements)} statements, budget is {max_queries}")
+    if not allow_repeats:
+        problems += [f"N+1: {item['count']}x {item['shape']}" for item in trace.repeated()]
+    if problems:
+        listing = "\n".join(f"  {s.ms:8.3f} ms  {s.sql}" for s in trace.statements)
+        raise AssertionError("; ".join(problems) + "\n" + listing)
@@ -0,0 +1,131 @@
+import os
+import re
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.search import PG_SEARCH_COLUMN, PG_TS_CONFIG, search_document
+
+SEARCH_FACET_SAMPLE = int(os.getenv("SEARCH_FACET_SAMPLE", "2000"))
+
+# bm25 column weights: a hit in a title outranks one in the body
+BLOG_WEIGHTS = (10.0, 4.0, 1.0, 6.0)  # title, description, content, tags
+PRODUCT_WEIGHTS = (10.0, 2.0)  # product_name, description
+SNIPPET_TOKENS = 12
+SNIPPET_OPTIONS = (f"StartSel=<mark>, StopSel=</mark>, MaxWords={SNIPPET_TOKENS}, MinWords=4, ShortWord=0, "
+                   "MaxFragments=1, FragmentDelimiter=…")
+
+# SQLite searches its FTS5 tables, Postgres the indexed tsvector column of models.search
+SEARCH_DIALECTS = ("sqlite", "postgresql")
+PG_MATCH = f"{PG_SEARCH_COLUMN} @@ to_tsquery('{PG_TS_CONFIG}', :match)"
+
+SEARCH_KINDS = {
+    "blog": {
+        "fts": "blogs_fts", "source": "blogs", "title": "title", "weights": BLOG_WEIGHTS,
+    },
+    "product": {
+        "fts": "products_fts", "source": "products", "title": "product_name", "weights": PRODUCT_WEIGHTS,
+    },
+}
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+
+def match_expression(query: str, prefix: bool = True):
+    # User input never reaches FTS5 syntax: every word becomes a quoted phrase, all of them required
+    terms = TOKEN.findall(query.lower())
+    if not terms:
+        return None
+    phrases = [f'"{term}"' for term in terms]
+    if prefix:
+        phrases[-1] += "*"
+    return " ".join(phrases)
+
+def tsquery_expression(query: str, prefix: bool = True):
+    # The same rules for Postgres; \w+ words carry none of the tsquery operators
+    terms = TOKEN.findall(query.lower())
+    if not terms:
+        return None
+    if prefix:
+        terms[-1] += ":*"
+    return " & ".join(terms)
+
+def is_postgres(db: AsyncSession):
+    return db.bind.dialect.name == "postgresql"
+
+def _ranked_select(kind: str):
+    spec = SEARCH_KINDS[kind]
+    weights = ", ".join(str(weight) for weight in spec["weights"])
+    return (f"SELECT '{kind}' AS type, rowid AS id, bm25({spec['fts']}, {weights}) AS score "
+            f"FROM {spec['fts']} WHERE {spec['fts']} MATCH :match")
+
+def _pg_ranked_select(kind: str):
+    source = SEARCH_KINDS[kind]["source"]
+    return (f"SELECT '{kind}' AS type, id, ts_rank({PG_SEARCH_COLUMN}, to_tsquery('{PG_TS_CONFIG}', :match)) "
+            f"AS score FROM {source} WHERE {PG_MATCH}")
+
+async def _pg_load_hits(db: AsyncSession, kind: str, match: str, ids: list):
+    spec = SEARCH_KINDS[kind]
+    statement = text(
+        f"SELECT id, {spec['title']} AS title, ts_headline('{PG_TS_CONFIG}', {search_document(spec['source'])}, "
+        f"to_tsquery('{PG_TS_CONFIG}', :match), :options) AS snippet FROM {spec['source']} WHERE id IN :ids"
+    ).bindparams(bindparam("ids", expanding=True))
+    rows = (await db.execute(statement, {"match": match, "options": SNIPPET_OPTIONS, "ids": ids})).mappings().all()
+    return {row["id"]: row for row in rows}
+
+async def _load_hits(db: AsyncSession, kind: str, match: str, ids: list):
+    # Snippets are only built for the page being returned, not for every match;
+    # column -1 lets FTS5 pick the column with the best hit
+    spec = SEARCH_KINDS[kind]
+    statement = text(
+        f"SELECT {spec['fts']}.rowid AS id, s.{spec['title']} AS title, "
+        f"snippet({spec['fts']}, -1, '<mark>', '</mark>', '…', {SNIPPET_TOKENS}) AS snippet "
+        f"FROM {spec['fts']} JOIN {spec['source']} s ON s.id = {spec['fts']}.rowid "
+        f"WHERE {spec['fts']} MATCH :match AND {spec['fts']}.rowid IN :ids"
+    ).bindparams(bindparam("ids", expanding=True))
+    rows = (await db.execute(statement, {"match": match, "ids": ids})).mappings().all()
+    return {row["id"]: row for row in rows}
+
+async def search(db: AsyncSession, query: str, kinds=tuple(SEARCH_KINDS), limit: int = 20, offset: int = 0,
+                 prefix: bool = True):
+    postgres = is_postgres(db)
+    match = (tsquery_expression if postgres else match_expression)(query, prefix)
+    if match is None:
+        return {"items": [], "next_offset": None}
+
+    ranked = " UNION ALL ".join((_pg_ranked_select if postgres else _ranked_select)(kind) for kind in kinds)
+    # bm25 is lower-is-better, ts_rank higher-is-better; fetch one extra row to know whether another page exists
+    order = "score DESC, type, id" if postgres else "score"
+    rows = (await db.execute(text(f"SELECT type, id, score FROM ({ranked}) AS ranked ORDER BY {order} "
+                                  f"LIMIT :limit OFFSET :offset"),
+                             {"match": match, "limit": limit + 1, "offset": offset})).all()
+    page = rows[:limit]
+
+    details = {}
+    for kind in kinds:
+        ids = [row.id for row in page if row.type == kind]
+        if ids:
+            details[kind] = await (_pg_load_hits if postgres else _load_hits)(db, kind, match, ids)
+
+    items = []
+    for row in page:
+        hit = details[row.type].get(row.id)
+        if hit is not None:
+            items.append({"type": row.type, "id": row.id, "title": hit["title"], "snippet": hit["snippet"],
+                          "score": round(row.score if postgres else -row.score, 4)})
+    return {"items": items, "next_offset": offset + limit if len(rows) > limit else None}
+
+async def tag_facets(db: AsyncSession, query: str, prefix: bool = True, size: int = 20,
+                     sample: int = SEARCH_FACET_SAMPLE):
+    postgres = is_postgres(db)
+    match = (tsquery_expression if postgres else match_expression)(query, prefix)
+    if match is None:
+        return {"tags": [], "sampled": False}
+    matches = (f"SELECT id FROM blogs WHERE {PG_MATCH}" if postgres
+               else "SELECT rowid AS id FROM blogs_fts WHERE blogs_fts MATCH :match")
+    # Exact up to `sample` matching blogs; beyond that the counts come from the first `sample` matches
+    matched = (await db.execute(text(f"SELECT count(*) FROM ({matches} LIMIT :sample) AS m"),
+                                {"match": match, "sample": sample})).scalar()
+    rows = await db.execute(text(
+        f"SELECT t.name, count(*) AS count FROM ({matches} LIMIT :sample) m "
+        "JOIN blog_tags bt ON bt.blog_id = m.id JOIN tags t ON t.id = bt.tag_id "
+        "GROUP BY t.name ORDER BY count DESC, t.name LIMIT :size"
+    ), {"match": match, "sample": sample, "size": size})
+    return {"tags": [{"tag": name, "count": count} for name, count in rows.all()], "sampled": matched >= sample}
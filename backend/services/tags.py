@@ -0,0 +1,69 @@
+import re
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.models import Blogs, BlogTags, Tags
+
+MAX_TAG_LENGTH = 50
+MAX_TAGS_PER_BLOG = 20
+WHITESPACE = re.compile(r"\s+")
+
+def parse_tags(tags: str | None):
+    # Blog tags arrive as one comma separated string; names are compared case-insensitively
+    names = (WHITESPACE.sub(" ", tag).strip().lower()[:MAX_TAG_LENGTH] for tag in (tags or "").split(","))
+    return list(dict.fromkeys(name for name in names if name))[:MAX_TAGS_PER_BLOG]
+
+def insert_ignore(dialect_name: str, table):
+    # Two writers introducing the same new tag must not fail on the unique name
+    if dialect_name == "sqlite":
+        return sqlite.insert(table).on_conflict_do_nothing()
+    if dialect_name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return insert(table)
+
+async def ensure_tags(db: AsyncSession, names):
+    if not names:
+        return {}
+    await db.execute(insert_ignore(db.bind.dialect.name, Tags.__table__), [{"name": name} for name in names])
+    rows = await db.execute(select(Tags.name, Tags.id).where(Tags.name.in_(names)))
+    return dict(rows.all())
+
+async def _adjust_counts(db: AsyncSession, tag_ids, delta: int):
+    if tag_ids:
+        await db.execute(update(Tags).where(Tags.id.in_(tag_ids)).values(blog_count=Tags.blog_count + delta))
+
+async def set_blog_tags(db: AsyncSession, blog: Blogs, tags: str | None):
+    # Applies only the difference, inside the caller's transaction
+    wanted = await ensure_tags(db, parse_tags(tags))
+    current = set((await db.execute(select(BlogTags.tag_id).where(BlogTags.blog_id == blog.id))).scalars().all())
+    added = set(wanted.values()) - current
+    removed = current - set(wanted.values())
+    if removed:
+        await db.execute(delete(BlogTags).where(BlogTags.blog_id == blog.id, BlogTags.tag_id.in_(removed)))
+    if added:
+        await db.execute(insert(BlogTags), [{"blog_id": blog.id, "tag_id": tag_id, "blog_created_at": blog.created_at}
+                                            for tag_id in added])
+    await _adjust_counts(db, removed, -1)
+    await _adjust_counts(db, added, 1)
+    return bool(added or removed)
+
+async def clear_blog_tags(db: AsyncSession, blog_id: int):
+    tag_ids = (await db.execute(delete(BlogTags).where(BlogTags.blog_id == blog_id)
+                                .returning(BlogTags.tag_id))).scalars().all()
+    await _adjust_counts(db, tag_ids, -1)
+
+def backfill_blog_tags(connection):
+    # One-off migration: parse every stored tag string into tags/blog_tags
+    blogs = connection.execute(select(Blogs.id, Blogs.tags, Blogs.created_at)).all()
+    parsed = {blog.id: (parse_tags(blog.tags), blog.created_at) for blog in blogs}
+    names = sorted({name for tags, _ in parsed.values() for name in tags})
+    if names:
+        connection.execute(insert_ignore(connection.dialect.name, Tags.__table__), [{"name": name} for name in names])
+    tag_ids = dict(connection.execute(select(Tags.name, Tags.id)).all())
+    links = [{"blog_id": blog_id, "tag_id": tag_ids[name], "blog_created_at": created_at}
+             for blog_id, (tags, created_at) in parsed.items() for name in tags]
+    if links:
+        connection.execute(insert(BlogTags), links)
+    counts = select(func.count()).where(BlogTags.tag_id == Tags.id).scalar_subquery()
+    connection.execute(update(Tags).values(blog_count=counts))
+    return {"blogs": len(blogs), "tags": len(names), "links": len(links)}
@@ -0,0 +1,135 @@
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import NamedTuple
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from services import metrics
+
+UPLOADS_ROOT = Path(os.getenv("UPLOADS_DIR", "uploads"))
+UPLOADS_URL = "/uploads"
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Room for multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 16 * 1024
+
+IMAGE_TYPES = {
+    "image/jpeg": "jpg",
+    "image/png": "png",
+    "image/gif": "gif",
+    "image/webp": "webp",
+}
+
+class StoredUpload(NamedTuple):
+    path: Path
+    url: str
+    content_type: str
+    size: int
+    sha256: str
+    deduplicated: bool
+
+def sniff_image(head: bytes):
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+def upload_url(path: Path):
+    return f"{UPLOADS_URL}/{path.relative_to(UPLOADS_ROOT).as_posix()}"
+
+def too_large(max_bytes: int):
+    return HTTPException(status_code=413, detail=f"File too large. Maximum size is {max_bytes // (1024 * 1024)} MB.")
+
+class UploadLimitMiddleware:
+    # Multipart bodies are spooled before a handler runs, so the cap has to sit in front of the app
+    def __init__(self, app, paths, max_bytes: int = UPLOAD_MAX_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_body = max_bytes + MULTIPART_OVERHEAD
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_body:
+            response = JSONResponse({"detail": too_large(self.max_bytes).detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    raise too_large(self.max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+def _open_temp(directory: Path):
+    directory.mkdir(parents=True, exist_ok=True)
+    return tempfile.NamedTemporaryFile(dir=directory, prefix=".upload-", delete=False)
+
+def _finalize(temp_path: Path, final_path: Path):
+    # Identical content already stored: drop the new copy instead of writing it twice
+    if final_path.exists():
+        temp_path.unlink()
+        return True
+    os.replace(temp_path, final_path)
+    return False
+
+def _discard(temp_path: Path):
+    try:
+        temp_path.unlink()
+    except FileNotFoundError:
+        pass
+
+async def store_upload(file: UploadFile, directory: str, allowed_types=tuple(IMAGE_TYPES),
+                       max_bytes: int = UPLOAD_MAX_BYTES):
+    target_dir = UPLOADS_ROOT / directory
+    temp = await run_in_threadpool(_open_temp, target_dir)
+    temp_path = Path(temp.name)
+    digest = hashlib.sha256()
+    size = 0
+    content_type = None
+    try:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            if content_type is None:
+                # The first chunk decides the type; the client's declared type is not trusted
+                content_type = sniff_image(chunk[:16])
+                if content_type not in allowed_types:
+                    raise HTTPException(status_code=400, detail="Invalid file type. Allowed: "
+                                        + ", ".join(sorted(IMAGE_TYPES[t].upper() for t in allowed_types)))
+            size += len(chunk)
+            if size > max_bytes:
+                raise too_large(max_bytes)
+            digest.update(chunk)
+            await run_in_threadpool(temp.write, chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Empty file")
+        await run_in_threadpool(temp.close)
+
+        sha256 = digest.hexdigest()
+        final_path = target_dir / f"{sha256}.{IMAGE_TYPES[content_type]}"
+        deduplicated = await run_in_threadpool(_finalize, temp_path, final_path)
+    except BaseException:
+        temp.close()
+        await run_in_threadpool(_discard, temp_path)
+        raise
+
+    metrics.upload_bytes.inc(size, (directory,))
+    metrics.uploads.inc(labels=(directory, str(deduplicated).lower()))
+    return StoredUpload(final_path, upload_url(final_path), content_type, size, sha256, deduplicated)
@@ -1,11 +1,120 @@
-from sqlalchemy import create_engine
+import os
+from typing import Annotated
+from fastapi import Depends
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from models.types import register_sqlite_functions
+from services.metrics import instrument_engine
+from services.querylog import QUERY_DIAGNOSTICS, enable_query_diagnostics
 
-SQLALCHEMY_DATABASE_URL = 'sqlite:///./storeapp.db'
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./storeapp.db")
+# GET routes read through their own pool; point this at a replica when there is one
+SQLALCHEMY_READ_DATABASE_URL = os.getenv("DATABASE_READ_URL", SQLALCHEMY_DATABASE_URL)
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={'check_same_thread': False})
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "10"))
+DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+
+# Applied to every new SQLite connection; ignored for other databases
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+def to_async_url(url: str):
+    parsed = make_url(url)
+    if parsed.drivername in ASYNC_DRIVERS:
+        parsed = parsed.set(drivername=ASYNC_DRIVERS[parsed.drivername])
+    return parsed.render_as_string(hide_password=False)
+
+def is_sqlite(url: str):
+    return make_url(url).get_backend_name() == "sqlite"
+
+def apply_sqlite_pragmas(engine, pragmas: dict, read_only: bool = False):
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            if value is not None:
+                cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+        register_sqlite_functions(dbapi_connection)
+
+def pool_options(url: str, pool_size: int, max_overflow: int):
+    # In-memory SQLite lives in a single connection and has no sized pool
+    if is_sqlite(url) and make_url(url).database in (None, "", ":memory:"):
+        return {}
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
+def create_db_engine(url: str = SQLALCHEMY_DATABASE_URL, pragmas: dict = SQLITE_PRAGMAS,
+                     pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW, read_only: bool = False):
+    connect_args = {'check_same_thread': False} if is_sqlite(url) else {}
+    engine = create_engine(url, connect_args=connect_args, **pool_options(url, pool_size, max_overflow))
+    if is_sqlite(url):
+        apply_sqlite_pragmas(engine, pragmas, read_only)
+    return engine
+
+def create_async_db_engine(url: str = SQLALCHEMY_DATABASE_URL, pragmas: dict = SQLITE_PRAGMAS,
+                           pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW, read_only: bool = False):
+    engine = create_async_engine(to_async_url(url), **pool_options(url, pool_size, max_overflow))
+    if is_sqlite(url):
+        apply_sqlite_pragmas(engine.sync_engine, pragmas, read_only)
+    return engine
+
+# Sync engine for schema management and offline scripts
+engine = create_db_engine()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-Base = declarative_base()
\ No newline at end of file
+# Async engines used by the request handlers so queries never block the event loop
+async_engine = create_async_db_engine()
+async_read_engine = create_async_db_engine(SQLALCHEMY_READ_DATABASE_URL, pool_size=DB_READ_POOL_SIZE,
+                                           max_overflow=DB_READ_MAX_OVERFLOW, read_only=True)
+
+# Query counts and timings, pool waits and pool sizes for /metrics
+instrument_engine(engine, "sync")
+instrument_engine(async_engine, "write")
+instrument_engine(async_read_engine, "read")
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
+# QUERY_DIAGNOSTICS=1 logs each request's statements, explains slow ones and flags N+1 patterns
+if QUERY_DIAGNOSTICS:
+    enable_query_diagnostics(SessionLocal, AsyncSessionLocal, AsyncReadSessionLocal)
+
+Base = declarative_base()
+
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_read_db():
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import importlib
+import logging
+import os
+from pathlib import Path
+
+from sqlalchemy import TIMESTAMP, Column, MetaData, String, Table, UniqueConstraint, func, inspect, insert, select, text
+from sqlalchemy.schema import CreateColumn
+from settings.database import async_engine, engine
+
+logger = logging.getLogger(__name__)
+
+# Apply pending migrations when the app starts; with 0 it refuses to start until
+# `python -m settings.migrations upgrade` has run
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") != "0"
+
+# One module per version, applied in file name order: migrations/NNNN_name.py with upgrade(connection)
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
+# Any fixed key works as long as every process uses the same one
+POSTGRES_LOCK_ID = 4_270_025
+
+version_table = Table(
+    "schema_migrations", MetaData(),
+    Column("version", String, primary_key=True),
+    Column("applied_at", TIMESTAMP, server_default=func.now()),
+)
+
+
+class SchemaOutOfDate(RuntimeError):
+    def __init__(self, missing):
+        super().__init__(f"database schema is missing migrations {', '.join(missing)}; "
+                         "run `python -m settings.migrations upgrade`")
+        self.missing = missing
+
+
+def available():
+    # Read from the file names, so checking the version imports no migration code
+    return sorted(path.stem for path in MIGRATIONS_DIR.glob("[0-9]*.py"))
+
+
+def applied(connection):
+    if not inspect(connection).has_table(version_table.name):
+        return set()
+    return set(connection.execute(select(version_table.c.version)).scalars())
+
+
+def pending(connection):
+    done = applied(connection)
+    return [version for version in available() if version not in done]
+
+
+def lock(connection):
+    # Held until commit, so concurrently starting processes migrate one after another
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": POSTGRES_LOCK_ID})
+    elif connection.dialect.name == "sqlite":
+        # pysqlite defers BEGIN to the first write, and DDL does not count as one
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def upgrade(bind=None):
+    # Every pending migration runs in one transaction with its version row
+    with (bind or engine).connect() as connection:
+        with connection.begin():
+            lock(connection)
+            version_table.create(connection, checkfirst=True)
+            versions = pending(connection)
+            for version in versions:
+                logger.info("applying migration %s", version)
+                importlib.import_module(f"migrations.{version}").upgrade(connection)
+                connection.execute(insert(version_table).values(version=version))
+    return versions
+
+
+def ensure_schema(bind=None, migrate: bool = MIGRATE_ON_STARTUP):
+    if migrate:
+        return upgrade(bind)
+    with (bind or engine).connect() as connection:
+        missing = pending(connection)
+    if missing:
+        raise SchemaOutOfDate(missing)
+    return []
+
+
+async def check_schema(bind=None, migrate: bool = MIGRATE_ON_STARTUP):
+    # Startup fast path: one look at the version table over the request pool
+    async with (bind or async_engine).connect() as connection:
+        missing = await connection.run_sync(pending)
+    if not missing:
+        return []
+    if not migrate:
+        raise SchemaOutOfDate(missing)
+    return await asyncio.to_thread(upgrade)
+
+
+# Helpers for migrations that bring tables made by an older create_all up to date
+
+def add_missing_columns(connection, table: Table):
+    present = {column["name"] for column in inspect(connection).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in present:
+            definition = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+
+
+def create_missing_indexes(connection, table: Table):
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def add_missing_unique_constraints(connection, table: Table):
+    # As unique indexes, which enforce the same: SQLite cannot add a constraint to an existing table
+    inspector = inspect(connection)
+    present = {tuple(constraint["column_names"]) for constraint in inspector.get_unique_constraints(table.name)}
+    present |= {tuple(index["column_names"]) for index in inspector.get_indexes(table.name) if index["unique"]}
+    for constraint in table.constraints:
+        columns = tuple(column.name for column in constraint.columns)
+        if isinstance(constraint, UniqueConstraint) and columns not in present:
+            name = constraint.name or f"uq_{table.name}_{'_'.join(columns)}"
+            connection.execute(text(f"CREATE UNIQUE INDEX {name} ON {table.name} ({', '.join(columns)})"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply and inspect database schema migrations")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("upgrade", help="apply every pending migration")
+    subcommands.add_parser("status", help="list applied and pending migrations")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.command == "upgrade":
+        versions = upgrade()
+        print(f"applied {len(versions)} migrations" + (f": {', '.join(versions)}" if versions else ""))
+    else:
+        with engine.connect() as connection:
+            done = applied(connection)
+        for version in available():
+            print(f"{'applied' if version in done else 'pending'}  {version}")